@@ -1,94 +1,99 @@
 import os, sys
+import functools
 import random
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, jsonify, request, send_file, Response, stream_with_context
 from flask_cors import CORS
-from dotenv import load_dotenv
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils import save_base64_image, logger_setup, get_mimetype, sample_frames
+from utils import save_base64_image, get_mimetype
+from utils import save_image_stream, save_video_stream
 from config import *
 from llm import Storyteller
-
-load_dotenv()
+from services import *
+from speculation import SpeculativeJob
 
 # Specify the static folder path
 app = Flask(__name__)
 CORS(app)
 
 
-# Get the environment variables
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-OPENAI_ORG_ID = os.environ.get("OPENAI_ORG_ID")
+# Initialize the storyteller
+llm = Storyteller(OPENAI_API_KEY, OPENAI_ORG_ID)
 
-PORT = os.environ.get("PORT", 5000)
+# Initialize the speculative story part executor
+speculative_executor = ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS)
+
+# Pre-translate the fixed action texts in the background, on import so that
+# WSGI servers (which never run __main__) warm up each worker too
+if TRANSLATION_WARMUP and OPENAI_API_KEY:
+    threading.Thread(
+        target=llm.warm_translations,
+        args=(WARMUP_TEXTS, APP_LANGUAGES, APP_SOURCE_LANGUAGE),
+        daemon=True,
+    ).start()
+
+
+def idempotent(view):
+    # Generation routes: a request retried with the same Idempotency-Key header
+    # gets the response of the original request (waiting for it if it still runs)
+    # instead of starting a new generation
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        header = request.headers.get("Idempotency-Key")
+        if header is None:
+            return view(*args, **kwargs)
+        key = idempotency_key(request.path, header)
+        if not key:
+            return jsonify(type="error", message="Invalid Idempotency-Key!", status=400)
+
+        fingerprint = idempotency_fingerprint(request.get_data())
+        entry = idempotent_requests.acquire(key, fingerprint, IDEMPOTENCY_WAIT)
+        if entry:
+            conflict = idempotency_conflict(entry, fingerprint)
+            if conflict:
+                message, status = conflict
+                return jsonify(type="error", message=message, status=status)
+            return Response(
+                entry["body"],
+                status=entry["status"],
+                mimetype=entry["mimetype"],
+                headers={"Idempotent-Replayed": "true"},
+            )
 
-HOST = os.environ.get("HOST", "0.0.0.0")
-DEBUG = os.environ.get("DEBUG", "False").lower() in ("true", "1", "t")
-LOGGER = os.environ.get("LOGGER", "False").lower() in ("true", "1", "t")
-STORAGE_PATH = "static"
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except BaseException:
+            idempotent_requests.release(key)
+            raise
+        # Failed generations are not kept, so the next retry runs again
+        if response.status_code >= 500:
+            idempotent_requests.release(key)
+        else:
+            idempotent_requests.finish(
+                key, response.status_code, response.get_data(), response.mimetype
+            )
+        return response
 
-if LOGGER:
-    logger = logger_setup("app", os.path.join(LOG_FOLDER, "app.log"), debug=DEBUG)
-else:
-    logger = None
-
-
-# Initialize the storyteller
-llm = Storyteller(OPENAI_API_KEY, OPENAI_ORG_ID)
+    return wrapper
 
 
 @app.route("/api")
 def index():
     # Return a json response representing the API, with the available endpoints
-    response = dict(
-        {
-            "prefix": "/api",
-            "endpoints": {
-                "image": {
-                    "methods": ["POST", "GET"],
-                    "description": "Save and retrieve images",
-                },
-                "character": {
-                    "methods": ["POST", "GET"],
-                    "description": "Generate and retrieve characters",
-                },
-                "session": {
-                    "methods": ["GET"],
-                    "description": "Initialize and retrieve sessions",
-                },
-                "story/premise": {
-                    "methods": ["POST"],
-                    "description": "Generate a story premise",
-                },
-                "story/part": {
-                    "methods": ["POST"],
-                    "description": "Generate a story part",
-                },
-                "story": {
-                    "methods": ["GET"],
-                    "description": "Initialize a story",
-                },
-                "story/actions": {
-                    "methods": ["POST"],
-                    "description": "Generate story actions",
-                },
-                "read": {
-                    "methods": ["POST"],
-                    "description": "Read text using the API",
-                },
-            },
-        }
-    )
-    # Sort the endpoints by name
-    response["endpoints"] = dict(sorted(response["endpoints"].items()))
+    response = api_description()
     return jsonify(type="success", message="API available", status=200, data=response)
 
 
 @app.route("/api/image", methods=["POST"])
 def image_save():
     os.makedirs(STORAGE_PATH, exist_ok=True)
-    # Save the base64 image
+    if not request.is_json:
+        return image_upload()
+
+    # Save the base64 image (older clients)
     data = request.get_json()
 
     base64_url = data["image"]
@@ -116,23 +121,74 @@ def image_save():
     return jsonify(type="success", message="Image saved!", status=200, name=img_fname)
 
 
+def image_upload():
+    # Save a multipart ("image" field) or raw-body upload, streamed to disk as is
+    if upload_too_large(request.content_length, APP_IMAGE_MAX_SIZE):
+        if logger:
+            logger.error("Image too large!")
+        return jsonify(type="error", message="Image too large!", status=413)
+
+    if request.mimetype == "multipart/form-data":
+        upload = request.files.get("image")
+        if not upload:
+            if logger:
+                logger.error("No image found in the request!")
+            return jsonify(type="error", message="No image found!", status=400)
+        stream = upload.stream
+    else:
+        stream = request.stream
+
+    try:
+        img_fname = save_image_stream(stream, STORAGE_PATH, APP_IMAGE_MAX_SIZE)
+    except ValueError as e:
+        if logger:
+            logger.error(str(e))
+        return jsonify(type="error", message=str(e), status=400)
+
+    if logger:
+        logger.info(f"Image saved: {os.path.join(STORAGE_PATH, img_fname)}")
+    return jsonify(type="success", message="Image saved!", status=200, name=img_fname)
+
+
 @app.route("/api/image/<img_name>", methods=["GET"])
 def image_get(img_name):
-    # Get the base64 image
+    # Get the image, answering revalidations with 304 Not Modified
     img_path = os.path.join(STORAGE_PATH, img_name)
     img_type = img_name.split(".")[-1]
 
-    if not os.path.exists(img_path):
+    try:
+        img_data, etag = image_cache.get(STORAGE_PATH, img_name)
+    except (FileNotFoundError, IsADirectoryError):
         if logger:
             logger.error(f"Image not found: {img_path}")
         return jsonify(type="error", message="Image not found!", status=404)
 
+    if img_data is None:
+        response = send_file(img_path, mimetype=f"image/{img_type}", etag=etag)
+    else:
+        response = Response(img_data, mimetype=f"image/{img_type}")
+        response.set_etag(etag)
+    if image_immutable(img_name):
+        response.cache_control.public = True
+        response.cache_control.max_age = IMAGE_CACHE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    if img_data is None:
+        response = response.make_conditional(request)
+    else:
+        # In-memory images answer Range requests (206) like the files on disk
+        response = response.make_conditional(
+            request, accept_ranges=True, complete_length=len(img_data)
+        )
+
     if logger:
-        logger.info(f"Image sent: {img_path}")
-    return send_file(img_path, mimetype=f"image/{img_type}")
+        logger.info(f"Image sent: {img_path} ({response.status_code})")
+    return response
 
 
 @app.route("/api/character", methods=["POST"])
+@idempotent
 def character_gen():
     try:
         data = request.get_json()
@@ -151,15 +207,18 @@ def character_gen():
             return jsonify(type="error", message="No image found!", status=400)
 
         result = llm.generate_character(image, complexity)
+        character = {
+            "id": str(uuid.uuid4()),
+            "image": {"src": image, **result["image"]},
+            "character": {**result["character"]},
+        }
+        if data.get("session"):
+            sessions.put_character(data["session"], character)
         return jsonify(
             type="success",
             message="Character generated!",
             status=200,
-            data={
-                "id": uuid.uuid4(),
-                "image": {"src": image, **result["image"]},
-                "character": {**result["character"]},
-            },
+            data=character,
         )
     except Exception as e:
         if logger:
@@ -169,13 +228,28 @@ def character_gen():
 
 @app.route("/api/character/<char_id>", methods=["GET"])
 def character_get(char_id):
-    pass
+    try:
+        character = sessions.character(char_id)
+        if not character:
+            if logger:
+                logger.error(f"Character not found: {char_id}")
+            return jsonify(type="error", message="Character not found!", status=404)
+        return jsonify(
+            type="success",
+            message="Character found!",
+            status=200,
+            data=character,
+        )
+    except Exception as e:
+        if logger:
+            logger.error(str(e))
+        return jsonify({"error": str(e)}), 500
 
 
 @app.route("/api/session", methods=["GET"])
 def session_init():
     try:
-        session_id = uuid.uuid4()
+        session_id = sessions.create()["id"]
         if logger:
             logger.info(f"Session initialized: {session_id}")
         return jsonify(
@@ -192,7 +266,23 @@ def session_init():
 
 @app.route("/api/session/<session_id>", methods=["GET"])
 def session_get(session_id):
-    pass
+    # The stored character, premise and story (with all its parts) of a session
+    try:
+        session = sessions.get(session_id)
+        if not session:
+            if logger:
+                logger.error(f"Session not found: {session_id}")
+            return jsonify(type="error", message="Session not found!", status=404)
+        return jsonify(
+            type="success",
+            message="Session found!",
+            status=200,
+            data=session,
+        )
+    except Exception as e:
+        if logger:
+            logger.error(str(e))
+        return jsonify({"error": str(e)}), 500
 
 
 @app.route("/api/story/premise", methods=["POST"])
@@ -205,7 +295,7 @@ def premise_gen():
             return jsonify(type="error", message="No data found!", status=400)
 
         complexity = data.get("complexity", None)
-        context = data.get("context", None)
+        context = session_context(data, "premise")
 
         context = {
             "name": context["fullname"],
@@ -225,13 +315,38 @@ def premise_gen():
             status=200,
             data={**result},
         )
+    except SessionMissing as e:
+        if logger:
+            logger.error(f"{e} ({e.session_id})")
+        return jsonify(type="error", message=str(e), status=e.status)
     except Exception as e:
         if logger:
             logger.error(str(e))
         return jsonify({"error": str(e)}), 500
 
 
+def start_image_job(keymoment, image):
+    # Opt-in per request with {"image": {"style": ...}}: generate the story image
+    # from the keymoment in the background and return the job id to await
+    if not image or not keymoment:
+        return None
+    story_part = {"content": keymoment, "style": image.get("style")}
+    return image_jobs.submit(generate_mirrored_image, story_part)
+
+
+def generate_mirrored_image(story_part):
+    result = llm.generate_story_image(story_part)
+    if image_mirror:
+        try:
+            result = {**result, **image_mirror.fetch(result["image_url"])}
+        except Exception as e:
+            if logger:
+                logger.error(f"Could not mirror story image: {e}")
+    return result
+
+
 @app.route("/api/story/part", methods=["POST"])
+@idempotent
 def part_gen():
     try:
         data = request.get_json()
@@ -241,19 +356,33 @@ def part_gen():
             return jsonify(type="error", message="No data found!", status=400)
 
         complexity = data.get("complexity", None)
-        context = data.get("context", None)
-
-        result = llm.generate_story_part(context, complexity)
-        part_id = uuid.uuid4()
+        context = session_context(data, "part")
+
+        result = None
+        job = speculative_parts.take(data.get("session"), context.get("action"))
+        if job:
+            try:
+                result = job.result()
+            except Exception as e:
+                if logger:
+                    logger.error(f"Speculative story part failed: {e}")
+        if not result:
+            result = llm.generate_story_part(context, complexity)
         if logger:
             logger.debug(f"Story part generated: {result}")
-        part = result["part"]
+        part = {"id": str(uuid.uuid4()), **result["part"]}
+        part["image_job"] = start_image_job(part.get("keymoment"), data.get("image"))
+        session_part(data.get("session"), part, context.get("action"))
         return jsonify(
             type="success",
             message="Story part generated!",
             status=200,
-            data={"id": part_id, **part},
+            data=part,
         )
+    except SessionMissing as e:
+        if logger:
+            logger.error(f"{e} ({e.session_id})")
+        return jsonify(type="error", message=str(e), status=e.status)
     except Exception as e:
         if logger:
             logger.error(str(e))
@@ -261,6 +390,7 @@ def part_gen():
 
 
 @app.route("/api/story/init", methods=["POST"])
+@idempotent
 def story_init():
     try:
         data = request.get_json()
@@ -270,19 +400,20 @@ def story_init():
             return jsonify(type="error", message="No data found!", status=400)
 
         complexity = data.get("complexity", None)
-        context = data.get("context", None)
+        context = session_context(data, "init")
+        premise = story_premise(context)
 
-        context = {
-            "setting": context["desc"],
-            "protagonist": {
-                "name": context["fullname"],
-                "about": context["backstory"],
-            },
-        }
+        context = story_init_context(context)
 
         result = llm.initialize_story(context, complexity)
-        story_id = uuid.uuid4()
-        part_id = uuid.uuid4()
+        result["image_job"] = start_image_job(
+            result.get("keymoment"), data.get("image")
+        )
+        story = {
+            "id": str(uuid.uuid4()),
+            "parts": [{"id": str(uuid.uuid4()), **result}],
+        }
+        session_story(data.get("session"), story, premise)
         if logger:
             logger.info(f"Story initialized!")
 
@@ -290,8 +421,12 @@ def story_init():
             type="success",
             message="Story initialized!",
             status=200,
-            data={"id": story_id, "parts": [{"id": part_id, **result}]},
+            data=story,
         )
+    except SessionMissing as e:
+        if logger:
+            logger.error(f"{e} ({e.session_id})")
+        return jsonify(type="error", message=str(e), status=e.status)
     except Exception as e:
         if logger:
             logger.error(str(e))
@@ -309,25 +444,189 @@ def story_end():
 
         print(data)
         complexity = data.get("complexity", None)
-        context = data.get("context", None)
+        context = session_context(data, "end")
+        # No next action will be chosen, stop the speculative parts
+        speculative_parts.discard(data.get("session"))
 
         result = llm.terminate_story(context, complexity)
         if logger:
             logger.info(f"Story ended!")
-        part = result["part"]
-        part_id = uuid.uuid4()
+        part = {"id": str(uuid.uuid4()), **result["part"]}
+        part["image_job"] = start_image_job(part.get("keymoment"), data.get("image"))
+        session_part(data.get("session"), part, finished=True)
         return jsonify(
             type="success",
             message="Story ended!",
             status=200,
-            data={"id": part_id, **part},
+            data=part,
+        )
+    except SessionMissing as e:
+        if logger:
+            logger.error(f"{e} ({e.session_id})")
+        return jsonify(type="error", message=str(e), status=e.status)
+    except Exception as e:
+        if logger:
+            logger.error(str(e))
+        return jsonify({"error": str(e)}), 500
+
+
+def sse_story_events(events, build, image=None):
+    # Forward streamed story events, `build` shapes the final parsed result.
+    # The image job starts as soon as the keymoment is complete.
+    image_job = None
+    try:
+        for event, key, value in events:
+            if event == "done":
+                yield sse_event("done", build(value, image_job))
+                continue
+            yield sse_event(event, {"key": key, "value": value})
+            if event == "field" and key == "keymoment" and not image_job:
+                image_job = start_image_job(value, image)
+                if image_job:
+                    yield sse_event("image_job", {"id": image_job})
+    except Exception as e:
+        if logger:
+            logger.error(str(e))
+        yield sse_event("error", {"error": str(e)})
+
+
+def sse_response(generator):
+    return Response(
+        stream_with_context(generator),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Streaming variants of the story routes (Server-Sent Events).
+# Events: "delta" with new characters of the story text, "field" once a value
+# such as keymoment or sentiment is complete, "image_job" if an image was
+# requested, and "done" with the same data the non-streaming route returns.
+
+
+@app.route("/api/story/part/stream", methods=["POST"])
+def part_gen_stream():
+    try:
+        data = request.get_json()
+        if not data:
+            if logger:
+                logger.error("No data found in the request!")
+            return jsonify(type="error", message="No data found!", status=400)
+
+        complexity = data.get("complexity", None)
+        context = session_context(data, "part")
+
+        events = llm.stream_story_part(context, complexity)
+        return sse_response(
+            sse_story_events(
+                events,
+                lambda result, image_job: session_part(
+                    data.get("session"),
+                    {"id": str(uuid.uuid4()), **result["part"], "image_job": image_job},
+                    context.get("action"),
+                ),
+                data.get("image"),
+            )
         )
+    except SessionMissing as e:
+        if logger:
+            logger.error(f"{e} ({e.session_id})")
+        return jsonify(type="error", message=str(e), status=e.status)
     except Exception as e:
         if logger:
             logger.error(str(e))
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/story/init/stream", methods=["POST"])
+def story_init_stream():
+    try:
+        data = request.get_json()
+        if not data:
+            if logger:
+                logger.error("No data found in the request!")
+            return jsonify(type="error", message="No data found!", status=400)
+
+        complexity = data.get("complexity", None)
+        context = session_context(data, "init")
+        premise = story_premise(context)
+        context = story_init_context(context)
+
+        events = llm.stream_initialize_story(context, complexity)
+        return sse_response(
+            sse_story_events(
+                events,
+                lambda result, image_job: session_story(
+                    data.get("session"),
+                    {
+                        "id": str(uuid.uuid4()),
+                        "parts": [
+                            {"id": str(uuid.uuid4()), **result, "image_job": image_job}
+                        ],
+                    },
+                    premise,
+                ),
+                data.get("image"),
+            )
+        )
+    except SessionMissing as e:
+        if logger:
+            logger.error(f"{e} ({e.session_id})")
+        return jsonify(type="error", message=str(e), status=e.status)
+    except Exception as e:
+        if logger:
+            logger.error(str(e))
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/story/end/stream", methods=["POST"])
+def story_end_stream():
+    try:
+        data = request.get_json()
+        if not data:
+            if logger:
+                logger.error("No data found in the request!")
+            return jsonify(type="error", message="No data found!", status=400)
+
+        complexity = data.get("complexity", None)
+        context = session_context(data, "end")
+        # No next action will be chosen, stop the speculative parts
+        speculative_parts.discard(data.get("session"))
+
+        events = llm.stream_terminate_story(context, complexity)
+        return sse_response(
+            sse_story_events(
+                events,
+                lambda result, image_job: session_part(
+                    data.get("session"),
+                    {"id": str(uuid.uuid4()), **result["part"], "image_job": image_job},
+                    finished=True,
+                ),
+                data.get("image"),
+            )
+        )
+    except SessionMissing as e:
+        if logger:
+            logger.error(f"{e} ({e.session_id})")
+        return jsonify(type="error", message=str(e), status=e.status)
+    except Exception as e:
+        if logger:
+            logger.error(str(e))
+        return jsonify({"error": str(e)}), 500
+
+
+def speculate_parts(session_id, actions, speculate, complexity):
+    # Start generating the next story part for each offered action in the background.
+    # /api/story/part picks up the matching result, the other branches are discarded.
+    speculative_parts.discard(session_id)
+    for action, context in speculative_contexts(session_id, actions, speculate):
+        job = SpeculativeJob(
+            speculative_executor,
+            functools.partial(llm.stream_story_part, context, complexity),
+        )
+        speculative_parts.put(session_id, action, job)
+
+
 @app.route("/api/story/actions", methods=["POST"])
 def actions_gen():
     try:
@@ -338,32 +637,35 @@ def actions_gen():
             return jsonify(type="error", message="No data found!", status=400)
 
         complexity = data.get("complexity", None)
-        context = data.get("context", None)
+        context = session_context(data, "actions")
 
         result = llm.generate_actions(context, complexity, ACTION_GEN_COUNT)
         actions = result["list"]
         actions = random.sample(actions, ACTION_GEN_COUNT)
-        actions.append(
-            {
-                "title": "Motion Capture",
-                "desc": "Use your body to progress the story!",
-            }
-        )
-        actions.append(
-            {
-                "title": "Ending",
-                "desc": "Bring the story to an end and see what happens!",
-            }
-        )
+        actions.extend(dict(a) for a in FIXED_ACTIONS)
         actions = [{"id": uuid.uuid4(), **a, "active": True} for a in actions]
         if logger:
             logger.debug(f"Story actions generated: {actions}")
+
+        session_id = data.get("session", None)
+        speculate = data.get("speculate", None)
+        if speculate is True:
+            # The premise and story so far are taken from the stored session
+            speculate = session_context({"session": session_id}, "part")
+        if SPECULATIVE_MODE and session_id and speculate:
+            speculate_parts(
+                session_id, actions[:ACTION_GEN_COUNT], speculate, complexity
+            )
         return jsonify(
             type="success",
             message="Story actions generated!",
             status=200,
             data={"list": actions},
         )
+    except SessionMissing as e:
+        if logger:
+            logger.error(f"{e} ({e.session_id})")
+        return jsonify(type="error", message=str(e), status=e.status)
     except Exception as e:
         if logger:
             logger.error(str(e))
@@ -373,13 +675,21 @@ def actions_gen():
 @app.route("/api/story/motion", methods=["POST"])
 def process_motion():
     try:
-        data = request.get_json()
-        if not data:
-            if logger:
-                logger.error("No data found in the request!")
-            return jsonify(type="error", message="No data found!", status=400)
+        if request.is_json:
+            # Frames sampled by the client
+            data = request.get_json()
+            if not data:
+                if logger:
+                    logger.error("No data found in the request!")
+                return jsonify(type="error", message="No data found!", status=400)
+
+            frames = data.get("frames", None)
+        else:
+            # Video upload, multipart ("video" field) or raw body
+            frames = motion_video_frames()
+            if isinstance(frames, Response):
+                return frames
 
-        frames = data.get("frames", None)
         if not frames:
             if logger:
                 logger.error("No frames found in the request!")
@@ -400,7 +710,41 @@ def process_motion():
         return jsonify({"error": str(e)}), 500
 
 
+def motion_video_frames():
+    # Sample the uploaded clip, returns the frames or an error response
+    if upload_too_large(request.content_length, MOTION_VIDEO_MAX_SIZE):
+        return jsonify(type="error", message="Video too large!", status=413)
+    if request.mimetype == "multipart/form-data":
+        upload = request.files.get("video")
+        if not upload:
+            return jsonify(type="error", message="No video found!", status=400)
+        stream = upload.stream
+    else:
+        stream = request.stream
+
+    try:
+        path = save_video_stream(stream, MOTION_VIDEO_MAX_SIZE)
+    except ValueError as e:
+        if logger:
+            logger.error(str(e))
+        return jsonify(type="error", message=str(e), status=400)
+    try:
+        future = submit_motion_video(path)
+        if not future:
+            if logger:
+                logger.error("Motion sampling queue is full!")
+            return jsonify(type="error", message="Server busy!", status=503)
+        frames = future.result(timeout=MOTION_TIMEOUT)
+    finally:
+        os.remove(path)
+    if logger:
+        logger.debug(f"Sampled {len(frames)} motion frames")
+    # Same format as the frames sent by the client
+    return [f"data:image/jpeg;base64,{frame}" for frame in frames]
+
+
 @app.route("/api/story/image", methods=["POST"])
+@idempotent
 def storyimage_gen():
     try:
         data = request.get_json()
@@ -412,11 +756,50 @@ def storyimage_gen():
         result = llm.generate_story_image(data)
         if logger:
             logger.debug(f"Story image generated: {result}")
+        if image_mirror:
+            # Usually quick, fall back to the API URL if the download is slow
+            try:
+                mirrored = image_mirror.submit(result["image_url"])
+                result = {**result, **mirrored.result(timeout=IMAGE_MIRROR_WAIT)}
+            except Exception as e:
+                if logger:
+                    logger.error(f"Could not mirror story image: {e}")
         return jsonify(
             type="success",
             message="Story image generated!",
             status=200,
-            data={**result},
+            data=story_image_data(result, request.host_url),
+        )
+    except Exception as e:
+        if logger:
+            logger.error(str(e))
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/story/image/<job_id>", methods=["GET"])
+def storyimage_get(job_id):
+    # Wait (up to IMAGE_JOB_WAIT seconds) for an image job started with a story part
+    try:
+        wait = min(float(request.args.get("wait", IMAGE_JOB_WAIT)), IMAGE_JOB_WAIT)
+        job = image_jobs.wait(job_id, wait)
+        if not job:
+            if logger:
+                logger.error(f"Image job not found: {job_id}")
+            return jsonify(type="error", message="Image job not found!", status=404)
+        if job["status"] == "pending":
+            return jsonify(
+                type="pending",
+                message="Story image pending!",
+                status=202,
+                data={"id": job_id},
+            )
+        if job["status"] == "error":
+            return jsonify(type="error", message=job["error"], status=500)
+        return jsonify(
+            type="success",
+            message="Story image generated!",
+            status=200,
+            data=story_image_data(job["result"], request.host_url),
         )
     except Exception as e:
         if logger:
@@ -456,17 +839,76 @@ def translate_text():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/translate/batch", methods=["POST"])
+def translate_batch():
+    try:
+        data = request.get_json()
+        if not data:
+            if logger:
+                logger.error("No data found in the request!")
+            return jsonify(type="error", message="No data found!", status=400)
+
+        texts = data.get("texts", None)
+        src_lang = data.get("src_lang", None)
+        tgt_lang = data.get("tgt_lang", None)
+        if not isinstance(texts, list):
+            if logger:
+                logger.error("No texts found in the request!")
+            return jsonify(type="error", message="No texts found!", status=400)
+
+        if src_lang == tgt_lang:
+            if logger:
+                logger.debug("No translation needed!")
+            return jsonify(
+                type="success",
+                message="No translation needed!",
+                status=200,
+                data={"texts": texts},
+            )
+
+        if logger:
+            logger.debug(
+                f"Translating {len(texts)} texts from {src_lang} to {tgt_lang}"
+            )
+        result = llm.translate_batch(texts, src_lang, tgt_lang)
+        return jsonify(
+            type="success",
+            message="Texts translated!",
+            status=200,
+            data={"texts": result},
+        )
+    except Exception as e:
+        if logger:
+            logger.error(str(e))
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route("/api/read", methods=["GET"])
 def read_text():
     try:
         text = request.args.get("text")
         os = request.args.get("os", "undetermined")
+        pipeline = request.args.get("pipeline", "False").lower() in ("true", "1", "t")
         if logger:
             logger.debug(f"Generating speech for: {text}")
 
-        mimetype = get_mimetype(os)
+        # Pipelined mode synthesizes sentence by sentence to cut time-to-first-audio,
+        # always as MP3 (the only format whose segments can be concatenated)
+        mimetype = get_mimetype("ios" if pipeline else os)
+        tts = llm.send_tts_pipelined_request if pipeline else llm.send_tts_request
+        if not tts_cache:
+            return Response(
+                stream_with_context(tts(text, os)),
+                mimetype=mimetype,
+            )
+
+        key = tts_cache.key(text, llm.voice, llm.tts, mimetype, pipeline)
+        path = tts_cache.get(key)
+        if path:
+            # Cached audio supports Range requests so clients can seek
+            return send_file(path, mimetype=mimetype, conditional=True, etag=key)
         return Response(
-            stream_with_context(llm.send_tts_request(text, os)),
+            stream_with_context(tts_cache.tee(key, tts(text, os))),
             mimetype=mimetype,
         )
     except Exception as e:
@@ -0,0 +1,874 @@
+import os, sys
+import asyncio
+import functools
+import random
+import tempfile
+import uuid
+from contextlib import asynccontextmanager
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import FileResponse, JSONResponse, Response
+from starlette.responses import StreamingResponse
+from starlette.routing import Route
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import get_mimetype, save_base64_image, save_image_stream
+from utils import save_video_stream
+from config import *
+from llm import AsyncStoryteller
+from services import *
+
+# ASGI entry point: the same API as app.py, served natively async by awaiting
+# AsyncStoryteller (blocking file and database work runs in threads).
+# Run with: gunicorn -k uvicorn.workers.UvicornWorker asgi:app
+
+# Initialize the async storyteller
+llm = AsyncStoryteller(OPENAI_API_KEY, OPENAI_ORG_ID)
+
+
+def success(message, **kwargs):
+    return JSONResponse(dict(type="success", message=message, status=200, **kwargs))
+
+
+def error(message, status=400):
+    return JSONResponse(dict(type="error", message=message, status=status))
+
+
+def server_error(e):
+    if isinstance(e, SessionMissing):
+        if logger:
+            logger.error(f"{e} ({e.session_id})")
+        return error(str(e), status=e.status)
+    if logger:
+        logger.error(str(e))
+    return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def get_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+def idempotent(view):
+    # Same as app.idempotent, the store is shared with the Flask routes
+    @functools.wraps(view)
+    async def wrapper(request):
+        header = request.headers.get("Idempotency-Key")
+        if header is None:
+            return await view(request)
+        key = idempotency_key(request.url.path, header)
+        if not key:
+            return error("Invalid Idempotency-Key!")
+
+        fingerprint = idempotency_fingerprint(await request.body())
+        entry = await idempotent_requests.aacquire(key, fingerprint, IDEMPOTENCY_WAIT)
+        if entry:
+            conflict = idempotency_conflict(entry, fingerprint)
+            if conflict:
+                return error(*conflict)
+            return Response(
+                entry["body"],
+                status_code=entry["status"],
+                media_type=entry["mimetype"],
+                headers={"Idempotent-Replayed": "true"},
+            )
+
+        try:
+            response = await view(request)
+        except BaseException:
+            await asyncio.to_thread(idempotent_requests.release, key)
+            raise
+        if response.status_code >= 500:
+            await asyncio.to_thread(idempotent_requests.release, key)
+        else:
+            await asyncio.to_thread(
+                idempotent_requests.finish,
+                key,
+                response.status_code,
+                response.body,
+                response.media_type,
+            )
+        return response
+
+    return wrapper
+
+
+async def index(request):
+    # Return a json response representing the API, with the available endpoints
+    return success("API available", data=api_description())
+
+
+async def image_save(request):
+    os.makedirs(STORAGE_PATH, exist_ok=True)
+    if not request.headers.get("content-type", "").startswith("application/json"):
+        return await image_upload(request)
+
+    # Save the base64 image (older clients)
+    data = await get_json(request)
+    if not data:
+        if logger:
+            logger.error("No data found in the request!")
+        return error("No data found!")
+
+    base64_url = data["image"]
+    img_type = data["type"]
+
+    if not base64_url:
+        if logger:
+            logger.error("No image found in the request!")
+            logger.debug(data)
+        return error("No image found!")
+
+    if img_type not in APP_IMAGE_EXT:
+        if logger:
+            logger.error("Invalid image type!")
+            logger.debug(data)
+        return error("Invalid image type!")
+
+    img_fname = f"img_{uuid.uuid4().hex}.{img_type}"
+    img_path = os.path.join(STORAGE_PATH, img_fname)
+    await asyncio.to_thread(save_base64_image, base64_url.split(",", 1)[1], img_path)
+
+    if logger:
+        logger.info(f"Image saved: {img_path}")
+    return success("Image saved!", name=img_fname)
+
+
+async def image_upload(request):
+    # Save a multipart ("image" field) or raw-body upload, streamed to disk as is
+    content_length = int(request.headers.get("content-length") or 0)
+    if upload_too_large(content_length, APP_IMAGE_MAX_SIZE):
+        if logger:
+            logger.error("Image too large!")
+        return error("Image too large!", status=413)
+
+    try:
+        if request.headers.get("content-type", "").startswith("multipart/form-data"):
+            async with request.form(max_part_size=APP_IMAGE_MAX_SIZE) as form:
+                upload = form.get("image")
+                if not upload or isinstance(upload, str):
+                    if logger:
+                        logger.error("No image found in the request!")
+                    return error("No image found!")
+                img_fname = await asyncio.to_thread(
+                    save_image_stream, upload.file, STORAGE_PATH, APP_IMAGE_MAX_SIZE
+                )
+        else:
+            path = await spool_body(request, APP_IMAGE_MAX_SIZE, "Image")
+            try:
+                img_fname = await asyncio.to_thread(save_spooled_image, path)
+            finally:
+                os.remove(path)
+    except ValueError as e:
+        if logger:
+            logger.error(str(e))
+        return error(str(e))
+
+    if logger:
+        logger.info(f"Image saved: {os.path.join(STORAGE_PATH, img_fname)}")
+    return success("Image saved!", name=img_fname)
+
+
+def save_spooled_image(path):
+    with open(path, "rb") as f:
+        return save_image_stream(f, STORAGE_PATH, APP_IMAGE_MAX_SIZE)
+
+
+async def image_get(request):
+    # Get the image, answering revalidations with 304 Not Modified
+    img_name = request.path_params["img_name"]
+    img_path = os.path.join(STORAGE_PATH, img_name)
+    img_type = img_name.split(".")[-1]
+
+    try:
+        img_data, etag = await asyncio.to_thread(
+            image_cache.get, STORAGE_PATH, img_name
+        )
+    except (FileNotFoundError, IsADirectoryError):
+        if logger:
+            logger.error(f"Image not found: {img_path}")
+        return error("Image not found!", status=404)
+
+    headers = {"ETag": f'"{etag}"'}
+    if image_immutable(img_name):
+        headers["Cache-Control"] = f"public, max-age={IMAGE_CACHE_MAX_AGE}, immutable"
+    else:
+        headers["Cache-Control"] = "no-cache"
+
+    if_none_match = request.headers.get("if-none-match", "")
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    if headers["ETag"] in tags or "*" in tags:
+        response = Response(status_code=304, headers=headers)
+    elif img_data is None or "range" in request.headers:
+        # FileResponse answers Range requests with 206 Partial Content
+        response = FileResponse(
+            img_path, media_type=f"image/{img_type}", headers=headers
+        )
+    else:
+        response = Response(img_data, media_type=f"image/{img_type}", headers=headers)
+
+    if logger:
+        logger.info(f"Image sent: {img_path} ({response.status_code})")
+    return response
+
+
+@idempotent
+async def character_gen(request):
+    try:
+        data = await get_json(request)
+        if not data:
+            if logger:
+                logger.error("No data found in the request!")
+            return error("No data found!")
+
+        complexity = data.get("complexity", None)
+        context = data.get("context", None)
+        image = context["image"]
+        if not image:
+            if logger:
+                logger.error("No image found in the request!")
+                logger.debug(data)
+            return error("No image found!")
+
+        result = await llm.generate_character(image, complexity)
+        character = {
+            "id": str(uuid.uuid4()),
+            "image": {"src": image, **result["image"]},
+            "character": {**result["character"]},
+        }
+        if data.get("session"):
+            await asyncio.to_thread(sessions.put_character, data["session"], character)
+        return success("Character generated!", data=character)
+    except Exception as e:
+        return server_error(e)
+
+
+async def character_get(request):
+    char_id = request.path_params["char_id"]
+    try:
+        character = await asyncio.to_thread(sessions.character, char_id)
+        if not character:
+            if logger:
+                logger.error(f"Character not found: {char_id}")
+            return error("Character not found!", status=404)
+        return success("Character found!", data=character)
+    except Exception as e:
+        return server_error(e)
+
+
+async def session_init(request):
+    try:
+        session_id = (await asyncio.to_thread(sessions.create))["id"]
+        if logger:
+            logger.info(f"Session initialized: {session_id}")
+        return success("Session initialized!", data={"id": session_id})
+    except Exception as e:
+        return server_error(e)
+
+
+async def session_get(request):
+    # The stored character, premise and story (with all its parts) of a session
+    session_id = request.path_params["session_id"]
+    try:
+        session = await asyncio.to_thread(sessions.get, session_id)
+        if not session:
+            if logger:
+                logger.error(f"Session not found: {session_id}")
+            return error("Session not found!", status=404)
+        return success("Session found!", data=session)
+    except Exception as e:
+        return server_error(e)
+
+
+async def premise_gen(request):
+    try:
+        data = await get_json(request)
+        if not data:
+            if logger:
+                logger.error("No data found in the request!")
+            return error("No data found!")
+
+        complexity = data.get("complexity", None)
+        context = await asyncio.to_thread(session_context, data, "premise")
+
+        context = {
+            "name": context["fullname"],
+            "about": context["backstory"],
+        }
+
+        result = await llm.generate_premise(context, complexity, PREMISE_GEN_COUNT)
+        if logger:
+            logger.debug(f"Story premise generated: {result}")
+        return success("Story premise generated!", data={**result})
+    except Exception as e:
+        return server_error(e)
+
+
+async def start_image_job(keymoment, image):
+    if not image or not keymoment:
+        return None
+    story_part = {"content": keymoment, "style": image.get("style")}
+    return await image_jobs.spawn(generate_mirrored_image(story_part))
+
+
+async def generate_mirrored_image(story_part):
+    result = await llm.generate_story_image(story_part)
+    if image_mirror:
+        try:
+            mirrored = await asyncio.wrap_future(
+                image_mirror.submit(result["image_url"])
+            )
+            result = {**result, **mirrored}
+        except Exception as e:
+            if logger:
+                logger.error(f"Could not mirror story image: {e}")
+    return result
+
+
+@idempotent
+async def part_gen(request):
+    try:
+        data = await get_json(request)
+        if not data:
+            if logger:
+                logger.error("No data found in the request!")
+            return error("No data found!")
+
+        complexity = data.get("complexity", None)
+        context = await asyncio.to_thread(session_context, data, "part")
+
+        result = None
+        job = speculative_parts.take(data.get("session"), context.get("action"))
+        if job:
+            try:
+                result = await job
+            except Exception as e:
+                if logger:
+                    logger.error(f"Speculative story part failed: {e}")
+        if not result:
+            result = await llm.generate_story_part(context, complexity)
+        if logger:
+            logger.debug(f"Story part generated: {result}")
+        part = {"id": str(uuid.uuid4()), **result["part"]}
+        part["image_job"] = await start_image_job(
+            part.get("keymoment"), data.get("image")
+        )
+        await asyncio.to_thread(
+            session_part, data.get("session"), part, context.get("action")
+        )
+        return success("Story part generated!", data=part)
+    except Exception as e:
+        return server_error(e)
+
+
+@idempotent
+async def story_init(request):
+    try:
+        data = await get_json(request)
+        if not data:
+            if logger:
+                logger.error("No data found in the request!")
+            return error("No data found!")
+
+        complexity = data.get("complexity", None)
+        context = await asyncio.to_thread(session_context, data, "init")
+        premise = story_premise(context)
+
+        context = story_init_context(context)
+
+        result = await llm.initialize_story(context, complexity)
+        result["image_job"] = await start_image_job(
+            result.get("keymoment"), data.get("image")
+        )
+        story = {
+            "id": str(uuid.uuid4()),
+            "parts": [{"id": str(uuid.uuid4()), **result}],
+        }
+        await asyncio.to_thread(session_story, data.get("session"), story, premise)
+        if logger:
+            logger.info(f"Story initialized!")
+
+        return success("Story initialized!", data=story)
+    except Exception as e:
+        return server_error(e)
+
+
+async def story_end(request):
+    try:
+        data = await get_json(request)
+        if not data:
+            if logger:
+                logger.error("No data found in the request!")
+            return error("No data found!")
+
+        complexity = data.get("complexity", None)
+        context = await asyncio.to_thread(session_context, data, "end")
+        # No next action will be chosen, stop the speculative parts
+        speculative_parts.discard(data.get("session"))
+
+        result = await llm.terminate_story(context, complexity)
+        if logger:
+            logger.info(f"Story ended!")
+        part = {"id": str(uuid.uuid4()), **result["part"]}
+        part["image_job"] = await start_image_job(
+            part.get("keymoment"), data.get("image")
+        )
+        await asyncio.to_thread(session_part, data.get("session"), part, finished=True)
+        return success("Story ended!", data=part)
+    except Exception as e:
+        return server_error(e)
+
+
+async def sse_story_events(events, build, image=None):
+    # Forward streamed story events, `build` shapes the final parsed result.
+    # The image job starts as soon as the keymoment is complete.
+    image_job = None
+    try:
+        async for event, key, value in events:
+            if event == "done":
+                # build records the result in the session store
+                result = await asyncio.to_thread(build, value, image_job)
+                yield sse_event("done", result)
+                continue
+            yield sse_event(event, {"key": key, "value": value})
+            if event == "field" and key == "keymoment" and not image_job:
+                image_job = await start_image_job(value, image)
+                if image_job:
+                    yield sse_event("image_job", {"id": image_job})
+    except Exception as e:
+        if logger:
+            logger.error(str(e))
+        yield sse_event("error", {"error": str(e)})
+    finally:
+        # Also on a client disconnect: ends the upstream generation
+        await events.aclose()
+
+
+def sse_response(generator):
+    return StreamingResponse(
+        generator,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def part_gen_stream(request):
+    try:
+        data = await get_json(request)
+        if not data:
+            if logger:
+                logger.error("No data found in the request!")
+            return error("No data found!")
+
+        complexity = data.get("complexity", None)
+        context = await asyncio.to_thread(session_context, data, "part")
+
+        events = llm.stream_story_part(context, complexity)
+        return sse_response(
+            sse_story_events(
+                events,
+                lambda result, image_job: session_part(
+                    data.get("session"),
+                    {"id": str(uuid.uuid4()), **result["part"], "image_job": image_job},
+                    context.get("action"),
+                ),
+                data.get("image"),
+            )
+        )
+    except Exception as e:
+        return server_error(e)
+
+
+async def story_init_stream(request):
+    try:
+        data = await get_json(request)
+        if not data:
+            if logger:
+                logger.error("No data found in the request!")
+            return error("No data found!")
+
+        complexity = data.get("complexity", None)
+        context = await asyncio.to_thread(session_context, data, "init")
+        premise = story_premise(context)
+        context = story_init_context(context)
+
+        events = llm.stream_initialize_story(context, complexity)
+        return sse_response(
+            sse_story_events(
+                events,
+                lambda result, image_job: session_story(
+                    data.get("session"),
+                    {
+                        "id": str(uuid.uuid4()),
+                        "parts": [
+                            {"id": str(uuid.uuid4()), **result, "image_job": image_job}
+                        ],
+                    },
+                    premise,
+                ),
+                data.get("image"),
+            )
+        )
+    except Exception as e:
+        return server_error(e)
+
+
+async def story_end_stream(request):
+    try:
+        data = await get_json(request)
+        if not data:
+            if logger:
+                logger.error("No data found in the request!")
+            return error("No data found!")
+
+        complexity = data.get("complexity", None)
+        context = await asyncio.to_thread(session_context, data, "end")
+        # No next action will be chosen, stop the speculative parts
+        speculative_parts.discard(data.get("session"))
+
+        events = llm.stream_terminate_story(context, complexity)
+        return sse_response(
+            sse_story_events(
+                events,
+                lambda result, image_job: session_part(
+                    data.get("session"),
+                    {"id": str(uuid.uuid4()), **result["part"], "image_job": image_job},
+                    finished=True,
+                ),
+                data.get("image"),
+            )
+        )
+    except Exception as e:
+        return server_error(e)
+
+
+async def speculate_parts(session_id, actions, speculate, complexity):
+    speculative_parts.discard(session_id)
+    contexts = await asyncio.to_thread(
+        speculative_contexts, session_id, actions, speculate
+    )
+    for action, context in contexts:
+        job = asyncio.create_task(llm.generate_story_part(context, complexity))
+        speculative_parts.put(session_id, action, job)
+
+
+async def actions_gen(request):
+    try:
+        data = await get_json(request)
+        if not data:
+            if logger:
+                logger.error("No data found in the request!")
+            return error("No data found!")
+
+        complexity = data.get("complexity", None)
+        context = await asyncio.to_thread(session_context, data, "actions")
+
+        result = await llm.generate_actions(context, complexity, ACTION_GEN_COUNT)
+        actions = result["list"]
+        actions = random.sample(actions, ACTION_GEN_COUNT)
+        actions.extend(dict(a) for a in FIXED_ACTIONS)
+        actions = [{"id": str(uuid.uuid4()), **a, "active": True} for a in actions]
+        if logger:
+            logger.debug(f"Story actions generated: {actions}")
+
+        session_id = data.get("session", None)
+        speculate = data.get("speculate", None)
+        if speculate is True:
+            speculate = await asyncio.to_thread(
+                session_context, {"session": session_id}, "part"
+            )
+        if SPECULATIVE_MODE and session_id and speculate:
+            await speculate_parts(
+                session_id, actions[:ACTION_GEN_COUNT], speculate, complexity
+            )
+        return success("Story actions generated!", data={"list": actions})
+    except Exception as e:
+        return server_error(e)
+
+
+async def process_motion(request):
+    try:
+        if request.headers.get("content-type", "").startswith("application/json"):
+            # Frames sampled by the client
+            data = await get_json(request)
+            if not data:
+                if logger:
+                    logger.error("No data found in the request!")
+                return error("No data found!")
+
+            frames = data.get("frames", None)
+        else:
+            # Video upload, multipart ("video" field) or raw body
+            frames = await motion_video_frames(request)
+            if isinstance(frames, JSONResponse):
+                return frames
+
+        if not frames:
+            if logger:
+                logger.error("No frames found in the request!")
+            return error("No frames found!")
+
+        result = await llm.process_motion(frames)
+        if logger:
+            logger.debug(f"Motion processed: {result}")
+        return success("Motion processed!", data={**result})
+    except Exception as e:
+        return server_error(e)
+
+
+async def spool_body(request, max_size=MOTION_VIDEO_MAX_SIZE, name="Video"):
+    # Stream the raw request body to a temp file, returns its path
+    fd, path = tempfile.mkstemp(suffix=f".{name.lower()}")
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > max_size:
+                    raise ValueError(f"{name} too large!")
+                f.write(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    if not size:
+        os.remove(path)
+        raise ValueError(f"No {name.lower()} found!")
+    return path
+
+
+async def motion_video_frames(request):
+    # Sample the uploaded clip, returns the frames or an error response
+    content_length = int(request.headers.get("content-length") or 0)
+    if upload_too_large(content_length, MOTION_VIDEO_MAX_SIZE):
+        return error("Video too large!", status=413)
+    try:
+        if request.headers.get("content-type", "").startswith("multipart/form-data"):
+            # The form (and its spooled upload) is closed when leaving the block
+            async with request.form(max_part_size=MOTION_VIDEO_MAX_SIZE) as form:
+                upload = form.get("video")
+                if not upload or isinstance(upload, str):
+                    return error("No video found!")
+                path = await asyncio.to_thread(
+                    save_video_stream, upload.file, MOTION_VIDEO_MAX_SIZE
+                )
+        else:
+            path = await spool_body(request)
+    except ValueError as e:
+        if logger:
+            logger.error(str(e))
+        return error(str(e))
+    try:
+        future = submit_motion_video(path)
+        if not future:
+            if logger:
+                logger.error("Motion sampling queue is full!")
+            return error("Server busy!", status=503)
+        frames = await asyncio.wait_for(asyncio.wrap_future(future), MOTION_TIMEOUT)
+    finally:
+        os.remove(path)
+    if logger:
+        logger.debug(f"Sampled {len(frames)} motion frames")
+    # Same format as the frames sent by the client
+    return [f"data:image/jpeg;base64,{frame}" for frame in frames]
+
+
+@idempotent
+async def storyimage_gen(request):
+    try:
+        data = await get_json(request)
+        if not data:
+            if logger:
+                logger.error("No data found in the request!")
+            return error("No data found!")
+
+        result = await llm.generate_story_image(data)
+        if logger:
+            logger.debug(f"Story image generated: {result}")
+        if image_mirror:
+            # Usually quick, fall back to the API URL if the download is slow
+            try:
+                mirrored = asyncio.wrap_future(image_mirror.submit(result["image_url"]))
+                mirrored = await asyncio.wait_for(mirrored, IMAGE_MIRROR_WAIT)
+                result = {**result, **mirrored}
+            except Exception as e:
+                if logger:
+                    logger.error(f"Could not mirror story image: {e}")
+        return success(
+            "Story image generated!",
+            data=story_image_data(result, str(request.base_url)),
+        )
+    except Exception as e:
+        return server_error(e)
+
+
+async def storyimage_get(request):
+    try:
+        job_id = request.path_params["job_id"]
+        wait = float(request.query_params.get("wait", IMAGE_JOB_WAIT))
+        job = await image_jobs.await_job(job_id, min(wait, IMAGE_JOB_WAIT))
+        if not job:
+            if logger:
+                logger.error(f"Image job not found: {job_id}")
+            return error("Image job not found!", 404)
+        if job["status"] == "pending":
+            return JSONResponse(
+                dict(
+                    type="pending",
+                    message="Story image pending!",
+                    status=202,
+                    data={"id": job_id},
+                )
+            )
+        if job["status"] == "error":
+            return error(job["error"], 500)
+        return success(
+            "Story image generated!",
+            data=story_image_data(job["result"], str(request.base_url)),
+        )
+    except Exception as e:
+        return server_error(e)
+
+
+async def translate_text(request):
+    try:
+        text = request.query_params.get("text")
+        src_lang = request.query_params.get("src_lang")
+        tgt_lang = request.query_params.get("tgt_lang")
+
+        if src_lang == tgt_lang:
+            if logger:
+                logger.debug("No translation needed!")
+            return success("No translation needed!", data={"text": text})
+
+        if logger:
+            logger.debug(f"Translating text from {src_lang} to {tgt_lang}")
+        result = await llm.translate_text(text, src_lang, tgt_lang)
+        return success("Text translated!", data={"text": result})
+    except Exception as e:
+        return server_error(e)
+
+
+async def translate_batch(request):
+    try:
+        data = await get_json(request)
+        if not data:
+            if logger:
+                logger.error("No data found in the request!")
+            return error("No data found!")
+
+        texts = data.get("texts", None)
+        src_lang = data.get("src_lang", None)
+        tgt_lang = data.get("tgt_lang", None)
+        if not isinstance(texts, list):
+            if logger:
+                logger.error("No texts found in the request!")
+            return error("No texts found!")
+
+        if src_lang == tgt_lang:
+            if logger:
+                logger.debug("No translation needed!")
+            return success("No translation needed!", data={"texts": texts})
+
+        if logger:
+            logger.debug(
+                f"Translating {len(texts)} texts from {src_lang} to {tgt_lang}"
+            )
+        result = await llm.translate_batch(texts, src_lang, tgt_lang)
+        return success("Texts translated!", data={"texts": result})
+    except Exception as e:
+        return server_error(e)
+
+
+async def read_text(request):
+    try:
+        text = request.query_params.get("text")
+        os = request.query_params.get("os", "undetermined")
+        pipeline = request.query_params.get("pipeline", "False").lower() in (
+            "true",
+            "1",
+            "t",
+        )
+        if logger:
+            logger.debug(f"Generating speech for: {text}")
+
+        # Pipelined mode synthesizes sentence by sentence to cut time-to-first-audio,
+        # always as MP3 (the only format whose segments can be concatenated)
+        mimetype = get_mimetype("ios" if pipeline else os)
+        tts = llm.send_tts_pipelined_request if pipeline else llm.send_tts_request
+        if not tts_cache:
+            return StreamingResponse(tts(text, os), media_type=mimetype)
+
+        key = tts_cache.key(text, llm.voice, llm.tts, mimetype, pipeline)
+        path = await asyncio.to_thread(tts_cache.get, key)
+        if path:
+            # Cached audio supports Range requests so clients can seek
+            return FileResponse(path, media_type=mimetype)
+        return StreamingResponse(
+            tts_cache.atee(key, tts(text, os)), media_type=mimetype
+        )
+    except Exception as e:
+        return server_error(e)
+
+
+async def not_found(request, exc):
+    return error("Not found!", status=404)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Pre-translate the fixed action texts in the background
+    warmup = None
+    if TRANSLATION_WARMUP and OPENAI_API_KEY:
+        warmup = asyncio.create_task(
+            llm.warm_translations(WARMUP_TEXTS, APP_LANGUAGES, APP_SOURCE_LANGUAGE)
+        )
+    yield
+    if warmup:
+        warmup.cancel()
+    await llm.aclose()
+
+
+app = Starlette(
+    routes=[
+        Route("/api", index, methods=["GET"]),
+        Route("/api/image", image_save, methods=["POST"]),
+        Route("/api/image/{img_name}", image_get, methods=["GET"]),
+        Route("/api/character", character_gen, methods=["POST"]),
+        Route("/api/character/{char_id}", character_get, methods=["GET"]),
+        Route("/api/session", session_init, methods=["GET"]),
+        Route("/api/session/{session_id}", session_get, methods=["GET"]),
+        Route("/api/story/premise", premise_gen, methods=["POST"]),
+        Route("/api/story/part", part_gen, methods=["POST"]),
+        Route("/api/story/init", story_init, methods=["POST"]),
+        Route("/api/story/end", story_end, methods=["POST"]),
+        Route("/api/story/part/stream", part_gen_stream, methods=["POST"]),
+        Route("/api/story/init/stream", story_init_stream, methods=["POST"]),
+        Route("/api/story/end/stream", story_end_stream, methods=["POST"]),
+        Route("/api/story/actions", actions_gen, methods=["POST"]),
+        Route("/api/story/motion", process_motion, methods=["POST"]),
+        Route("/api/story/image", storyimage_gen, methods=["POST"]),
+        Route("/api/story/image/{job_id}", storyimage_get, methods=["GET"]),
+        Route("/api/translate", translate_text, methods=["GET"]),
+        Route("/api/translate/batch", translate_batch, methods=["POST"]),
+        Route("/api/read", read_text, methods=["GET"]),
+    ],
+    middleware=[
+        Middleware(
+            CORSMiddleware,
+            allow_origins=["*"],
+            allow_methods=["*"],
+            allow_headers=["*"],
+        )
+    ],
+    exception_handlers={404: not_found},
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run("asgi:app", host=HOST, port=int(PORT))
@@ -0,0 +1,130 @@
+import argparse
+import base64
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import sample_frames, select_keyframes, contact_sheet
+from config import *
+
+# Compares the per-frame and contact sheet encodings of process_motion.
+# Usage: python benchmarks/motion_modes.py [clip ...] [--live --runs N]
+# Without clips, a 5 s 720x1280 clip of a moving figure is generated. Payload bytes
+# and estimated image tokens are always reported; --live also sends the requests
+# (needs OPENAI_API_KEY) and reports latency and how often the answer agrees.
+
+LOW_DETAIL_TOKENS = 85  # image tokens of a "low" detail image
+TILE_TOKENS = 170  # per 512px tile of a "high" detail image
+
+
+def make_clip(folder, seconds=5, fps=30, size=(720, 1280)):
+    # A figure that stands still, jumps and stands still again
+    path = os.path.join(folder, f"clip_{seconds}s.mp4")
+    width, height = size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    for i in range(seconds * fps):
+        t = i / (seconds * fps)
+        lift = int(300 * np.sin(np.pi * (t - 0.3) / 0.4)) if 0.3 < t < 0.7 else 0
+        frame = np.full((height, width, 3), 200, np.uint8)
+        top = 700 - lift
+        cv2.circle(frame, (width // 2, top), 60, (40, 40, 40), -1)
+        cv2.line(frame, (width // 2, top), (width // 2, top + 300), (40, 40, 40), 20)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def image_tokens(data_url, detail):
+    # Estimate of the vision tokens billed for one image: "high" detail images are
+    # fit in 2048x2048, scaled so the short side is at most 768 and cut in 512 tiles
+    if detail == "low":
+        return LOW_DETAIL_TOKENS
+    data = np.frombuffer(base64.b64decode(data_url.split(",", 1)[1]), np.uint8)
+    height, width = cv2.imdecode(data, cv2.IMREAD_COLOR).shape[:2]
+    scale = min(1, 2048 / max(height, width))
+    scale = min(scale, 768 / (min(height, width) * scale) * scale)
+    tiles = np.ceil(height * scale / 512) * np.ceil(width * scale / 512)
+    return LOW_DETAIL_TOKENS + TILE_TOKENS * int(tiles)
+
+
+def payloads(frames):
+    # (images, tiled, detail) for each mode
+    keyframes = select_keyframes(frames, MOTION_KEYFRAMES, MOTION_KEYFRAME_THRESHOLD)
+    sheet = contact_sheet(
+        keyframes, MOTION_CONTACT_SHEET_COLUMNS, MOTION_CONTACT_SHEET_WIDTH
+    )
+    return {
+        "per-frame": (keyframes, False, "low"),
+        "contact sheet": ([sheet], True, MOTION_CONTACT_SHEET_DETAIL),
+    }
+
+
+def run_live(storyteller, images, tiled, runs):
+    latencies = []
+    answers = []
+    for _ in range(runs):
+        messages = storyteller._process_motion_messages(images, tiled)
+        start = time.perf_counter()
+        result = storyteller._get_json_data(storyteller.send_gpt4_request(messages))
+        latencies.append(time.perf_counter() - start)
+        answers.append(str(result.get("action", "")).strip().lower())
+    return latencies, answers
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("clips", nargs="*")
+    parser.add_argument("--live", action="store_true")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    storyteller = None
+    if args.live:
+        from llm import Storyteller
+
+        storyteller = Storyteller(
+            os.environ.get("OPENAI_API_KEY"), os.environ.get("OPENAI_ORG_ID")
+        )
+
+    with tempfile.TemporaryDirectory() as folder:
+        clips = args.clips or [make_clip(folder)]
+        for clip in clips:
+            frames = [
+                f"data:image/jpeg;base64,{frame}"
+                for frame in sample_frames(
+                    clip, MOTION_FRAMES, MOTION_FRAME_MAX_EDGE, MOTION_FRAME_QUALITY
+                )
+            ]
+            print(f"{os.path.basename(clip)}: {len(frames)} sampled frames")
+            all_answers = {}
+            for name, (images, tiled, detail) in payloads(frames).items():
+                size = sum(len(image) for image in images) // 1024
+                tokens = sum(image_tokens(image, detail) for image in images)
+                line = f"  {name:<14} {len(images)} image(s), {size:5d} KB, ~{tokens} image tokens"
+                if storyteller:
+                    latencies, answers = run_live(storyteller, images, tiled, args.runs)
+                    top, count = Counter(answers).most_common(1)[0]
+                    all_answers[name] = top
+                    line += (
+                        f", p50 {statistics.median(latencies):.2f}s"
+                        f", max {max(latencies):.2f}s"
+                        f", stability {count}/{len(answers)} ('{top}')"
+                    )
+                print(line)
+            if storyteller:
+                print(
+                    f"  same answer in both modes: {len(set(all_answers.values())) == 1}"
+                )
+                print(f"  answers: {json.dumps(all_answers)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import argparse
+import base64
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import sample_frames
+from config import *
+
+# Benchmark of utils.sample_frames (one forward pass) against the previous
+# seek-per-frame sampler. The generated mp4v clips have 12-frame GOPs, which makes
+# seeking cheaper than on phone H.264 clips (1-2 s GOPs): pass real clips to
+# compare on the uploads the motion route actually gets.
+# Usage: python benchmarks/sample_frames.py [clip ...] [--repeat N]
+# Without clips, 5 to 20 s 720x1280@30fps clips are generated (like phone videos),
+# plus a 10 s webm clip (no frame count, sampled while counting).
+
+
+def sample_frames_seek(video_blob, n_frames=10):
+    # Previous implementation: seek to every sampled frame, encode at full size
+    video = cv2.VideoCapture(video_blob)
+    total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    interval = max(total_frames // n_frames, 1)
+    sampled_frames = []
+    for i in range(0, total_frames, interval):
+        video.set(cv2.CAP_PROP_POS_FRAMES, i)
+        ret, frame = video.read()
+        if not ret:
+            break
+        _, buffer = cv2.imencode(".jpg", frame)
+        sampled_frames.append(base64.b64encode(buffer).decode("utf-8"))
+        if len(sampled_frames) >= n_frames:
+            break
+    video.release()
+    return sampled_frames
+
+
+def make_clip(folder, seconds, fps=30, size=(720, 1280), ext="mp4", codec="mp4v"):
+    # A moving gradient with a bouncing square, with keyframes far apart
+    path = os.path.join(folder, f"clip_{seconds}s.{ext}")
+    width, height = size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, size)
+    horizontal = np.tile(np.linspace(0, 255, width, dtype=np.uint8), (height, 1))
+    vertical = np.tile(np.linspace(0, 255, height, dtype=np.uint8), (width, 1)).T
+    for i in range(seconds * fps):
+        frame = cv2.merge(
+            [np.roll(horizontal, i * 4, axis=1), vertical.copy(), horizontal]
+        )
+        x = int((width - 200) * abs(np.sin(i / fps)))
+        cv2.rectangle(frame, (x, 400), (x + 200, 600), (0, 0, 255), -1)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def measure(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        frames = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("clips", nargs="*")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--frames", type=int, default=MOTION_FRAMES)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        clips = args.clips or [
+            *(make_clip(folder, seconds) for seconds in (5, 8, 10, 20)),
+            make_clip(folder, 10, ext="webm", codec="VP80"),
+        ]
+        for clip in clips:
+            with open(clip, "rb") as f:
+                data = f.read()
+            cases = {
+                "seek (previous)": lambda: sample_frames_seek(clip, args.frames),
+                "sample_frames": lambda: sample_frames(clip, args.frames),
+                "sample_frames, bytes": lambda: sample_frames(data, args.frames),
+                f"sample_frames, {MOTION_FRAME_MAX_EDGE}px": lambda: sample_frames(
+                    clip, args.frames, MOTION_FRAME_MAX_EDGE, MOTION_FRAME_QUALITY
+                ),
+            }
+            if int(cv2.VideoCapture(clip).get(cv2.CAP_PROP_FRAME_COUNT)) <= 0:
+                # Without a frame count only sample_frames can sample the clip
+                cases = {
+                    name: fn
+                    for name, fn in cases.items()
+                    if name.startswith("sample_frames")
+                }
+            print(f"{os.path.basename(clip)} ({len(data) // 1024} KB)")
+            baseline = None
+            for name, fn in cases.items():
+                elapsed, frames = measure(fn, args.repeat)
+                baseline = baseline or elapsed
+                size = sum(len(frame) for frame in frames) // 1024
+                print(
+                    f"  {name:<24} {elapsed * 1000:8.1f} ms  {baseline / elapsed:5.2f}x"
+                    f"  {len(frames)} frames, {size} KB base64"
+                )
+
+
+if __name__ == "__main__":
+    main()
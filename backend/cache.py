@@ -0,0 +1,484 @@
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import sqlite3
+import threading
+import time
+import unicodedata
+import uuid
+from collections import OrderedDict
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import logger_setup
+from config import *
+
+from dotenv import load_dotenv
+
+load_dotenv()
+LOGGER = os.environ.get("LOGGER", "False").lower() in ("true", "1", "t")
+
+if LOGGER:
+    logger = logger_setup("cache", os.path.join(LOG_FOLDER, "cache.log"))
+else:
+    logger = None
+
+
+class AudioCache:
+    # Disk-backed, content-addressed cache for TTS audio.
+    # Files are named by the hash of what produced them, so every worker sharing the
+    # folder sees the same entries. Recency is tracked with the file mtime (LRU).
+
+    def __init__(self, folder, max_size) -> None:
+        self.folder = folder
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        os.makedirs(self.folder, exist_ok=True)
+
+    def key(self, text, voice, model, mimetype, pipeline=False):
+        # Pipelined audio is stitched from segments, it is cached apart
+        payload = json.dumps(
+            [text, voice, model, mimetype, pipeline], ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.folder, key)
+
+    def get(self, key):
+        # Return the cached file path (and mark it as recently used), or None
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        if logger:
+            logger.debug(f"Audio cache hit: {key}")
+        return path
+
+    def tee(self, key, chunks):
+        # Yield the upstream chunks while writing them to the cache
+        tmp_path = f"{self.path(key)}.{uuid.uuid4().hex}.part"
+        complete = False
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            complete = True
+        finally:
+            self.__commit(key, tmp_path, complete)
+
+    async def atee(self, key, chunks):
+        # Async version of tee() for the ASGI entry point, the file I/O (and the
+        # eviction scan) runs in threads
+        tmp_path = f"{self.path(key)}.{uuid.uuid4().hex}.part"
+        complete = False
+        try:
+            f = await asyncio.to_thread(open, tmp_path, "wb")
+            try:
+                async for chunk in chunks:
+                    await asyncio.to_thread(f.write, chunk)
+                    yield chunk
+            finally:
+                await asyncio.to_thread(f.close)
+            complete = True
+        finally:
+            await asyncio.to_thread(self.__commit, key, tmp_path, complete)
+
+    def __commit(self, key, tmp_path, complete):
+        # Only keep fully streamed, non-empty responses
+        if complete and os.path.getsize(tmp_path) > 0:
+            os.replace(tmp_path, self.path(key))
+            if logger:
+                logger.debug(f"Audio cached: {key}")
+            self.__evict()
+        else:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+
+    def __evict(self):
+        # Remove the least recently used files until the folder fits in max_size
+        with self.lock:
+            entries = []
+            total = 0
+            with os.scandir(self.folder) as it:
+                for entry in it:
+                    if not entry.is_file() or entry.name.endswith(".part"):
+                        continue
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            if total <= self.max_size:
+                return
+            entries.sort()
+            for _, size, path in entries:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                if logger:
+                    logger.debug(f"Audio cache evicted: {path}")
+                if total <= self.max_size:
+                    break
+
+
+class TranslationMemory:
+    # Two-tier translation memory keyed by normalized (text, source, target).
+    # An in-process LRU sits in front of a SQLite file shared by all workers.
+    # Entries expire after `ttl` seconds, the file keeps at most `max_rows` rows.
+
+    PRUNE_EVERY = 100  # puts between size checks of the SQLite tier
+    TOUCH_INTERVAL = 3600  # seconds, a hit refreshes an older "used" stamp only
+
+    def __init__(self, max_entries, path=None, max_rows=None, ttl=None) -> None:
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.puts = 0
+        self.db = None
+        if path:
+            try:
+                self.db = self.__connect(path)
+            except sqlite3.Error as e:
+                if logger:
+                    logger.error(f"Translation memory database unavailable: {e}")
+
+    @staticmethod
+    def key(text, source, target):
+        text = unicodedata.normalize("NFC", " ".join(str(text).split()))
+        source = str(source).strip().lower()
+        target = str(target).strip().lower()
+        payload = json.dumps([text, source, target], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, text, source, target):
+        key = self.key(text, source, target)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and (not self.ttl or entry[1] > now - self.ttl):
+                self.entries.move_to_end(key)
+                return entry[0]
+            if entry:
+                del self.entries[key]
+        translation = self.__db_get(key, now)
+        if translation is not None:
+            self.__remember(key, translation, now)
+        return translation
+
+    def put(self, text, source, target, translation):
+        key = self.key(text, source, target)
+        now = time.time()
+        self.__remember(key, translation, now)
+        self.__db_put(key, translation, now)
+
+    def __remember(self, key, translation, created):
+        with self.lock:
+            self.entries[key] = (translation, created)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    # -- SQLite tier --
+
+    def __connect(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            "key TEXT PRIMARY KEY, translation TEXT, created REAL, used REAL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS translations_used ON translations(used)")
+        db.commit()
+        return db
+
+    def __db_get(self, key, now):
+        if not self.db:
+            return None
+        try:
+            with self.lock:
+                row = self.db.execute(
+                    "SELECT translation, created, used FROM translations "
+                    "WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if not row:
+                    return None
+                if self.ttl and row[1] <= now - self.ttl:
+                    self.db.execute("DELETE FROM translations WHERE key = ?", (key,))
+                    self.db.commit()
+                    return None
+                # Pruning only needs a coarse LRU order, so most hits stay read-only
+                if row[2] <= now - self.TOUCH_INTERVAL:
+                    self.db.execute(
+                        "UPDATE translations SET used = ? WHERE key = ?", (now, key)
+                    )
+                    self.db.commit()
+                return row[0]
+        except sqlite3.Error as e:
+            if logger:
+                logger.error(f"Translation memory read failed: {e}")
+            return None
+
+    def __db_put(self, key, translation, now):
+        if not self.db:
+            return
+        try:
+            with self.lock:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)",
+                    (key, translation, now, now),
+                )
+                self.puts += 1
+                if self.puts % self.PRUNE_EVERY == 0:
+                    self.__db_prune(now)
+                self.db.commit()
+        except sqlite3.Error as e:
+            if logger:
+                logger.error(f"Translation memory write failed: {e}")
+
+    def __db_prune(self, now):
+        # Drop expired rows, then the least recently used ones over max_rows
+        if self.ttl:
+            self.db.execute(
+                "DELETE FROM translations WHERE created <= ?", (now - self.ttl,)
+            )
+        if self.max_rows:
+            self.db.execute(
+                "DELETE FROM translations WHERE key IN ("
+                "SELECT key FROM translations ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (self.max_rows,),
+            )
+
+
+class ImageCache:
+    # In-memory LRU of hot image bytes for /api/image, bounded by total size.
+    # Stored images are never rewritten (names are uuids or content hashes), so an
+    # entry stays valid for as long as it is cached. Files over `max_item_size`
+    # only keep their ETag here and are still streamed from disk. Every entry is
+    # also charged ENTRY_SIZE bytes, which bounds the number of ETag-only entries.
+
+    CHUNK_SIZE = 64 * 1024
+    ENTRY_SIZE = 1024  # name, ETag and bookkeeping of an entry
+
+    def __init__(self, max_size, max_item_size) -> None:
+        self.max_size = max_size
+        self.max_item_size = max_item_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # name -> (data or None, etag)
+        self.size = 0
+
+    def get(self, folder, name):
+        # Return (data, etag), data is None for files served from disk.
+        # Raises FileNotFoundError if the image does not exist.
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry:
+                self.entries.move_to_end(name)
+                return entry
+
+        path = os.path.join(folder, name)
+        size = os.path.getsize(path)
+        if size <= self.max_item_size:
+            with open(path, "rb") as f:
+                data = f.read()
+            etag = hashlib.sha256(data).hexdigest()
+        else:
+            data = None
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                while chunk := f.read(self.CHUNK_SIZE):
+                    digest.update(chunk)
+            etag = digest.hexdigest()
+        self.__remember(name, data, etag)
+        return data, etag
+
+    def __remember(self, name, data, etag):
+        with self.lock:
+            old = self.entries.pop(name, None)
+            if old:
+                self.size -= self.__cost(old[0])
+            self.entries[name] = (data, etag)
+            self.size += self.__cost(data)
+            while self.size > self.max_size and self.entries:
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.size -= self.__cost(evicted)
+                if logger:
+                    logger.debug(f"Image cache evicted, {self.size} bytes cached")
+
+    def __cost(self, data):
+        return self.ENTRY_SIZE + (len(data) if data else 0)
+
+
+class CharacterCache:
+    # Persistent cache of character results, keyed by a perceptual hash (64 bit
+    # dHash) of the drawing and the complexity. Re-photographed drawings hash to
+    # nearby values, so a lookup matches anything within `max_distance` bits.
+    # The hash is split into max_distance + 1 bands: two hashes that close must
+    # share at least one band exactly, so only rows sharing a band are compared
+    # (multi-index hashing) and the lookup stays fast as the table grows.
+
+    HASH_BITS = 64
+    PRUNE_EVERY = 100  # puts between size checks
+
+    def __init__(self, path, max_distance, max_rows) -> None:
+        self.max_distance = max_distance
+        self.max_rows = max_rows
+        self.bands = self.__bands(max_distance + 1)
+        self.lock = threading.Lock()
+        self.puts = 0
+        self.db = None
+        try:
+            self.db = self.__connect(path)
+        except sqlite3.Error as e:
+            if logger:
+                logger.error(f"Character cache database unavailable: {e}")
+
+    @staticmethod
+    def key(complexity):
+        return json.dumps(complexity, sort_keys=True, ensure_ascii=False)
+
+    def get(self, image_hash, complexity):
+        # Return the closest cached result within max_distance, or None
+        if not self.db or image_hash is None:
+            return None
+        key = self.key(complexity)
+        clauses = " OR ".join(f"b{i} = ?" for i in range(len(self.bands)))
+        try:
+            with self.lock:
+                rows = self.db.execute(
+                    f"SELECT id, hash, result FROM characters "
+                    f"WHERE complexity = ? AND ({clauses})",
+                    (key, *self.__split(image_hash)),
+                ).fetchall()
+                best = None
+                for row_id, row_hash, result in rows:
+                    distance = (int(row_hash, 16) ^ image_hash).bit_count()
+                    if distance <= self.max_distance and (
+                        not best or distance < best[0]
+                    ):
+                        best = (distance, row_id, result)
+                if not best:
+                    return None
+                self.db.execute(
+                    "UPDATE characters SET used = ? WHERE id = ?",
+                    (time.time(), best[1]),
+                )
+                self.db.commit()
+        except sqlite3.Error as e:
+            if logger:
+                logger.error(f"Character cache read failed: {e}")
+            return None
+        if logger:
+            logger.debug(f"Character cache hit: {image_hash:016x} (d={best[0]})")
+        return json.loads(best[2])
+
+    def put(self, image_hash, complexity, result):
+        if not self.db or image_hash is None:
+            return
+        now = time.time()
+        try:
+            with self.lock:
+                self.db.execute(
+                    "INSERT INTO characters (hash, complexity, result, created, used, "
+                    + ", ".join(f"b{i}" for i in range(len(self.bands)))
+                    + ") VALUES (?, ?, ?, ?, ?"
+                    + ", ?" * len(self.bands)
+                    + ")",
+                    (
+                        f"{image_hash:016x}",
+                        self.key(complexity),
+                        json.dumps(result),
+                        now,
+                        now,
+                        *self.__split(image_hash),
+                    ),
+                )
+                self.puts += 1
+                if self.max_rows and self.puts % self.PRUNE_EVERY == 0:
+                    self.db.execute(
+                        "DELETE FROM characters WHERE id IN ("
+                        "SELECT id FROM characters ORDER BY used DESC "
+                        "LIMIT -1 OFFSET ?)",
+                        (self.max_rows,),
+                    )
+                self.db.commit()
+        except sqlite3.Error as e:
+            if logger:
+                logger.error(f"Character cache write failed: {e}")
+
+    def __create_table(self, db, name):
+        columns = "".join(f", b{i} INTEGER" for i in range(len(self.bands)))
+        db.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} (id INTEGER PRIMARY KEY, "
+            f"hash TEXT, complexity TEXT, result TEXT, created REAL, used REAL{columns})"
+        )
+
+    def __rebuild_bands(self, db):
+        # The bands depend on max_distance. When it changed since the table was
+        # made, the stored band values would never match a lookup again, so the
+        # rows are copied into a table with the new bands.
+        stored = [
+            row[1]
+            for row in db.execute("PRAGMA table_info(characters)")
+            if row[1].startswith("b") and row[1][1:].isdigit()
+        ]
+        if len(stored) == len(self.bands):
+            return
+        for i in range(len(stored)):
+            db.execute(f"DROP INDEX IF EXISTS characters_b{i}")
+        db.execute("DROP INDEX IF EXISTS characters_used")
+        db.execute("ALTER TABLE characters RENAME TO characters_old")
+        self.__create_table(db, "characters")
+        rows = db.execute(
+            "SELECT id, hash, complexity, result, created, used FROM characters_old"
+        ).fetchall()
+        db.executemany(
+            "INSERT INTO characters VALUES (?, ?, ?, ?, ?, ?"
+            + ", ?" * len(self.bands)
+            + ")",
+            [(*row, *self.__split(int(row[1], 16))) for row in rows],
+        )
+        db.execute("DROP TABLE characters_old")
+        if logger:
+            logger.warning(
+                f"Character cache bands rebuilt for max_distance={self.max_distance} "
+                f"({len(rows)} rows)"
+            )
+
+    def __bands(self, count):
+        # (shift, mask) of each band, spreading the bits as evenly as possible
+        bands = []
+        shift = 0
+        for i in range(count):
+            width = self.HASH_BITS // count + (i < self.HASH_BITS % count)
+            bands.append((shift, (1 << width) - 1))
+            shift += width
+        return bands
+
+    def __split(self, image_hash):
+        return [(image_hash >> shift) & mask for shift, mask in self.bands]
+
+    def __connect(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("BEGIN IMMEDIATE")
+        self.__create_table(db, "characters")
+        self.__rebuild_bands(db)
+        for i in range(len(self.bands)):
+            db.execute(
+                f"CREATE INDEX IF NOT EXISTS characters_b{i} "
+                f"ON characters(b{i}, complexity)"
+            )
+        db.execute("CREATE INDEX IF NOT EXISTS characters_used ON characters(used)")
+        db.commit()
+        return db
@@ -0,0 +1,196 @@
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import threading
+from concurrent.futures import Future
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import logger_setup
+from config import *
+
+from dotenv import load_dotenv
+
+load_dotenv()
+LOGGER = os.environ.get("LOGGER", "False").lower() in ("true", "1", "t")
+
+if LOGGER:
+    logger = logger_setup("coalesce", os.path.join(LOG_FOLDER, "coalesce.log"))
+else:
+    logger = None
+
+
+class SingleFlight:
+    # Coalesces identical in-flight calls within a worker: the first caller runs
+    # the upstream request, callers with the same key that arrive before it ends
+    # share its result (or error). Nothing is kept once the call is done.
+    # do()/stream() serve threads, ado()/astream() serve an asyncio event loop.
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.calls = {}  # key -> Future (threads)
+        self.tasks = {}  # key -> [asyncio.Task, waiters]
+        self.streams = {}  # key -> _Broadcast (threads)
+        self.astreams = {}  # key -> _AsyncBroadcast
+
+    @staticmethod
+    def key(method, model, *params):
+        payload = json.dumps(
+            [method, model, *params], sort_keys=True, ensure_ascii=False, default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def do(self, key, fn):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+        if not leader:
+            self.__joined(key)
+            return future.result()
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+        return future.result()
+
+    async def ado(self, key, fn):
+        # fn() returns a coroutine. The shared task survives a cancelled caller,
+        # it is only cancelled when nobody is waiting for it any more.
+        entry = self.tasks.get(key)
+        if entry:
+            self.__joined(key)
+        else:
+            entry = self.tasks[key] = [asyncio.create_task(fn()), 0]
+            entry[0].add_done_callback(lambda _: self.__forget(key, entry))
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            entry[1] -= 1
+            if not entry[1] and not task.done():
+                task.cancel()
+
+    def __forget(self, key, entry):
+        if self.tasks.get(key) is entry:
+            del self.tasks[key]
+
+    def stream(self, key, fn):
+        # fn() returns an iterator of chunks. A background thread reads it once and
+        # every caller replays the chunks from the start, at its own pace.
+        with self.lock:
+            broadcast = self.streams.get(key)
+            if broadcast:
+                self.__joined(key)
+            else:
+                broadcast = self.streams[key] = _Broadcast()
+                threading.Thread(
+                    target=self.__pump, args=(key, broadcast, fn), daemon=True
+                ).start()
+        yield from broadcast.replay()
+
+    async def astream(self, key, fn):
+        # Async version of stream(), fn() returns an async iterator
+        broadcast = self.astreams.get(key)
+        if broadcast:
+            self.__joined(key)
+        else:
+            broadcast = self.astreams[key] = _AsyncBroadcast()
+            broadcast.task = asyncio.create_task(self.__apump(key, broadcast, fn))
+        async for chunk in broadcast.replay():
+            yield chunk
+
+    def __pump(self, key, broadcast, fn):
+        try:
+            for chunk in fn():
+                broadcast.append(chunk)
+        except BaseException as e:
+            broadcast.error = e
+        finally:
+            with self.lock:
+                self.streams.pop(key, None)
+            broadcast.close()
+
+    async def __apump(self, key, broadcast, fn):
+        try:
+            async for chunk in fn():
+                broadcast.append(chunk)
+        except BaseException as e:
+            broadcast.error = e
+        finally:
+            self.astreams.pop(key, None)
+            broadcast.close()
+
+    def __joined(self, key):
+        if logger:
+            logger.debug(f"Joined in-flight call {key[:12]}")
+
+
+class _Broadcast:
+    def __init__(self) -> None:
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.condition = threading.Condition()
+
+    def append(self, chunk):
+        with self.condition:
+            self.chunks.append(chunk)
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.done = True
+            self.condition.notify_all()
+
+    def replay(self):
+        index = 0
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: index < len(self.chunks) or self.done)
+                chunks = self.chunks[index:]
+                done = self.done
+            index += len(chunks)
+            yield from chunks
+            if done and index >= len(self.chunks):
+                break
+        if self.error:
+            raise self.error
+
+
+class _AsyncBroadcast:
+    def __init__(self) -> None:
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.task = None
+        self.changed = asyncio.Event()
+
+    def append(self, chunk):
+        self.chunks.append(chunk)
+        self.changed.set()
+
+    def close(self):
+        self.done = True
+        self.changed.set()
+
+    async def replay(self):
+        index = 0
+        while True:
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.done:
+                break
+            self.changed.clear()
+            if index < len(self.chunks) or self.done:
+                continue
+            await self.changed.wait()
+        if self.error:
+            raise self.error
@@ -5,17 +5,177 @@ MODEL_GPT3 = "gpt-3.5-turbo"
 MODEL_IMAGE_GEN = "dall-e-2"
 MODEL_TTS = "tts-1"
 MODEL_STT = "whisper-1"
+TTS_VOICE = "echo"
 # NOTE: If using dall-e-3, change the resolution to "1024x1024"
 IMAGE_GEN_RESOLUTION = "256x256"
 
 # App settings
 APP_IMAGE_EXT = ["jpg", "jpeg", "png"]
+APP_IMAGE_MAX_SIZE = 10 * 1024 * 1024  # bytes, for multipart/raw uploads
+UPLOAD_FORM_OVERHEAD = 64 * 1024  # bytes of multipart framing allowed over a file
 FLASK_DEBUG = True
 PREMISE_GEN_COUNT = 3
 ACTION_GEN_COUNT = 2
+# Actions offered on every turn, after the generated ones
+FIXED_ACTIONS = [
+    {
+        "title": "Motion Capture",
+        "desc": "Use your body to progress the story!",
+    },
+    {
+        "title": "Ending",
+        "desc": "Bring the story to an end and see what happens!",
+    },
+]
+# Languages offered by the frontend (see languageOptions)
+APP_LANGUAGES = ["en", "he", "ja", "es"]
+APP_SOURCE_LANGUAGE = "en"
+
+# Generated image mirroring (copied into STORAGE_PATH and served by /api/image)
+IMAGE_MIRROR = True
+IMAGE_MIRROR_WORKERS = 4
+IMAGE_MIRROR_WAIT = 5  # max seconds /api/story/image waits before using the API URL
+IMAGE_VARIANT_SIZES = [128, 256, 512]
+IMAGE_VARIANT_QUALITY = 80
+
+# Vision input (drawings are shrunk before they are sent to MODEL_VISION)
+VISION_IMAGE_MAX_EDGE = 768  # pixels
+VISION_IMAGE_FORMAT = "JPEG"  # or "WEBP"
+VISION_IMAGE_QUALITY = 85
+
+# Character cache (near-duplicate drawings reuse the generated character)
+CHARACTER_CACHE_ENABLED = True
+CHARACTER_CACHE_DB = "cache/characters.sqlite3"  # shared by all workers
+# Max differing bits (of 64) between perceptual hashes to count as the same drawing.
+# The lookup bands depend on it, they are rebuilt when the database is opened with
+# a new value.
+CHARACTER_CACHE_DISTANCE = 3
+CHARACTER_CACHE_MAX_ROWS = 500000
+
+# Motion capture frames (sampled from uploaded clips)
+MOTION_FRAMES = 10
+MOTION_FRAME_MAX_EDGE = 512  # pixels, frames are downscaled before JPEG encoding
+MOTION_FRAME_QUALITY = 80
+MOTION_KEYFRAMES = 6  # frames sent to the model (first and last always included)
+MOTION_KEYFRAME_THRESHOLD = 1.0  # min mean pixel change (0-255) for a frame to count
+# Contact sheet mode: send the keyframes tiled into one labeled image
+MOTION_CONTACT_SHEET = False
+MOTION_CONTACT_SHEET_COLUMNS = 3
+MOTION_CONTACT_SHEET_WIDTH = 768  # pixels
+MOTION_CONTACT_SHEET_DETAIL = "low"  # "low" or "high" vision detail
+MOTION_VIDEO_MAX_SIZE = 50 * 1024 * 1024  # bytes, for uploaded clips
+MOTION_WORKERS = 2  # sampling processes per worker
+MOTION_MAX_PENDING = 8  # queued clips per worker before uploads are turned away
+MOTION_TIMEOUT = 60  # max seconds to sample a clip
+
+# Image serving (/api/image/<img_name>)
+IMAGE_CACHE_SIZE = 64 * 1024 * 1024  # bytes of hot images kept in memory per worker
+IMAGE_CACHE_MAX_ITEM = 4 * 1024 * 1024  # larger files are streamed from disk
+IMAGE_CACHE_MAX_AGE = 365 * 24 * 3600  # seconds, for immutable image names
+
+# Story image jobs (started from the keymoment alongside story generation)
+IMAGE_JOB_FOLDER = "cache/jobs"
+IMAGE_JOB_TTL = 600  # seconds
+IMAGE_JOB_WORKERS = 8
+IMAGE_JOB_WAIT = 20  # max seconds a GET waits for the image
+
+# Server-side sessions (character, premise and story of each client session)
+SESSION_BACKEND = "sqlite"  # "sqlite" (shared by all workers) or "memory"
+SESSION_DB = "cache/sessions.sqlite3"
+SESSION_TTL = 24 * 3600  # seconds since the session was last updated
+
+# Idempotency-Key requests (retries get the response of the original request)
+IDEMPOTENCY_DB = "cache/idempotency.sqlite3"  # shared by all workers
+IDEMPOTENCY_TTL = 600  # seconds a response is replayed
+IDEMPOTENCY_LEASE = 180  # seconds before an unfinished request is presumed lost
+IDEMPOTENCY_WAIT = 60  # max seconds a retry waits for the original request
+IDEMPOTENCY_MAX_KEY = 255  # characters
+
+# Speculative story parts (pre-generate the next part for each offered action)
+SPECULATIVE_MODE = False
+SPECULATIVE_TURN_BUDGET = 2  # max speculative parts per offered set of actions
+SPECULATIVE_SESSION_BUDGET = 20  # max speculative parts over a whole session
+SPECULATIVE_WORKERS = 8
+SPECULATIVE_TTL = 120  # seconds
 
 # LLM settings
 LLM_DEBUG = True
 
+# Model routing (per worker): each route has a quality tier and a latency budget
+ROUTER_ENABLED = True
+ROUTER_TIERS = {
+    "quality": [MODEL_GPT4, MODEL_GPT3],  # preferred model first, then fallbacks
+    "fast": [MODEL_GPT3],
+}
+ROUTER_ROUTES = {
+    "init": {"tier": "quality", "budget": 12.0},  # seconds (p95)
+    "story_part": {"tier": "quality", "budget": 10.0},
+    "actions": {"tier": "quality", "budget": 8.0},
+    "premise": {"tier": "fast", "budget": 8.0},
+    "end": {"tier": "fast", "budget": 10.0},
+}
+ROUTER_WINDOW = 50  # latest requests kept per model
+ROUTER_MAX_AGE = 300  # seconds before a sample is forgotten
+ROUTER_MIN_SAMPLES = 5  # a model is trusted until it has this many samples
+ROUTER_MAX_ERROR_RATE = 0.25
+
+# Upstream protection (shared by all workers through RATE_LIMIT_DB)
+RATE_LIMIT_DB = "cache/limits.sqlite3"
+RATE_LIMITS = {  # per minute: "rpm" requests and "tpm" (estimated) tokens
+    MODEL_GPT4: {"rpm": 500, "tpm": 30000},
+    MODEL_GPT3: {"rpm": 500, "tpm": 200000},
+    MODEL_IMAGE_GEN: {"rpm": 5},
+    MODEL_TTS: {"rpm": 50},
+    MODEL_STT: {"rpm": 50},
+}
+RATE_LIMIT_MAX_WAIT = 20  # seconds, longer waits fail right away
+RETRY_MAX_ATTEMPTS = 4
+RETRY_BASE_DELAY = 0.5  # seconds, doubled each attempt (with full jitter)
+RETRY_MAX_DELAY = 8.0
+CIRCUIT_FAILURES = 5  # consecutive upstream failures that open the circuit
+CIRCUIT_COOLDOWN = 30  # seconds before a trial request is let through
+
+# Hedged requests (a duplicate is sent when a call is slower than usual)
+HEDGE_ENABLED = False
+HEDGE_ROUTES = ["init", "story_part", "actions"]
+HEDGE_PERCENTILE = 0.9  # of the route's recent latencies, before hedging
+HEDGE_WINDOW = 200  # latest latencies kept per route
+HEDGE_MIN_SAMPLES = 20  # no hedging until a route has this many
+HEDGE_MAX_RATE = 0.05  # max hedges per request
+HEDGE_RATE_WINDOW = 300  # seconds
+HEDGE_WORKERS = 16
+
+# Story context (older parts are folded into a running summary)
+STORY_CONTEXT_MAX_TOKENS = 1200  # approximate ceiling for the story in prompts
+STORY_CONTEXT_RECENT_PARTS = 8  # parts (sentences, for plain text) kept verbatim
+STORY_CONTEXT_CACHE_SIZE = 1024  # cached summaries per worker
+
+# HTTP transport (one pool per worker, shared by all Storyteller requests)
+HTTP_POOL_SIZE = 20
+HTTP_KEEPALIVE_SIZE = 10
+HTTP_KEEPALIVE_EXPIRY = 30.0
+# NOTE: HTTP/2 requires the `h2` package (pip install httpx[http2])
+HTTP2 = False
+HTTP_CONNECT_TIMEOUT = 5.0
+HTTP_READ_TIMEOUT = 60.0
+
+# TTS pipelining (sentence-by-sentence synthesis for /api/read?pipeline=true)
+TTS_PIPELINE_CONCURRENCY = 3
+TTS_PIPELINE_MIN_CHARS = 40  # merge shorter sentences into the next one
+
+# Cache settings
+TTS_CACHE_ENABLED = True
+TTS_CACHE_FOLDER = "cache/tts"
+TTS_CACHE_MAX_SIZE = 512 * 1024 * 1024  # bytes
+
+# Translation settings
+TRANSLATION_CACHE_SIZE = 4096  # in-process entries per worker
+TRANSLATION_DB = "cache/translations.sqlite3"  # shared by all workers
+TRANSLATION_DB_MAX_ROWS = 100000
+TRANSLATION_TTL = 30 * 24 * 60 * 60  # seconds
+TRANSLATION_WARMUP = True  # pre-translate FIXED_ACTIONS on startup
+TRANSLATE_BATCH_MAX_ITEMS = 20  # strings per LLM request
+TRANSLATE_BATCH_MAX_CHARS = 4000  # characters per LLM request
+
 # General settings
 LOG_FOLDER = "logs"
@@ -0,0 +1,187 @@
+import asyncio
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import logger_setup
+from config import *
+
+from dotenv import load_dotenv
+
+load_dotenv()
+LOGGER = os.environ.get("LOGGER", "False").lower() in ("true", "1", "t")
+
+if LOGGER:
+    logger = logger_setup("idempotency", os.path.join(LOG_FOLDER, "idempotency.log"))
+else:
+    logger = None
+
+
+class IdempotencyStore:
+    # Responses of requests sent with an Idempotency-Key, so a retried request
+    # gets the response of the original instead of a new generation.
+    # Entries live in SQLite so every worker sees them. The first request with a
+    # key claims it and stores its response with finish() (or gives the key up
+    # with release() when it failed); a retry arriving in the meantime waits for
+    # it. Responses are kept for `ttl` seconds, and a claim older than `lease`
+    # seconds that never finished (a worker died) can be taken over.
+
+    POLL_INTERVAL = 0.25
+
+    def __init__(self, path, ttl, lease) -> None:
+        self.ttl = ttl
+        self.lease = lease
+        self.lock = threading.Lock()
+        self.local = {}  # key -> threading.Event of claims made by this worker
+        self.db = None
+        try:
+            self.db = self.__connect(path)
+        except sqlite3.Error as e:
+            if logger:
+                logger.error(f"Idempotency database unavailable: {e}")
+
+    def acquire(self, key, fingerprint, timeout):
+        # None when the caller must run the request, then finish() or release() it.
+        # Otherwise the entry of the original request ({"fingerprint", "status",
+        # "body", "mimetype"}), with status None if it still runs after `timeout`.
+        deadline = time.monotonic() + timeout
+        while True:
+            entry = self.__claim(key, fingerprint)
+            if not self.__running(entry, fingerprint):
+                return entry
+            while self.__running(entry, fingerprint):
+                if time.monotonic() >= deadline:
+                    return entry
+                event = self.local.get(key)
+                if event:
+                    event.wait(max(0, deadline - time.monotonic()))
+                else:
+                    time.sleep(self.POLL_INTERVAL)
+                entry = self.get(key)
+
+    async def aacquire(self, key, fingerprint, timeout):
+        # Async version of acquire(), the SQLite calls run in a thread
+        deadline = time.monotonic() + timeout
+        while True:
+            entry = await asyncio.to_thread(self.__claim, key, fingerprint)
+            if not self.__running(entry, fingerprint):
+                return entry
+            while self.__running(entry, fingerprint):
+                if time.monotonic() >= deadline:
+                    return entry
+                await asyncio.sleep(self.POLL_INTERVAL)
+                entry = await asyncio.to_thread(self.get, key)
+
+    def get(self, key):
+        if not self.db:
+            return None
+        try:
+            with self.lock:
+                # Running entries expire after the lease, responses after the TTL
+                now = time.time()
+                row = self.db.execute(
+                    "SELECT fingerprint, status, body, mimetype FROM results "
+                    "WHERE key = ? AND created >= "
+                    "CASE WHEN status IS NULL THEN ? ELSE ? END",
+                    (key, now - self.lease, now - self.ttl),
+                ).fetchone()
+        except sqlite3.Error as e:
+            if logger:
+                logger.error(f"Idempotency lookup failed: {e}")
+            return None
+        if not row:
+            return None
+        return dict(zip(("fingerprint", "status", "body", "mimetype"), row))
+
+    def finish(self, key, status, body, mimetype):
+        self.__update(
+            "UPDATE results SET status = ?, body = ?, mimetype = ?, created = ? "
+            "WHERE key = ?",
+            (status, body, mimetype, time.time(), key),
+        )
+        self.__done(key)
+
+    def release(self, key):
+        self.__update("DELETE FROM results WHERE key = ?", (key,))
+        self.__done(key)
+
+    @staticmethod
+    def __running(entry, fingerprint):
+        return (
+            entry is not None
+            and entry["status"] is None
+            and entry["fingerprint"] == fingerprint
+        )
+
+    def __connect(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        db = sqlite3.connect(
+            path, timeout=5, check_same_thread=False, isolation_level=None
+        )
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, "
+            "fingerprint TEXT, status INTEGER, body BLOB, mimetype TEXT, created REAL)"
+        )
+        return db
+
+    def __claim(self, key, fingerprint):
+        # Insert a running entry for the key unless a live one exists, in which
+        # case that one is returned
+        while self.db:
+            entry = self.__insert(key, fingerprint)
+            if entry is not False:
+                return entry
+        return None
+
+    def __insert(self, key, fingerprint):
+        # None when claimed, else the live entry (False if it just went away)
+        now = time.time()
+        try:
+            with self.lock:
+                self.db.execute(
+                    "DELETE FROM results WHERE created < ? AND status IS NOT NULL",
+                    (now - self.ttl,),
+                )
+                claimed = self.db.execute(
+                    "INSERT INTO results VALUES (?, ?, NULL, NULL, NULL, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET "
+                    "fingerprint = excluded.fingerprint, "
+                    "status = NULL, body = NULL, mimetype = NULL, "
+                    "created = excluded.created WHERE status IS NULL AND created < ?",
+                    (key, fingerprint, now, now - self.lease),
+                ).rowcount
+                if claimed:
+                    self.local[key] = threading.Event()
+        except sqlite3.Error as e:
+            if logger:
+                logger.error(f"Idempotency claim failed: {e}")
+            return None
+        if claimed:
+            return None
+        entry = self.get(key)
+        if not entry:
+            return False
+        if logger:
+            state = "running" if entry["status"] is None else "done"
+            logger.info(f"Retried request joins the original ({state}): {key}")
+        return entry
+
+    def __update(self, sql, params):
+        if not self.db:
+            return
+        try:
+            with self.lock:
+                self.db.execute(sql, params)
+        except sqlite3.Error as e:
+            if logger:
+                logger.error(f"Idempotency update failed: {e}")
+
+    def __done(self, key):
+        with self.lock:
+            event = self.local.pop(key, None)
+        if event:
+            event.set()
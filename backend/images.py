@@ -0,0 +1,167 @@
+import base64
+import hashlib
+import os
+import sys
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import httpx
+from PIL import Image, ImageOps
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import logger_setup
+from coalesce import SingleFlight
+from config import *
+
+from dotenv import load_dotenv
+
+load_dotenv()
+LOGGER = os.environ.get("LOGGER", "False").lower() in ("true", "1", "t")
+
+if LOGGER:
+    logger = logger_setup("images", os.path.join(LOG_FOLDER, "images.log"))
+else:
+    logger = None
+
+
+class ImageMirror:
+    # Copies generated images from the API's temporary URLs into our own storage.
+    # Files are content-addressed (img_<sha256>.<ext>), so the same image is only
+    # stored once, and pre-scaled WEBP variants are written next to the original.
+
+    def __init__(self, folder, sizes, workers) -> None:
+        self.folder = folder
+        self.sizes = sorted(sizes)
+        self.http = httpx.Client(
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+        )
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.flights = SingleFlight()
+        os.makedirs(self.folder, exist_ok=True)
+
+    def submit(self, url):
+        return self.executor.submit(self.fetch, url)
+
+    def fetch(self, url):
+        # Download the image and store it, returns {"name": ..., "variants": {...}}.
+        # Concurrent fetches of the same URL share one download.
+        key = self.flights.key("image", None, url)
+        return self.flights.do(key, lambda: self.__fetch(url))
+
+    def __fetch(self, url):
+        # Streamed so a wrong or hostile URL can't make us buffer more than
+        # APP_IMAGE_MAX_SIZE bytes
+        with self.http.stream("GET", url) as response:
+            response.raise_for_status()
+            if int(response.headers.get("content-length") or 0) > APP_IMAGE_MAX_SIZE:
+                raise ValueError("Image too large!")
+            data = bytearray()
+            for chunk in response.iter_bytes():
+                data += chunk
+                if len(data) > APP_IMAGE_MAX_SIZE:
+                    raise ValueError("Image too large!")
+        return self.store(bytes(data))
+
+    def store(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        image = Image.open(BytesIO(data))
+        ext = (image.format or "png").lower().replace("jpeg", "jpg")
+        name = f"img_{digest}.{ext}"
+        self.__write(name, data)
+
+        variants = {}
+        for size in self.sizes:
+            if size >= max(image.size):
+                break
+            variant = f"img_{digest}_{size}.webp"
+            if not os.path.exists(os.path.join(self.folder, variant)):
+                scaled = image.copy()
+                scaled.thumbnail((size, size))
+                buffer = BytesIO()
+                scaled.save(buffer, format="WEBP", quality=IMAGE_VARIANT_QUALITY)
+                self.__write(variant, buffer.getvalue())
+            variants[str(size)] = variant
+        if logger:
+            logger.debug(f"Image mirrored: {name} ({len(variants)} variants)")
+        return {"name": name, "variants": variants}
+
+    def __write(self, name, data):
+        path = os.path.join(self.folder, name)
+        if os.path.exists(path):
+            return
+        tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+def dhash(image, size=8):
+    # 64 bit difference hash: is each pixel brighter than its right neighbour?
+    gray = image.convert("L").resize((size + 1, size), Image.LANCZOS)
+    pixels = list(gray.getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+class VisionPreprocessor:
+    # Shrinks uploaded drawings before they are sent to the vision model.
+    # The data URL is decoded once, rotated by its EXIF orientation, downscaled to
+    # `max_edge` and re-encoded; the original is kept if that does not make it
+    # smaller. Remote URLs are passed through untouched.
+    # prepare() returns (url, dhash of the drawing or None).
+
+    def __init__(self, max_edge, image_format, quality) -> None:
+        self.max_edge = max_edge
+        self.format = image_format.upper()
+        self.quality = quality
+        self.lock = threading.Lock()
+        self.stats = {"images": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def prepare(self, data_url):
+        if not data_url.startswith("data:") or "," not in data_url:
+            return data_url, None
+        try:
+            data = base64.b64decode(data_url.split(",", 1)[1], validate=True)
+            image = Image.open(BytesIO(data))
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ("RGB", "L"):
+                background = Image.new("RGB", image.size, "white")
+                background.paste(image, mask=image.convert("RGBA").getchannel("A"))
+                image = background
+            image.thumbnail((self.max_edge, self.max_edge))
+            image_hash = dhash(image)
+            buffer = BytesIO()
+            image.save(buffer, format=self.format, quality=self.quality)
+            output = buffer.getvalue()
+        except Exception as e:
+            if logger:
+                logger.error(f"Could not preprocess vision image: {e}")
+            return data_url, None
+
+        if len(output) >= len(data):
+            output = None
+        self.__record(len(data), len(output) if output else len(data), image.size)
+        if not output:
+            return data_url, image_hash
+        mimetype = f"image/{self.format.lower()}"
+        data_url = f"data:{mimetype};base64,{base64.b64encode(output).decode()}"
+        return data_url, image_hash
+
+    def __record(self, bytes_in, bytes_out, size):
+        with self.lock:
+            self.stats["images"] += 1
+            self.stats["bytes_in"] += bytes_in
+            self.stats["bytes_out"] += bytes_out
+            saved = self.stats["bytes_in"] - self.stats["bytes_out"]
+        if logger:
+            logger.info(
+                f"Vision image {size[0]}x{size[1]}: {bytes_in} -> {bytes_out} bytes "
+                f"({saved} bytes saved in total)"
+            )
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import logger_setup
+from config import *
+
+from dotenv import load_dotenv
+
+load_dotenv()
+LOGGER = os.environ.get("LOGGER", "False").lower() in ("true", "1", "t")
+
+if LOGGER:
+    logger = logger_setup("jobs", os.path.join(LOG_FOLDER, "jobs.log"))
+else:
+    logger = None
+
+
+class JobStore:
+    # Background jobs that clients can await by id.
+    # The state of every job is written to a small JSON file, so any worker can
+    # answer for a job started by another one; the worker that runs the job can
+    # also wait on it directly. Jobs run in a thread pool (submit) or as asyncio
+    # tasks (spawn) and are forgotten after `ttl` seconds.
+
+    POLL_INTERVAL = 0.25
+
+    def __init__(self, folder, ttl, workers) -> None:
+        self.folder = folder
+        self.ttl = ttl
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.local = {}  # job id -> Future / Task
+        os.makedirs(self.folder, exist_ok=True)
+
+    def path(self, job_id):
+        return os.path.join(self.folder, f"{job_id}.json")
+
+    def submit(self, fn, *args):
+        job_id = self.__create()
+
+        def run():
+            try:
+                self.__finish(job_id, result=fn(*args))
+            except Exception as e:
+                self.__finish(job_id, error=str(e))
+
+        self.__track(job_id, self.executor.submit(run))
+        return job_id
+
+    async def spawn(self, coro):
+        # Async version of submit(), the job runs as a task of the running loop.
+        # The state files are written in a thread, off the event loop.
+        job_id = await asyncio.to_thread(self.__create)
+
+        async def run():
+            try:
+                result = await coro
+            except Exception as e:
+                await asyncio.to_thread(self.__finish, job_id, error=str(e))
+            else:
+                await asyncio.to_thread(self.__finish, job_id, result=result)
+
+        self.__track(job_id, asyncio.create_task(run()))
+        return job_id
+
+    def get(self, job_id):
+        # Return the job state ({"status": "pending" | "done" | "error", ...}) or None
+        if not re.fullmatch(r"[0-9a-f]{32}", job_id or ""):
+            return None
+        try:
+            with open(self.path(job_id), "r") as f:
+                job = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if job["created"] < time.time() - self.ttl:
+            return None
+        return job
+
+    def wait(self, job_id, timeout):
+        future = self.local.get(job_id)
+        if future and not isinstance(future, asyncio.Task):
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass
+            return self.get(job_id)
+        deadline = time.monotonic() + timeout
+        job = self.get(job_id)
+        while job and job["status"] == "pending" and time.monotonic() < deadline:
+            time.sleep(self.POLL_INTERVAL)
+            job = self.get(job_id)
+        return job
+
+    async def await_job(self, job_id, timeout):
+        task = self.local.get(job_id)
+        if isinstance(task, asyncio.Task):
+            await asyncio.wait([task], timeout=timeout)
+            return await asyncio.to_thread(self.get, job_id)
+        deadline = time.monotonic() + timeout
+        job = await asyncio.to_thread(self.get, job_id)
+        while job and job["status"] == "pending" and time.monotonic() < deadline:
+            await asyncio.sleep(self.POLL_INTERVAL)
+            job = await asyncio.to_thread(self.get, job_id)
+        return job
+
+    def __create(self):
+        self.__purge()
+        job_id = uuid.uuid4().hex
+        self.__write(job_id, {"status": "pending", "created": time.time()})
+        if logger:
+            logger.debug(f"Job created: {job_id}")
+        return job_id
+
+    def __finish(self, job_id, result=None, error=None):
+        job = {"created": time.time()}
+        if error is None:
+            job.update(status="done", result=result)
+        else:
+            job.update(status="error", error=error)
+            if logger:
+                logger.error(f"Job {job_id} failed: {error}")
+        self.__write(job_id, job)
+
+    def __track(self, job_id, job):
+        # Registered first, then forgotten once done: the callback runs right away
+        # for a job that already finished, so no stale entry is left behind
+        with self.lock:
+            self.local[job_id] = job
+        job.add_done_callback(lambda _: self.__forget(job_id))
+
+    def __forget(self, job_id):
+        with self.lock:
+            self.local.pop(job_id, None)
+
+    def __write(self, job_id, job):
+        # Write atomically so readers never see a partial file
+        tmp_path = f"{self.path(job_id)}.{uuid.uuid4().hex}.part"
+        with open(tmp_path, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self.path(job_id))
+
+    def __purge(self):
+        expired = time.time() - self.ttl
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                try:
+                    if entry.stat().st_mtime < expired:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,319 @@
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+
+import httpx
+import openai
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import logger_setup
+from config import *
+
+from dotenv import load_dotenv
+
+load_dotenv()
+LOGGER = os.environ.get("LOGGER", "False").lower() in ("true", "1", "t")
+
+if LOGGER:
+    logger = logger_setup("limits", os.path.join(LOG_FOLDER, "limits.log"))
+else:
+    logger = None
+
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class RateLimitWaitError(Exception):
+    pass
+
+
+def raise_for_retry(response):
+    # Turn retryable HTTP statuses of raw httpx calls into exceptions
+    if response.status_code in RETRY_STATUSES:
+        response.raise_for_status()
+    return response
+
+
+def estimate_tokens(messages, max_tokens=0):
+    # Rough token count of a chat request: ~4 characters per token, 85 per image
+    tokens = max_tokens
+    for message in messages or ():
+        content = message.get("content") if isinstance(message, dict) else message
+        parts = content if isinstance(content, list) else [content]
+        for part in parts:
+            if isinstance(part, dict) and part.get("type") == "image_url":
+                tokens += 85
+            elif isinstance(part, dict):
+                tokens += len(str(part.get("text", ""))) // 4
+            else:
+                tokens += len(str(part)) // 4
+    return tokens
+
+
+class UpstreamGuard:
+    # Protects the API from bursts and the workers from a failing API.
+    # - Token buckets of requests and tokens per minute for each model (`limits`),
+    #   stored in SQLite so every worker draws from the same buckets.
+    # - Retries of 408/409/429/5xx and connection errors with jittered exponential
+    #   backoff, honouring Retry-After when the API sends it.
+    # - A circuit breaker per model, also shared: after `failures` consecutive
+    #   upstream failures calls fail fast for `cooldown` seconds, then one trial
+    #   call is let through to probe the API.
+
+    def __init__(
+        self,
+        path,
+        limits,
+        max_wait,
+        attempts,
+        base_delay,
+        max_delay,
+        failures,
+        cooldown,
+    ) -> None:
+        self.limits = limits
+        self.max_wait = max_wait
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failures = failures
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.db = None
+        try:
+            self.db = self.__connect(path)
+        except sqlite3.Error as e:
+            if logger:
+                logger.error(f"Rate limit database unavailable: {e}")
+
+    def call(self, model, tokens, fn):
+        # Run fn() under the limits of the model, retrying transient errors
+        for attempt in range(self.attempts):
+            self.__check_circuit(model)
+            wait = self.__acquire(model, tokens)
+            while wait:
+                time.sleep(wait)
+                wait = self.__acquire(model, tokens)
+            try:
+                result = fn()
+            except Exception as e:
+                delay = self.__failed(model, e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self.__succeeded(model)
+            return result
+
+    async def acall(self, model, tokens, fn):
+        # Async version of call(), fn() returns an awaitable.
+        # The shared state lives in SQLite, so it is read and written in a thread.
+        for attempt in range(self.attempts):
+            await asyncio.to_thread(self.__check_circuit, model)
+            wait = await asyncio.to_thread(self.__acquire, model, tokens)
+            while wait:
+                await asyncio.sleep(wait)
+                wait = await asyncio.to_thread(self.__acquire, model, tokens)
+            try:
+                result = await fn()
+            except Exception as e:
+                delay = await asyncio.to_thread(self.__failed, model, e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            await asyncio.to_thread(self.__succeeded, model)
+            return result
+
+    # -- Retries --
+
+    def __failed(self, model, e, attempt):
+        # Return the delay before the next attempt, or None to give up
+        status, headers = self.__status(e)
+        transient = status in RETRY_STATUSES or isinstance(
+            e, (openai.APIConnectionError, httpx.TransportError)
+        )
+        if not transient:
+            return None
+        if status is None or status >= 500:
+            self.__record_failure(model)
+        if attempt + 1 >= self.attempts:
+            return None
+
+        delay = self.__retry_after(headers)
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        if delay > self.max_wait:
+            return None
+        if logger:
+            logger.warning(
+                f"Retrying {model} in {delay:.2f}s "
+                f"(attempt {attempt + 1}/{self.attempts}): {status or e}"
+            )
+        return delay
+
+    @staticmethod
+    def __status(e):
+        if isinstance(e, openai.APIStatusError):
+            return e.status_code, e.response.headers
+        if isinstance(e, httpx.HTTPStatusError):
+            return e.response.status_code, e.response.headers
+        return None, {}
+
+    @staticmethod
+    def __retry_after(headers):
+        try:
+            if "retry-after-ms" in headers:
+                return float(headers["retry-after-ms"]) / 1000
+            if "retry-after" in headers:
+                return float(headers["retry-after"])
+        except ValueError:
+            pass
+        return None
+
+    # -- Shared state --
+
+    def __connect(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        db = sqlite3.connect(
+            path, timeout=5, check_same_thread=False, isolation_level=None
+        )
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "name TEXT PRIMARY KEY, level REAL, updated REAL)"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS circuits ("
+            "model TEXT PRIMARY KEY, failures INTEGER, opened REAL)"
+        )
+        return db
+
+    def __acquire(self, model, tokens):
+        # Take one request and `tokens` tokens from the buckets of the model.
+        # Returns 0 when granted, otherwise the seconds until they will be.
+        limits = self.limits.get(model)
+        if not self.db or not limits:
+            return 0
+        costs = {"rpm": 1, "tpm": tokens}
+        now = time.time()
+        try:
+            with self.lock:
+                self.db.execute("BEGIN IMMEDIATE")
+                try:
+                    levels = {}
+                    wait = 0
+                    for kind, per_minute in limits.items():
+                        cost = min(costs.get(kind, 0), per_minute)
+                        row = self.db.execute(
+                            "SELECT level, updated FROM buckets WHERE name = ?",
+                            (f"{model}:{kind}",),
+                        ).fetchone()
+                        level, updated = row if row else (per_minute, now)
+                        level = min(
+                            per_minute, level + (now - updated) * per_minute / 60
+                        )
+                        levels[kind] = (level, cost)
+                        if level < cost:
+                            wait = max(wait, (cost - level) * 60 / per_minute)
+                    if not wait:
+                        for kind, (level, cost) in levels.items():
+                            self.db.execute(
+                                "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)",
+                                (f"{model}:{kind}", level - cost, now),
+                            )
+                    self.db.execute("COMMIT")
+                except Exception:
+                    self.db.execute("ROLLBACK")
+                    raise
+        except sqlite3.Error as e:
+            if logger:
+                logger.error(f"Rate limit check failed: {e}")
+            return 0
+        if wait > self.max_wait:
+            raise RateLimitWaitError(f"Rate limit of {model} exceeded, try again later")
+        if wait and logger:
+            logger.debug(f"Rate limited {model} for {wait:.2f}s")
+        return wait
+
+    def __check_circuit(self, model):
+        if not self.db:
+            return
+        now = time.time()
+        state = "closed"
+        try:
+            with self.lock:
+                self.db.execute("BEGIN IMMEDIATE")
+                try:
+                    row = self.db.execute(
+                        "SELECT failures, opened FROM circuits WHERE model = ?",
+                        (model,),
+                    ).fetchone()
+                    if row and row[0] >= self.failures:
+                        if now - row[1] < self.cooldown:
+                            state = "open"
+                        else:
+                            # Half open: let this call through as a trial and keep
+                            # the others failing fast for another cooldown
+                            self.db.execute(
+                                "UPDATE circuits SET opened = ? WHERE model = ?",
+                                (now, model),
+                            )
+                            state = "half open"
+                    self.db.execute("COMMIT")
+                except Exception:
+                    self.db.execute("ROLLBACK")
+                    raise
+        except sqlite3.Error as e:
+            if logger:
+                logger.error(f"Circuit check failed: {e}")
+            return
+        if state == "open":
+            raise CircuitOpenError(f"{model} is unavailable, try again later")
+        if state == "half open" and logger:
+            logger.info(f"Circuit of {model} half open, sending a trial request")
+
+    def __record_failure(self, model):
+        if not self.db:
+            return
+        try:
+            with self.lock:
+                self.db.execute(
+                    "INSERT INTO circuits VALUES (?, 1, ?) ON CONFLICT(model) DO "
+                    "UPDATE SET failures = failures + 1, opened = excluded.opened",
+                    (model, time.time()),
+                )
+                failures = self.db.execute(
+                    "SELECT failures FROM circuits WHERE model = ?", (model,)
+                ).fetchone()[0]
+        except sqlite3.Error as e:
+            if logger:
+                logger.error(f"Circuit update failed: {e}")
+            return
+        if failures == self.failures and logger:
+            logger.error(f"Circuit of {model} opened after {failures} failures")
+
+    def __succeeded(self, model):
+        if not self.db:
+            return
+        try:
+            with self.lock:
+                row = self.db.execute(
+                    "SELECT failures FROM circuits WHERE model = ?", (model,)
+                ).fetchone()
+                if row:
+                    self.db.execute("DELETE FROM circuits WHERE model = ?", (model,))
+        except sqlite3.Error as e:
+            if logger:
+                logger.error(f"Circuit update failed: {e}")
+            return
+        if row and row[0] >= self.failures and logger:
+            logger.info(f"Circuit of {model} closed")
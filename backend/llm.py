@@ -1,16 +1,29 @@
+import asyncio
+import hashlib
 import json
 import os
 from dotenv import load_dotenv
-import requests
+import httpx
 import sys
 import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import aclosing
 
 from langcodes import Language
 
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils import logger_setup
+from utils import logger_setup, split_sentences, JsonFieldStream, select_keyframes
+from utils import contact_sheet
+from cache import TranslationMemory, CharacterCache
+from images import VisionPreprocessor
+from router import ModelRouter, RequestHedger
+from limits import UpstreamGuard, estimate_tokens, raise_for_retry
+from coalesce import SingleFlight
 from config import *
 
 DEBUG = LLM_DEBUG
@@ -24,15 +37,146 @@ else:
     logger = None
 
 
+def http_client_options():
+    # Connection pool settings shared by the sync and async transports
+    http2 = HTTP2
+    if http2:
+        try:
+            import h2
+        except ImportError:
+            http2 = False
+            if logger:
+                logger.warning("HTTP/2 requested but 'h2' is not installed.")
+    return dict(
+        limits=httpx.Limits(
+            max_connections=HTTP_POOL_SIZE,
+            max_keepalive_connections=HTTP_KEEPALIVE_SIZE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        http2=http2,
+    )
+
+
+class StoryContext:
+    # Keeps the story sent to the LLM bounded. Once the story is over the token
+    # ceiling, the last parts stay verbatim and the older ones are folded into a
+    # running summary. Summaries are cached by the parts they cover, so each turn
+    # only folds the newly aged-out parts (one cheap request) into the last summary.
+    # A story sent as one string is split into sentences, which then act as parts.
+
+    def __init__(self, recent_parts, max_tokens, cache_size) -> None:
+        self.recent_parts = recent_parts
+        self.max_tokens = max_tokens
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.summaries = OrderedDict()
+
+    @staticmethod
+    def estimate_tokens(text):
+        # Rough estimate (~4 characters per token), good enough for a ceiling
+        return len(text) // 4 + 1
+
+    @staticmethod
+    def key(parts):
+        return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+    def split(self, context):
+        # Return (older, recent) parts, or None if the story fits as it is
+        story = context.get("story") if isinstance(context, dict) else None
+        if not story:
+            return None
+        parts = story if isinstance(story, list) else split_sentences(story)
+        if len(parts) < 2 or self.estimate_tokens(" ".join(parts)) <= self.max_tokens:
+            return None
+        keep = min(self.recent_parts, len(parts) - 1)
+        while keep > 1 and (
+            self.estimate_tokens(" ".join(parts[-keep:])) > self.max_tokens // 2
+        ):
+            keep -= 1
+        return parts[:-keep], parts[-keep:]
+
+    def cached(self, older):
+        # Return (number of parts covered, summary) for the longest cached prefix
+        with self.lock:
+            for i in range(len(older), 0, -1):
+                key = self.key(older[:i])
+                if key in self.summaries:
+                    self.summaries.move_to_end(key)
+                    return i, self.summaries[key]
+        return 0, ""
+
+    def store(self, older, summary):
+        with self.lock:
+            self.summaries[self.key(older)] = summary
+            self.summaries.move_to_end(self.key(older))
+            while len(self.summaries) > self.cache_size:
+                self.summaries.popitem(last=False)
+
+    def apply(self, context, summary, recent):
+        return {**context, "story_summary": summary, "story": " ".join(recent)}
+
+
 class Storyteller:
     def __init__(self, key, org) -> None:
-        self.llm = OpenAI(api_key=key, organization=org)
+        # One keep-alive pool for every request, including the SDK ones
+        self.http = self._create_http_client()
+        self.llm = self._create_client(key, org)
         self.gpt4 = MODEL_GPT4
         self.gpt3 = MODEL_GPT3
         self.vision = MODEL_VISION
         self.image_gen = MODEL_IMAGE_GEN
         self.stt = MODEL_STT
         self.tts = MODEL_TTS
+        self.voice = TTS_VOICE
+        self.translations = TranslationMemory(
+            TRANSLATION_CACHE_SIZE,
+            TRANSLATION_DB,
+            TRANSLATION_DB_MAX_ROWS,
+            TRANSLATION_TTL,
+        )
+        self.story_context = StoryContext(
+            STORY_CONTEXT_RECENT_PARTS,
+            STORY_CONTEXT_MAX_TOKENS,
+            STORY_CONTEXT_CACHE_SIZE,
+        )
+        self.router = ModelRouter(
+            ROUTER_ROUTES,
+            ROUTER_TIERS,
+            ROUTER_WINDOW,
+            ROUTER_MAX_AGE,
+            ROUTER_MIN_SAMPLES,
+            ROUTER_MAX_ERROR_RATE,
+        )
+        self.limits = UpstreamGuard(
+            RATE_LIMIT_DB,
+            RATE_LIMITS,
+            RATE_LIMIT_MAX_WAIT,
+            RETRY_MAX_ATTEMPTS,
+            RETRY_BASE_DELAY,
+            RETRY_MAX_DELAY,
+            CIRCUIT_FAILURES,
+            CIRCUIT_COOLDOWN,
+        )
+        self.flights = SingleFlight()
+        self.hedger = RequestHedger(
+            HEDGE_PERCENTILE,
+            HEDGE_WINDOW,
+            HEDGE_MIN_SAMPLES,
+            HEDGE_MAX_RATE,
+            HEDGE_RATE_WINDOW,
+        )
+        self.hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS)
+        self.vision_images = VisionPreprocessor(
+            VISION_IMAGE_MAX_EDGE, VISION_IMAGE_FORMAT, VISION_IMAGE_QUALITY
+        )
+        self.characters = (
+            CharacterCache(
+                CHARACTER_CACHE_DB, CHARACTER_CACHE_DISTANCE, CHARACTER_CACHE_MAX_ROWS
+            )
+            if CHARACTER_CACHE_ENABLED
+            else None
+        )
 
         if logger:
             logger.info(f"LLM storyteller initialized.")
@@ -41,14 +185,36 @@ class Storyteller:
                 f"Modes: {self.gpt4}, {self.gpt3}, {self.vision}, {self.image_gen}, {self.stt}, {self.tts}"
             )
 
-    def hello_world(self):
+    def _create_http_client(self):
+        return httpx.Client(**http_client_options())
+
+    def _create_client(self, key, org):
+        # Retries are done by self.limits, which also knows about the other workers
+        return OpenAI(
+            api_key=key, organization=org, http_client=self.http, max_retries=0
+        )
+
+    def close(self):
+        self.http.close()
+
+    def _request_headers(self):
+        return {
+            "Authorization": f"Bearer {self.llm.api_key}",
+            "OpenAI-Organization": f"{self.llm.organization}",
+        }
+
+    def _hello_world_messages(self):
         messages = [
             {"role": "system", "content": "You are a helpful chatbot."},
             {"role": "user", "content": "Hello, who are you?"},
         ]
+        return messages
+
+    def hello_world(self):
+        messages = self._hello_world_messages()
         return self.send_gpt4_request(messages)
 
-    def __get_json_data(self, datastr):
+    def _get_json_data(self, datastr):
         try:
             if datastr.strip().startswith("```json"):
                 return json.loads(datastr.split("```json")[1].split("```")[0])
@@ -63,7 +229,7 @@ class Storyteller:
             if logger:
                 logger.debug(f"Data string: '{datastr}'")
 
-    def __improve_prompt(
+    def _improve_prompt_messages(
         self,
         prompt,
         usage="image generation model",
@@ -104,12 +270,76 @@ Example JSON output:
                 ],
             },
         ]
-        data = self.send_gpt3_request(messages)
-        data = self.__get_json_data(data)
+        return messages
+
+    def _improve_prompt(self, prompt, *args, **kwargs):
+        messages = self._improve_prompt_messages(prompt, *args, **kwargs)
+        data = self.send_gpt3_request(messages, coalesce=True)
+        data = self._get_json_data(data)
         if logger:
             logger.debug(f"Improved prompt: {data}")
         return data
 
+    def _summarize_story_messages(self, summary, parts):
+        messages = [
+            {
+                "role": "system",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": """
+You are a helpful assistant. Help me keep a running summary of a story.
+1. Understand the summary of the story so far (it may be empty).
+2. Understand the new story parts that follow it.
+3. Write an updated summary covering both.
+    - Keep characters, places, items and unresolved plot points.
+    - Not more than %d words.
+4. Return as a JSON object.
+    - No styling and all in ascii characters.
+    - Use double quotes for keys and values.
+
+Example JSON object:
+{
+    "summary": "Johnny the cat found out his tuna was stolen and followed paw prints to the garden, where he met a friendly dog named Rex.",
+}
+"""
+                        % (STORY_CONTEXT_MAX_TOKENS // 3),
+                    }
+                ],
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": str({"summary": summary, "parts": parts}),
+                    },
+                ],
+            },
+        ]
+        return messages
+
+    def _bound_context(self, context):
+        # Replace the full story with a running summary + the most recent parts
+        split = self.story_context.split(context)
+        if not split:
+            return context
+        older, recent = split
+        try:
+            count, summary = self.story_context.cached(older)
+            if count < len(older):
+                messages = self._summarize_story_messages(summary, older[count:])
+                data = self._get_json_data(self.send_gpt3_request(messages))
+                summary = data["summary"]
+                self.story_context.store(older, summary)
+        except Exception as e:
+            if logger:
+                logger.error(f"Could not summarize story context: {e}")
+            return context
+        if logger:
+            logger.debug(f"Story context bounded: {len(older)} parts summarized")
+        return self.story_context.apply(context, summary, recent)
+
     # -- Unimplemented Functions --
 
     def __inquire_drawing(self, data):
@@ -142,7 +372,7 @@ Example JSON output:
 
     # -- Storyteller Functions --
 
-    def initialize_story(self, context, complexity):
+    def _initialize_story_messages(self, context, complexity):
         length = random.choice([1, 1, 1, 2, 2, 3, 4])
         messages = [
             {
@@ -187,10 +417,14 @@ Example JSON object:
                 ],
             },
         ]
-        data = self.send_gpt4_request(messages)
-        return self.__get_json_data(data)
+        return messages
 
-    def analyze_story_parts(self, context):
+    def initialize_story(self, context, complexity):
+        messages = self._initialize_story_messages(context, complexity)
+        data = self.send_routed_request("init", messages)
+        return self._get_json_data(data)
+
+    def _analyze_story_parts_messages(self, context):
         # Send LLM request to analyze story parts based on a given context.
         story = context["story"]
         story_parts = context["story_parts"]
@@ -259,10 +493,14 @@ Here is an example JSON object:
                 ],
             },
         ]
+        return messages
+
+    def analyze_story_parts(self, context):
+        messages = self._analyze_story_parts_messages(context)
         data = self.send_gpt3_request(messages)
-        return self.__get_json_data(data)
+        return self._get_json_data(data)
 
-    def terminate_story(self, context, complexity):
+    def _terminate_story_messages(self, context, complexity):
         endings = [
             "Ends in a plot twist.",
             "Ends with a moral lesson.",
@@ -314,10 +552,15 @@ Example JSON object:
                 ],
             },
         ]
-        data = self.send_gpt3_request(messages)
-        return self.__get_json_data(data)
+        return messages
 
-    def generate_actions(self, context, complexity, n=2):
+    def terminate_story(self, context, complexity):
+        context = self._bound_context(context)
+        messages = self._terminate_story_messages(context, complexity)
+        data = self.send_routed_request("end", messages)
+        return self._get_json_data(data)
+
+    def _generate_actions_messages(self, context, complexity, n=2):
         # Generate choices based on a given context
         messages = [
             {
@@ -366,10 +609,15 @@ Here is an example JSON object:
                 ],
             },
         ]
-        data = self.send_gpt4_request(messages)
-        return self.__get_json_data(data)
+        return messages
 
-    def generate_story_part(self, context, complexity):
+    def generate_actions(self, context, complexity, n=2):
+        context = self._bound_context(context)
+        messages = self._generate_actions_messages(context, complexity, n)
+        data = self.send_routed_request("actions", messages)
+        return self._get_json_data(data)
+
+    def _generate_story_part_messages(self, context, complexity):
         # Generate a story part based on the given context
         length = random.choice([1, 1, 1, 2, 2, 3, 4])
         settings = [
@@ -436,10 +684,45 @@ Example JSON object:
                 ],
             },
         ]
-        data = self.send_gpt4_request(messages)
-        return self.__get_json_data(data)
+        return messages
 
-    def generate_premise(self, character, complexity, n=2):
+    def generate_story_part(self, context, complexity):
+        context = self._bound_context(context)
+        messages = self._generate_story_part_messages(context, complexity)
+        data = self.send_routed_request("story_part", messages)
+        return self._get_json_data(data)
+
+    # -- Streaming Storyteller Functions --
+    # Each yields ("delta" | "field", key, value) events while the completion
+    # streams in, then a final ("done", None, data) with the parsed JSON.
+
+    def _stream_json_fields(self, chunks):
+        parser = JsonFieldStream(stream=("text",))
+        content = []
+        for chunk in chunks:
+            content.append(chunk)
+            yield from parser.feed(chunk)
+        yield ("done", None, self._get_json_data("".join(content)))
+
+    def stream_initialize_story(self, context, complexity):
+        messages = self._initialize_story_messages(context, complexity)
+        chunks = self.send_chat_stream_request(self.router.choose("init"), messages)
+        return self._stream_json_fields(chunks)
+
+    def stream_story_part(self, context, complexity):
+        context = self._bound_context(context)
+        messages = self._generate_story_part_messages(context, complexity)
+        model = self.router.choose("story_part")
+        chunks = self.send_chat_stream_request(model, messages)
+        return self._stream_json_fields(chunks)
+
+    def stream_terminate_story(self, context, complexity):
+        context = self._bound_context(context)
+        messages = self._terminate_story_messages(context, complexity)
+        chunks = self.send_chat_stream_request(self.router.choose("end"), messages)
+        return self._stream_json_fields(chunks)
+
+    def _generate_premise_messages(self, character, complexity, n=2):
         # Generate a premise based on the given character
         messages = [
             {
@@ -483,10 +766,14 @@ Example JSON object:
                 ],
             },
         ]
-        data = self.send_gpt3_request(messages)
-        return self.__get_json_data(data)
+        return messages
 
-    def generate_character(self, drawing_url, complexity):
+    def generate_premise(self, character, complexity, n=2):
+        messages = self._generate_premise_messages(character, complexity, n)
+        data = self.send_routed_request("premise", messages)
+        return self._get_json_data(data)
+
+    def _generate_character_messages(self, drawing_url, complexity):
         messages = [
             {
                 "role": "system",
@@ -543,10 +830,30 @@ Here is an example JSON object:
                 ],
             },
         ]
+        return messages
+
+    def _cached_character(self, drawing_hash, complexity):
+        if not self.characters:
+            return None
+        return self.characters.get(drawing_hash, complexity)
+
+    def _store_character(self, drawing_hash, complexity, result):
+        # Only cache complete results
+        if self.characters and "image" in result and "character" in result:
+            self.characters.put(drawing_hash, complexity, result)
+
+    def generate_character(self, drawing_url, complexity):
+        drawing_url, drawing_hash = self.vision_images.prepare(drawing_url)
+        cached = self._cached_character(drawing_hash, complexity)
+        if cached:
+            return cached
+        messages = self._generate_character_messages(drawing_url, complexity)
         data = self.send_vision_request(messages)
-        return self.__get_json_data(data)
+        result = self._get_json_data(data)
+        self._store_character(drawing_hash, complexity, result)
+        return result
 
-    def generate_story_image(self, story_part):
+    def _story_image_prompt(self, story_part):
         content = story_part["content"]
         style = story_part["style"]
 
@@ -554,7 +861,11 @@ Here is an example JSON object:
 {content}.
 In the style of: {style}.
 """
-        prompt = self.__improve_prompt(
+        return prompt
+
+    def generate_story_image(self, story_part):
+        prompt = self._story_image_prompt(story_part)
+        prompt = self._improve_prompt(
             prompt, "image generation model to generate drawings"
         )
         prompt = prompt["new_prompt"]
@@ -562,7 +873,9 @@ In the style of: {style}.
         result = self.send_image_request(prompt)
         return {"prompt": prompt, "image_url": result}
 
-    def translate_text(self, text, source_language="en", target_language="en"):
+    def _translate_text_messages(
+        self, text, source_language="en", target_language="en"
+    ):
         source = Language.get(source_language)
         target = Language.get(target_language)
         # Translate the given text to the target language using LLM
@@ -597,18 +910,144 @@ Example JSON object:
                 ],
             },
         ]
+        return messages
 
-        response = self.send_gpt3_request(messages)
-        response = self.__get_json_data(response)
+    def translate_text(self, text, source_language="en", target_language="en"):
+        cached = self.translations.get(text, source_language, target_language)
+        if cached is not None:
+            return cached
+        messages = self._translate_text_messages(
+            text, source_language, target_language
+        )
+        response = self.send_gpt3_request(messages, coalesce=True)
+        response = self._get_json_data(response)
         data = response["translation"]
+        if not isinstance(data, str) or not data.strip():
+            raise ValueError("No translation in the response!")
         if logger:
             logger.debug(f"Translated text: {data}")
+        self.translations.put(text, source_language, target_language, data)
         return data
 
-    def process_motion(self, frames):
-        if logger:
-            logger.debug(f"Processing motion...")
+    def warm_translations(self, texts, languages, source_language="en"):
+        # Fill the translation memory for fixed UI strings ahead of the first request
+        for language in languages:
+            if language == source_language:
+                continue
+            try:
+                self.translate_batch(texts, source_language, language)
+            except Exception as e:
+                if logger:
+                    logger.error(f"Translation warm-up failed for '{language}': {e}")
+
+    def _translate_batch_messages(
+        self, texts, source_language="en", target_language="en"
+    ):
+        source = Language.get(source_language)
+        target = Language.get(target_language)
+        messages = [
+            {
+                "role": "system",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": """
+Translate a list of texts from %s to %s.
+1. Translate each of the given texts on its own.
+2. Keep the same order and the same number of items.
+3. Return the translated texts in the target language.
+
+Example JSON object:
+{
+    "translations": ["...", "..."],
+}
+"""
+                        % (source, target),
+                    }
+                ],
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": json.dumps({"texts": texts}, ensure_ascii=False),
+                    },
+                ],
+            },
+        ]
+        return messages
+
+    def _translation_batches(self, texts, source_language, target_language):
+        # Group the texts that are not cached yet into size-bounded batches
+        batches = [[]]
+        size = 0
+        for text in dict.fromkeys(texts):
+            if not text or not text.strip():
+                continue
+            if self.translations.get(text, source_language, target_language) is not None:
+                continue
+            if batches[-1] and (
+                len(batches[-1]) >= TRANSLATE_BATCH_MAX_ITEMS
+                or size + len(text) > TRANSLATE_BATCH_MAX_CHARS
+            ):
+                batches.append([])
+                size = 0
+            batches[-1].append(text)
+            size += len(text)
+        return [batch for batch in batches if batch]
+
+    def _store_batch_translations(self, batch, data, source_language, target_language):
+        # Returns the texts of the batch left without a translation (all of them if
+        # the response does not line up with the batch), empty ones are not stored
+        translations = data.get("translations") if isinstance(data, dict) else None
+        if not isinstance(translations, list) or len(translations) != len(batch):
+            if logger:
+                logger.error(f"Batch translation mismatch for {len(batch)} texts")
+            return batch
+        missing = []
+        for text, translation in zip(batch, translations):
+            if isinstance(translation, str) and translation.strip():
+                self.translations.put(
+                    text, source_language, target_language, translation
+                )
+            else:
+                missing.append(text)
+        if missing and logger:
+            logger.error(f"Batch translation missing {len(missing)} texts")
+        return missing
 
+    def _batch_results(self, texts, source_language, target_language):
+        # None for a text without translation, never the untranslated source
+        results = [
+            self.translations.get(text, source_language, target_language)
+            for text in texts
+        ]
+        missing = sum(result is None for result in results)
+        if missing and logger:
+            logger.error(f"No translation for {missing} of {len(texts)} texts")
+        return results
+
+    def translate_batch(self, texts, source_language="en", target_language="en"):
+        # Translate many strings in as few requests as possible, keeping their order
+        for batch in self._translation_batches(texts, source_language, target_language):
+            messages = self._translate_batch_messages(
+                batch, source_language, target_language
+            )
+            data = self._get_json_data(self.send_gpt3_request(messages, coalesce=True))
+            missing = self._store_batch_translations(
+                batch, data, source_language, target_language
+            )
+            for text in missing:
+                try:
+                    self.translate_text(text, source_language, target_language)
+                except ValueError as e:
+                    if logger:
+                        logger.error(f"Translation failed for '{text}': {e}")
+        return self._batch_results(texts, source_language, target_language)
+
+    def _process_motion_messages(self, frames, tiled=False):
+        detail = MOTION_CONTACT_SHEET_DETAIL if tiled else "low"
         messages = [
             {
                 "role": "system",
@@ -644,39 +1083,104 @@ Example:
             {
                 "role": "user",
                 "content": [
-                    "These are video frames in order.",
+                    (
+                        "These are video frames in order, tiled left to right and "
+                        "top to bottom. Each frame is labeled with its number."
+                        if tiled
+                        else "These are video frames in order."
+                    ),
                     *map(
                         lambda frame: {
                             "type": "image_url",
-                            "image_url": {"url": f"{frame}", "detail": "low"},
+                            "image_url": {"url": f"{frame}", "detail": detail},
                         },
                         frames,
                     ),
                 ],
             },
         ]
+        return messages
 
+    def _select_motion_frames(self, frames):
+        # Only send the frames where the action happens
+        try:
+            keyframes = select_keyframes(
+                frames, MOTION_KEYFRAMES, MOTION_KEYFRAME_THRESHOLD
+            )
+        except Exception as e:
+            if logger:
+                logger.error(f"Could not select motion keyframes: {e}")
+            return frames
+        if logger:
+            logger.debug(
+                f"Motion keyframes: {len(keyframes)} of {len(frames)} frames, "
+                f"{sum(map(len, keyframes))} of {sum(map(len, frames))} bytes"
+            )
+        return keyframes
+
+    def _motion_contact_sheet(self, frames):
+        # Tile the frames into a single image, or None to send them one by one
+        try:
+            sheet = contact_sheet(
+                frames, MOTION_CONTACT_SHEET_COLUMNS, MOTION_CONTACT_SHEET_WIDTH
+            )
+        except Exception as e:
+            if logger:
+                logger.error(f"Could not build motion contact sheet: {e}")
+            return None
+        if logger:
+            logger.debug(
+                f"Motion contact sheet: {len(sheet)} bytes "
+                f"for {len(frames)} frames ({sum(map(len, frames))} bytes)"
+            )
+        return sheet
+
+    def _prepare_motion_frames(self, frames):
+        # Returns (frames to send, tiled)
+        frames = self._select_motion_frames(frames)
+        if MOTION_CONTACT_SHEET and frames:
+            sheet = self._motion_contact_sheet(frames)
+            if sheet:
+                return [sheet], True
+        return frames, False
+
+    def process_motion(self, frames):
+        if logger:
+            logger.debug(f"Processing motion...")
+        frames, tiled = self._prepare_motion_frames(frames)
+        messages = self._process_motion_messages(frames, tiled)
         data = self.send_gpt4_request(messages)
-        return self.__get_json_data(data)
+        return self._get_json_data(data)
 
     # -- LLM Request Functions --
 
-    def send_vision_request(self, request):
+    def send_vision_request(self, request, coalesce=True):
+        if coalesce:
+            key = self._vision_key(request)
+            return self.flights.do(
+                key, lambda: self.send_vision_request(request, coalesce=False)
+            )
+        response = None
         try:
             headers = {
                 "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.llm.api_key}",
-                "OpenAI-Organization": f"{self.llm.organization}",
+                **self._request_headers(),
             }
             payload = {
                 "model": self.vision,
                 "messages": request,
                 "max_tokens": 1024,
             }
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers=headers,
-                json=payload,
+            response = self.limits.call(
+                self.vision,
+                estimate_tokens(request, 1024),
+                lambda: raise_for_retry(
+                    self.http.post(
+                        "https://api.openai.com/v1/chat/completions",
+                        headers=headers,
+                        json=payload,
+                    )
+                ),
             )
             if logger:
                 logger.debug(
@@ -691,17 +1195,104 @@ Example:
                 logger.error(str(e) + str(response))
             raise e
 
+    def _vision_key(self, request):
+        # Flight key of a vision request: images count by a digest of their URL,
+        # instead of dumping multi-MB data URLs into the key
+        def content(item):
+            if isinstance(item, dict) and item.get("type") == "image_url":
+                url = item["image_url"]["url"].encode("utf-8")
+                return {"image": hashlib.sha256(url).hexdigest()}
+            return item
+
+        messages = [
+            (
+                {**m, "content": [content(item) for item in m["content"]]}
+                if isinstance(m.get("content"), list)
+                else m
+            )
+            for m in request
+        ]
+        return self.flights.key("vision", self.vision, messages)
+
+    def send_routed_request(self, route, request, *args, **kwargs):
+        # Send a chat request to the model the router picks for this route
+        model = self.router.choose(route)
+        send = self.send_gpt3_request if model == self.gpt3 else self.send_gpt4_request
+        if HEDGE_ENABLED and route in HEDGE_ROUTES:
+            return self._send_hedged_request(route, send, request, *args, **kwargs)
+        return send(request, *args, **kwargs)
+
+    def _send_hedged_request(self, route, send, request, *args, **kwargs):
+        # The first response that parses wins. Sync requests can't be interrupted,
+        # so the losing one is left to finish in the background and ignored.
+        start = time.monotonic()
+        delay = self.hedger.delay(route)
+        futures = [self.hedge_executor.submit(send, request, *args, **kwargs)]
+        if delay is not None:
+            done, _ = wait(futures, timeout=delay)
+            if not done and self.hedger.allow(route):
+                futures.append(
+                    self.hedge_executor.submit(
+                        send, request, *args, coalesce=False, **kwargs
+                    )
+                )
+        result = None
+        try:
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    futures.remove(future)
+                    result = future
+                    if future.exception() is None and self._valid_response(
+                        future.result()
+                    ):
+                        self.hedger.record(route, time.monotonic() - start)
+                        return future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+        return result.result()
+
+    def _valid_response(self, data):
+        try:
+            return self._get_json_data(data) is not None
+        except Exception:
+            return False
+
     def send_gpt4_request(
-        self, request, is_jason=True, temperature=1.0, presence_penalty=0.0
+        self,
+        request,
+        is_jason=True,
+        temperature=1.0,
+        presence_penalty=0.0,
+        coalesce=None,
     ):
+        # Identical requests already in flight share one upstream call. Only
+        # deterministic ones: by default those at temperature 0, callers pass
+        # coalesce=True for requests whose answers are interchangeable.
+        if coalesce or (coalesce is None and temperature == 0):
+            key = self.flights.key(
+                "chat", self.gpt4, request, is_jason, temperature, presence_penalty
+            )
+            return self.flights.do(
+                key,
+                lambda: self.send_gpt4_request(
+                    request, is_jason, temperature, presence_penalty, coalesce=False
+                ),
+            )
+        start = time.monotonic()
         try:
-            response = self.llm.chat.completions.create(
-                model=self.gpt4,
-                messages=request,
-                response_format={"type": "json_object"} if is_jason else None,
-                max_tokens=1024,
-                temperature=temperature,
-                presence_penalty=presence_penalty,
+            response = self.limits.call(
+                self.gpt4,
+                estimate_tokens(request, 1024),
+                lambda: self.llm.chat.completions.create(
+                    model=self.gpt4,
+                    messages=request,
+                    response_format={"type": "json_object"} if is_jason else None,
+                    max_tokens=1024,
+                    temperature=temperature,
+                    presence_penalty=presence_penalty,
+                ),
             )
             if logger:
                 logger.debug(
@@ -709,24 +1300,49 @@ Example:
                 )
 
             jresponse = json.loads(response.model_dump_json())
+            self.router.record(self.gpt4, time.monotonic() - start)
 
             return jresponse["choices"][0]["message"]["content"]
         except Exception as e:
+            self.router.record(self.gpt4, time.monotonic() - start, ok=False)
             if logger:
                 logger.error(e)
             raise e
 
     def send_gpt3_request(
-        self, request, is_jason=True, temperature=1.0, presence_penalty=0.0
+        self,
+        request,
+        is_jason=True,
+        temperature=1.0,
+        presence_penalty=0.0,
+        coalesce=None,
     ):
+        # Identical requests already in flight share one upstream call. Only
+        # deterministic ones: by default those at temperature 0, callers pass
+        # coalesce=True for requests whose answers are interchangeable.
+        if coalesce or (coalesce is None and temperature == 0):
+            key = self.flights.key(
+                "chat", self.gpt3, request, is_jason, temperature, presence_penalty
+            )
+            return self.flights.do(
+                key,
+                lambda: self.send_gpt3_request(
+                    request, is_jason, temperature, presence_penalty, coalesce=False
+                ),
+            )
+        start = time.monotonic()
         try:
-            response = self.llm.chat.completions.create(
-                model=self.gpt3,
-                messages=request,
-                response_format={"type": "json_object"} if is_jason else None,
-                max_tokens=1024,
-                temperature=temperature,
-                presence_penalty=presence_penalty,
+            response = self.limits.call(
+                self.gpt3,
+                estimate_tokens(request, 1024),
+                lambda: self.llm.chat.completions.create(
+                    model=self.gpt3,
+                    messages=request,
+                    response_format={"type": "json_object"} if is_jason else None,
+                    max_tokens=1024,
+                    temperature=temperature,
+                    presence_penalty=presence_penalty,
+                ),
             )
             if logger:
                 logger.debug(
@@ -734,8 +1350,43 @@ Example:
                 )
 
             jresponse = json.loads(response.model_dump_json())
+            self.router.record(self.gpt3, time.monotonic() - start)
 
             return jresponse["choices"][0]["message"]["content"]
+        except Exception as e:
+            self.router.record(self.gpt3, time.monotonic() - start, ok=False)
+            if logger:
+                logger.error(e)
+            raise e
+
+    def send_chat_stream_request(
+        self, model, request, is_jason=True, temperature=1.0, presence_penalty=0.0
+    ):
+        # Yield the completion content as it is generated
+        try:
+            response = self.limits.call(
+                model,
+                estimate_tokens(request, 1024),
+                lambda: self.llm.chat.completions.create(
+                    model=model,
+                    messages=request,
+                    response_format={"type": "json_object"} if is_jason else None,
+                    max_tokens=1024,
+                    temperature=temperature,
+                    presence_penalty=presence_penalty,
+                    stream=True,
+                ),
+            )
+            if logger:
+                logger.debug(
+                    f"Successfuly sent 'stream chat' LLM request with model={model}"
+                )
+            # Closing the response (also when the consumer stops early) ends the
+            # generation upstream
+            with response:
+                for chunk in response:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
         except Exception as e:
             if logger:
                 logger.error(e)
@@ -743,13 +1394,17 @@ Example:
 
     def send_image_request(self, request):
         try:
-            response = self.llm.images.generate(
-                model=self.image_gen,
-                prompt=request,
-                size=IMAGE_GEN_RESOLUTION,
-                quality="standard",
-                style="natural",
-                n=1,
+            response = self.limits.call(
+                self.image_gen,
+                0,
+                lambda: self.llm.images.generate(
+                    model=self.image_gen,
+                    prompt=request,
+                    size=IMAGE_GEN_RESOLUTION,
+                    quality="standard",
+                    style="natural",
+                    n=1,
+                ),
             )
             if logger:
                 logger.debug(
@@ -763,37 +1418,99 @@ Example:
                 logger.error(e)
             raise e
 
-    def send_tts_request(self, text, os="undetermined"):
+    def send_tts_request(self, text, os="undetermined", response_format=None):
+        # Concurrent requests for the same speech share one upstream stream
+        response_format = response_format or self._tts_format(os)
+        key = self.flights.key("tts", self.tts, self.voice, text, response_format)
+        return self.flights.stream(
+            key, lambda: self._stream_tts_request(text, response_format)
+        )
+
+    @staticmethod
+    def _tts_format(os):
+        return "mp3" if os == "ios" else "opus"
+
+    def _stream_tts_request(self, text, response_format):
         # Based on this answer: https://github.com/openai/openai-python/issues/864#issuecomment-1872681672
         url = "https://api.openai.com/v1/audio/speech"
-        headers = {
-            "Authorization": f"Bearer {self.llm.api_key}",
-            "OpenAI-Organization": f"{self.llm.organization}",
-        }
+        headers = self._request_headers()
         data = {
             "model": self.tts,
             "input": text,
-            "voice": "echo",
-            "response_format": "mp3" if os == "ios" else "opus",
+            "voice": self.voice,
+            "response_format": response_format,
         }
 
-        with requests.post(url, headers=headers, json=data, stream=True) as response:
-            if response.status_code == 200:
-                if logger:
-                    logger.debug(
-                        f"Successfuly sent 'speech' LLM request with model={self.tts}"
-                    )
-                for chunk in response.iter_content(chunk_size=4096):
-                    yield chunk
+        request = self.http.build_request("POST", url, headers=headers, json=data)
+        response = self.limits.call(self.tts, 0, lambda: self._open_stream(request))
+        try:
+            self._check_tts_response(response)
+            if logger:
+                logger.debug(
+                    f"Successfuly sent 'speech' LLM request with model={self.tts}"
+                )
+            for chunk in response.iter_bytes(chunk_size=4096):
+                yield chunk
+        finally:
+            response.close()
+
+    @staticmethod
+    def _check_tts_response(response):
+        # An error answer must not end up as an empty (or cached) audio stream
+        if response.status_code != 200:
+            if logger:
+                logger.error(f"Speech request failed with {response.status_code}")
+            raise httpx.HTTPStatusError(
+                f"Speech request failed with {response.status_code}",
+                request=response.request,
+                response=response,
+            )
+
+    def _open_stream(self, request):
+        response = self.http.send(request, stream=True)
+        try:
+            return raise_for_retry(response)
+        except Exception:
+            response.close()
+            raise
+
+    def send_tts_pipelined_request(self, text, os="undetermined"):
+        # Synthesize sentence by sentence so playback starts after the first one.
+        # The first sentence is streamed live while the rest are fetched in parallel,
+        # the audio segments are yielded in order as one continuous stream.
+        # Segments are always MP3: its frames can be concatenated, Ogg/Opus can't.
+        # A failed segment raises, so a gap is never streamed (or cached).
+        sentences = split_sentences(text, TTS_PIPELINE_MIN_CHARS)
+        if not sentences:
+            return
+        executor = ThreadPoolExecutor(max_workers=max(TTS_PIPELINE_CONCURRENCY - 1, 1))
+        try:
+            futures = [
+                executor.submit(
+                    lambda s: b"".join(self.send_tts_request(s, os, "mp3")), s
+                )
+                for s in sentences[1:]
+            ]
+            yield from self.send_tts_request(sentences[0], os, "mp3")
+            for future in futures:
+                yield future.result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
     def send_stt_request(self, input, translate=False):
         # TODO: Maybe move to file-in-memory approach without saving/opening the file
         with open(input, "rb") as audio_file:
+            # Read once so a retry can send the same bytes again
+            audio_file = (os.path.basename(input), audio_file.read())
             if translate:
-                transcript = self.llm.audio.translations.create(
-                    model=self.stt,
-                    file=audio_file,
-                    response_format="verbose_json",
+                transcript = self.limits.call(
+                    self.stt,
+                    0,
+                    lambda: self.llm.audio.translations.create(
+                        model=self.stt,
+                        file=audio_file,
+                        response_format="verbose_json",
+                    ),
                 )
                 if logger:
                     logger.debug(
@@ -802,12 +1519,16 @@ Example:
                 return transcript.model_dump_json(indent=4)
             else:
                 print("Transcribing...")
-                transcript = self.llm.audio.transcriptions.create(
-                    model=self.stt,
-                    file=audio_file,
-                    language="en",
-                    prompt="This voice recording is from a presentation about reinforcement learning with robots.",
-                    response_format="json",
+                transcript = self.limits.call(
+                    self.stt,
+                    0,
+                    lambda: self.llm.audio.transcriptions.create(
+                        model=self.stt,
+                        file=audio_file,
+                        language="en",
+                        prompt="This voice recording is from a presentation about reinforcement learning with robots.",
+                        response_format="json",
+                    ),
                 )
                 print("Transcribed")
                 if logger:
@@ -816,3 +1537,552 @@ Example:
                     )
                 print("Dumping JSON")
                 return transcript.model_dump_json(indent=4)
+
+
+class AsyncStoryteller(Storyteller):
+    # Same surface as Storyteller, but every LLM call is a coroutine.
+    # Prompts come from the shared `_*_messages` builders, only the request layer differs.
+    # Used by the ASGI entry point (asgi.py) so one worker can await many sessions at once.
+
+    def _create_http_client(self):
+        return httpx.AsyncClient(**http_client_options())
+
+    def _create_client(self, key, org):
+        return AsyncOpenAI(
+            api_key=key, organization=org, http_client=self.http, max_retries=0
+        )
+
+    async def aclose(self):
+        await self.http.aclose()
+
+    async def hello_world(self):
+        messages = self._hello_world_messages()
+        return await self.send_gpt4_request(messages)
+
+    async def _improve_prompt(self, prompt, *args, **kwargs):
+        messages = self._improve_prompt_messages(prompt, *args, **kwargs)
+        data = await self.send_gpt3_request(messages, coalesce=True)
+        data = self._get_json_data(data)
+        if logger:
+            logger.debug(f"Improved prompt: {data}")
+        return data
+
+    # -- Storyteller Functions --
+
+    async def _bound_context(self, context):
+        split = self.story_context.split(context)
+        if not split:
+            return context
+        older, recent = split
+        try:
+            count, summary = self.story_context.cached(older)
+            if count < len(older):
+                messages = self._summarize_story_messages(summary, older[count:])
+                data = self._get_json_data(await self.send_gpt3_request(messages))
+                summary = data["summary"]
+                self.story_context.store(older, summary)
+        except Exception as e:
+            if logger:
+                logger.error(f"Could not summarize story context: {e}")
+            return context
+        if logger:
+            logger.debug(f"Story context bounded: {len(older)} parts summarized")
+        return self.story_context.apply(context, summary, recent)
+
+    async def initialize_story(self, context, complexity):
+        messages = self._initialize_story_messages(context, complexity)
+        data = await self.send_routed_request("init", messages)
+        return self._get_json_data(data)
+
+    async def analyze_story_parts(self, context):
+        messages = self._analyze_story_parts_messages(context)
+        data = await self.send_gpt3_request(messages)
+        return self._get_json_data(data)
+
+    async def terminate_story(self, context, complexity):
+        context = await self._bound_context(context)
+        messages = self._terminate_story_messages(context, complexity)
+        data = await self.send_routed_request("end", messages)
+        return self._get_json_data(data)
+
+    async def generate_actions(self, context, complexity, n=2):
+        context = await self._bound_context(context)
+        messages = self._generate_actions_messages(context, complexity, n)
+        data = await self.send_routed_request("actions", messages)
+        return self._get_json_data(data)
+
+    async def generate_story_part(self, context, complexity):
+        context = await self._bound_context(context)
+        messages = self._generate_story_part_messages(context, complexity)
+        data = await self.send_routed_request("story_part", messages)
+        return self._get_json_data(data)
+
+    async def _stream_json_fields(self, chunks):
+        # The chunks are closed with the events, so a consumer stopping early ends
+        # the upstream request
+        parser = JsonFieldStream(stream=("text",))
+        content = []
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                content.append(chunk)
+                for event in parser.feed(chunk):
+                    yield event
+        yield ("done", None, self._get_json_data("".join(content)))
+
+    async def stream_initialize_story(self, context, complexity):
+        messages = self._initialize_story_messages(context, complexity)
+        chunks = self.send_chat_stream_request(self.router.choose("init"), messages)
+        async with aclosing(self._stream_json_fields(chunks)) as events:
+            async for event in events:
+                yield event
+
+    async def stream_story_part(self, context, complexity):
+        context = await self._bound_context(context)
+        messages = self._generate_story_part_messages(context, complexity)
+        model = self.router.choose("story_part")
+        chunks = self.send_chat_stream_request(model, messages)
+        async with aclosing(self._stream_json_fields(chunks)) as events:
+            async for event in events:
+                yield event
+
+    async def stream_terminate_story(self, context, complexity):
+        context = await self._bound_context(context)
+        messages = self._terminate_story_messages(context, complexity)
+        chunks = self.send_chat_stream_request(self.router.choose("end"), messages)
+        async with aclosing(self._stream_json_fields(chunks)) as events:
+            async for event in events:
+                yield event
+
+    async def generate_premise(self, character, complexity, n=2):
+        messages = self._generate_premise_messages(character, complexity, n)
+        data = await self.send_routed_request("premise", messages)
+        return self._get_json_data(data)
+
+    async def generate_character(self, drawing_url, complexity):
+        drawing_url, drawing_hash = await asyncio.to_thread(
+            self.vision_images.prepare, drawing_url
+        )
+        cached = await asyncio.to_thread(
+            self._cached_character, drawing_hash, complexity
+        )
+        if cached:
+            return cached
+        messages = self._generate_character_messages(drawing_url, complexity)
+        data = await self.send_vision_request(messages)
+        result = self._get_json_data(data)
+        await asyncio.to_thread(self._store_character, drawing_hash, complexity, result)
+        return result
+
+    async def generate_story_image(self, story_part):
+        prompt = self._story_image_prompt(story_part)
+        prompt = await self._improve_prompt(
+            prompt, "image generation model to generate drawings"
+        )
+        prompt = prompt["new_prompt"]
+
+        result = await self.send_image_request(prompt)
+        return {"prompt": prompt, "image_url": result}
+
+    async def translate_text(self, text, source_language="en", target_language="en"):
+        cached = await asyncio.to_thread(
+            self.translations.get, text, source_language, target_language
+        )
+        if cached is not None:
+            return cached
+        messages = self._translate_text_messages(
+            text, source_language, target_language
+        )
+        response = await self.send_gpt3_request(messages, coalesce=True)
+        response = self._get_json_data(response)
+        data = response["translation"]
+        if not isinstance(data, str) or not data.strip():
+            raise ValueError("No translation in the response!")
+        if logger:
+            logger.debug(f"Translated text: {data}")
+        await asyncio.to_thread(
+            self.translations.put, text, source_language, target_language, data
+        )
+        return data
+
+    async def _translate_batch(self, batch, source_language, target_language):
+        messages = self._translate_batch_messages(
+            batch, source_language, target_language
+        )
+        data = await self.send_gpt3_request(messages, coalesce=True)
+        data = self._get_json_data(data)
+        missing = await asyncio.to_thread(
+            self._store_batch_translations,
+            batch,
+            data,
+            source_language,
+            target_language,
+        )
+        for text in missing:
+            try:
+                await self.translate_text(text, source_language, target_language)
+            except ValueError as e:
+                if logger:
+                    logger.error(f"Translation failed for '{text}': {e}")
+
+    async def translate_batch(self, texts, source_language="en", target_language="en"):
+        # The translation memory is SQLite backed, it is used off the event loop
+        batches = await asyncio.to_thread(
+            self._translation_batches, texts, source_language, target_language
+        )
+        await asyncio.gather(
+            *[
+                self._translate_batch(b, source_language, target_language)
+                for b in batches
+            ]
+        )
+        return await asyncio.to_thread(
+            self._batch_results, texts, source_language, target_language
+        )
+
+    async def warm_translations(self, texts, languages, source_language="en"):
+        for language in languages:
+            if language == source_language:
+                continue
+            try:
+                await self.translate_batch(texts, source_language, language)
+            except Exception as e:
+                if logger:
+                    logger.error(f"Translation warm-up failed for '{language}': {e}")
+
+    async def process_motion(self, frames):
+        if logger:
+            logger.debug(f"Processing motion...")
+        frames, tiled = await asyncio.to_thread(self._prepare_motion_frames, frames)
+        messages = self._process_motion_messages(frames, tiled)
+        data = await self.send_gpt4_request(messages)
+        return self._get_json_data(data)
+
+    # -- LLM Request Functions --
+
+    async def send_vision_request(self, request, coalesce=True):
+        if coalesce:
+            key = self._vision_key(request)
+            return await self.flights.ado(
+                key, lambda: self.send_vision_request(request, coalesce=False)
+            )
+        response = None
+        try:
+            headers = {
+                "Content-Type": "application/json",
+                **self._request_headers(),
+            }
+            payload = {
+                "model": self.vision,
+                "messages": request,
+                "max_tokens": 1024,
+            }
+            response = await self.limits.acall(
+                self.vision,
+                estimate_tokens(request, 1024),
+                lambda: self._post_checked(
+                    "https://api.openai.com/v1/chat/completions",
+                    headers=headers,
+                    json=payload,
+                ),
+            )
+            if logger:
+                logger.debug(
+                    f"Successfuly sent 'vision' LLM request with model={self.vision}"
+                )
+                logger.debug(f"Response = {response.json()}")
+
+            jresponse = response.json()
+            return jresponse["choices"][0]["message"]["content"]
+        except Exception as e:
+            if logger:
+                logger.error(str(e) + str(response))
+            raise e
+
+    async def _send_chat_request(
+        self, model, request, is_jason=True, temperature=1.0, presence_penalty=0.0
+    ):
+        response = await self.limits.acall(
+            model,
+            estimate_tokens(request, 1024),
+            lambda: self.llm.chat.completions.create(
+                model=model,
+                messages=request,
+                response_format={"type": "json_object"} if is_jason else None,
+                max_tokens=1024,
+                temperature=temperature,
+                presence_penalty=presence_penalty,
+            ),
+        )
+        jresponse = json.loads(response.model_dump_json())
+        return jresponse["choices"][0]["message"]["content"]
+
+    async def send_routed_request(self, route, request, *args, **kwargs):
+        model = self.router.choose(route)
+        send = self.send_gpt3_request if model == self.gpt3 else self.send_gpt4_request
+        if HEDGE_ENABLED and route in HEDGE_ROUTES:
+            return await self._send_hedged_request(
+                route, send, request, *args, **kwargs
+            )
+        return await send(request, *args, **kwargs)
+
+    async def _send_hedged_request(self, route, send, request, *args, **kwargs):
+        # The first response that parses wins, the other request is cancelled
+        start = time.monotonic()
+        delay = self.hedger.delay(route)
+        tasks = [asyncio.create_task(send(request, *args, **kwargs))]
+        if delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self.hedger.allow(route):
+                hedge = send(request, *args, coalesce=False, **kwargs)
+                tasks.append(asyncio.create_task(hedge))
+        result = None
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    tasks.remove(task)
+                    result = task
+                    if task.exception() is None and self._valid_response(
+                        task.result()
+                    ):
+                        self.hedger.record(route, time.monotonic() - start)
+                        return task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+        return result.result()
+
+    async def send_gpt4_request(
+        self,
+        request,
+        is_jason=True,
+        temperature=1.0,
+        presence_penalty=0.0,
+        coalesce=None,
+    ):
+        # Identical requests already in flight share one upstream call. Only
+        # deterministic ones: by default those at temperature 0, callers pass
+        # coalesce=True for requests whose answers are interchangeable.
+        if coalesce or (coalesce is None and temperature == 0):
+            key = self.flights.key(
+                "chat", self.gpt4, request, is_jason, temperature, presence_penalty
+            )
+            return await self.flights.ado(
+                key,
+                lambda: self.send_gpt4_request(
+                    request, is_jason, temperature, presence_penalty, coalesce=False
+                ),
+            )
+        start = time.monotonic()
+        try:
+            data = await self._send_chat_request(
+                self.gpt4, request, is_jason, temperature, presence_penalty
+            )
+            self.router.record(self.gpt4, time.monotonic() - start)
+            if logger:
+                logger.debug(
+                    f"Successfuly sent 'chat' LLM request with model={self.gpt4}"
+                )
+            return data
+        except Exception as e:
+            self.router.record(self.gpt4, time.monotonic() - start, ok=False)
+            if logger:
+                logger.error(e)
+            raise e
+
+    async def send_gpt3_request(
+        self,
+        request,
+        is_jason=True,
+        temperature=1.0,
+        presence_penalty=0.0,
+        coalesce=None,
+    ):
+        # Identical requests already in flight share one upstream call. Only
+        # deterministic ones: by default those at temperature 0, callers pass
+        # coalesce=True for requests whose answers are interchangeable.
+        if coalesce or (coalesce is None and temperature == 0):
+            key = self.flights.key(
+                "chat", self.gpt3, request, is_jason, temperature, presence_penalty
+            )
+            return await self.flights.ado(
+                key,
+                lambda: self.send_gpt3_request(
+                    request, is_jason, temperature, presence_penalty, coalesce=False
+                ),
+            )
+        start = time.monotonic()
+        try:
+            data = await self._send_chat_request(
+                self.gpt3, request, is_jason, temperature, presence_penalty
+            )
+            self.router.record(self.gpt3, time.monotonic() - start)
+            if logger:
+                logger.debug(
+                    f"Successfuly sent 'fast chat' LLM request with model={self.gpt3}"
+                )
+            return data
+        except Exception as e:
+            self.router.record(self.gpt3, time.monotonic() - start, ok=False)
+            if logger:
+                logger.error(e)
+            raise e
+
+    async def send_chat_stream_request(
+        self, model, request, is_jason=True, temperature=1.0, presence_penalty=0.0
+    ):
+        try:
+            response = await self.limits.acall(
+                model,
+                estimate_tokens(request, 1024),
+                lambda: self.llm.chat.completions.create(
+                    model=model,
+                    messages=request,
+                    response_format={"type": "json_object"} if is_jason else None,
+                    max_tokens=1024,
+                    temperature=temperature,
+                    presence_penalty=presence_penalty,
+                    stream=True,
+                ),
+            )
+            if logger:
+                logger.debug(
+                    f"Successfuly sent 'stream chat' LLM request with model={model}"
+                )
+            # Closing the response (also when the consumer stops early) ends the
+            # generation upstream
+            async with response:
+                async for chunk in response:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+        except Exception as e:
+            if logger:
+                logger.error(e)
+            raise e
+
+    async def send_image_request(self, request):
+        try:
+            response = await self.limits.acall(
+                self.image_gen,
+                0,
+                lambda: self.llm.images.generate(
+                    model=self.image_gen,
+                    prompt=request,
+                    size=IMAGE_GEN_RESOLUTION,
+                    quality="standard",
+                    style="natural",
+                    n=1,
+                ),
+            )
+            if logger:
+                logger.debug(
+                    f"Successfuly sent 'image' LLM request with model={self.image_gen}"
+                )
+
+            image_url = response.data[0].url
+            return image_url
+        except Exception as e:
+            if logger:
+                logger.error(e)
+            raise e
+
+    def send_tts_request(self, text, os="undetermined", response_format=None):
+        response_format = response_format or self._tts_format(os)
+        key = self.flights.key("tts", self.tts, self.voice, text, response_format)
+        return self.flights.astream(
+            key, lambda: self._stream_tts_request(text, response_format)
+        )
+
+    async def _stream_tts_request(self, text, response_format):
+        url = "https://api.openai.com/v1/audio/speech"
+        headers = self._request_headers()
+        data = {
+            "model": self.tts,
+            "input": text,
+            "voice": self.voice,
+            "response_format": response_format,
+        }
+
+        request = self.http.build_request("POST", url, headers=headers, json=data)
+        response = await self.limits.acall(
+            self.tts, 0, lambda: self._open_stream(request)
+        )
+        try:
+            self._check_tts_response(response)
+            if logger:
+                logger.debug(
+                    f"Successfuly sent 'speech' LLM request with model={self.tts}"
+                )
+            async for chunk in response.aiter_bytes(chunk_size=4096):
+                yield chunk
+        finally:
+            await response.aclose()
+
+    async def _open_stream(self, request):
+        response = await self.http.send(request, stream=True)
+        try:
+            return raise_for_retry(response)
+        except Exception:
+            await response.aclose()
+            raise
+
+    async def _post_checked(self, url, **kwargs):
+        return raise_for_retry(await self.http.post(url, **kwargs))
+
+    async def send_tts_pipelined_request(self, text, os="undetermined"):
+        sentences = split_sentences(text, TTS_PIPELINE_MIN_CHARS)
+        if not sentences:
+            return
+        semaphore = asyncio.Semaphore(max(TTS_PIPELINE_CONCURRENCY - 1, 1))
+
+        async def synthesize(sentence):
+            async with semaphore:
+                stream = self.send_tts_request(sentence, os, "mp3")
+                return b"".join([chunk async for chunk in stream])
+
+        tasks = [asyncio.create_task(synthesize(s)) for s in sentences[1:]]
+        try:
+            async for chunk in self.send_tts_request(sentences[0], os, "mp3"):
+                yield chunk
+            for task in tasks:
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def send_stt_request(self, input, translate=False):
+        with open(input, "rb") as audio_file:
+            audio_file = (os.path.basename(input), audio_file.read())
+            if translate:
+                transcript = await self.limits.acall(
+                    self.stt,
+                    0,
+                    lambda: self.llm.audio.translations.create(
+                        model=self.stt,
+                        file=audio_file,
+                        response_format="verbose_json",
+                    ),
+                )
+                if logger:
+                    logger.debug(
+                        f"Successfuly sent 'voice (translate)' LLM request with model={self.stt}"
+                    )
+            else:
+                transcript = await self.limits.acall(
+                    self.stt,
+                    0,
+                    lambda: self.llm.audio.transcriptions.create(
+                        model=self.stt,
+                        file=audio_file,
+                        language="en",
+                        prompt="This voice recording is from a presentation about reinforcement learning with robots.",
+                        response_format="json",
+                    ),
+                )
+                if logger:
+                    logger.debug(
+                        f"Successfuly sent 'voice (transcribe)' LLM request with model={self.stt}"
+                    )
+            return transcript.model_dump_json(indent=4)
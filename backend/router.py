@@ -0,0 +1,157 @@
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import logger_setup
+from config import *
+
+from dotenv import load_dotenv
+
+load_dotenv()
+LOGGER = os.environ.get("LOGGER", "False").lower() in ("true", "1", "t")
+
+if LOGGER:
+    logger = logger_setup("router", os.path.join(LOG_FOLDER, "router.log"))
+else:
+    logger = None
+
+
+class ModelRouter:
+    # Picks the chat model for each Storyteller route from recent latencies.
+    # Every route declares a quality tier (an ordered list of models, preferred
+    # first) and a latency budget in seconds. A model is degraded when its p95
+    # latency is over the budget or its error rate is over `max_error_rate`; the
+    # route then falls back to the next model of its tier. Samples expire after
+    # `max_age` seconds, so a degraded model is tried again once it goes quiet.
+    # Stats are kept per worker process.
+
+    def __init__(
+        self, routes, tiers, window, max_age, min_samples, max_error_rate
+    ) -> None:
+        self.routes = routes
+        self.tiers = tiers
+        self.window = window
+        self.max_age = max_age
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.lock = threading.Lock()
+        self.samples = {}  # model -> deque of (time, latency, ok)
+
+    def record(self, model, latency, ok=True):
+        with self.lock:
+            samples = self.samples.setdefault(model, deque(maxlen=self.window))
+            samples.append((time.monotonic(), latency, ok))
+
+    def stats(self, model):
+        # Rolling {"count", "p50", "p95", "error_rate"} of a model (None if unknown)
+        expired = time.monotonic() - self.max_age
+        with self.lock:
+            samples = self.samples.get(model, ())
+            while samples and samples[0][0] < expired:
+                samples.popleft()
+            samples = list(samples)
+        if not samples:
+            return {"count": 0, "p50": None, "p95": None, "error_rate": None}
+        latencies = sorted(latency for _, latency, _ in samples)
+        errors = sum(1 for _, _, ok in samples if not ok)
+        return {
+            "count": len(samples),
+            "p50": latencies[int(0.5 * (len(latencies) - 1))],
+            "p95": latencies[int(0.95 * (len(latencies) - 1))],
+            "error_rate": errors / len(samples),
+        }
+
+    def choose(self, route):
+        # Return the model for the route, logging why it was chosen
+        tier, budget = self.routes[route]["tier"], self.routes[route]["budget"]
+        models = self.tiers[tier]
+        if not ROUTER_ENABLED:
+            return models[0]
+
+        checked = []
+        for model in models:
+            stats = self.stats(model)
+            problem = self.__problem(stats, budget)
+            if not problem:
+                reason = "preferred" if model == models[0] else "fallback"
+                self.__log(route, model, reason, checked)
+                return model
+            checked.append(f"{model} {problem}")
+
+        # Everything is degraded: take the fastest one
+        model = min(models, key=lambda m: self.stats(m)["p95"] or 0)
+        self.__log(route, model, "all degraded, fastest", checked)
+        return model
+
+    def __problem(self, stats, budget):
+        if stats["count"] < self.min_samples:
+            return None
+        if stats["error_rate"] > self.max_error_rate:
+            return f"error rate {stats['error_rate']:.0%}"
+        if stats["p95"] > budget:
+            return f"p95 {stats['p95']:.1f}s > {budget:.1f}s"
+        return None
+
+    def __log(self, route, model, reason, checked):
+        if logger:
+            skipped = f" (skipped: {'; '.join(checked)})" if checked else ""
+            logger.info(f"Route '{route}' -> {model}: {reason}{skipped}")
+
+
+class RequestHedger:
+    # Tail-latency control for interactive routes: when a request is still running
+    # after the `percentile` latency of its route, a duplicate is sent and the first
+    # valid response wins. Hedges are capped at `max_rate` of the requests seen in
+    # the last `rate_window` seconds, so token spend only grows by that much.
+    # Latencies (of the winning response, as the user sees it) are kept per route.
+
+    def __init__(self, percentile, window, min_samples, max_rate, rate_window) -> None:
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.max_rate = max_rate
+        self.rate_window = rate_window
+        self.window = window
+        self.lock = threading.Lock()
+        self.latencies = {}  # route -> deque of latencies
+        self.requests = deque()  # request times
+        self.hedges = deque()  # hedge times
+
+    def delay(self, route):
+        # Seconds to wait before hedging, None until the route has enough samples
+        now = time.monotonic()
+        with self.lock:
+            self.__prune(now)
+            self.requests.append(now)
+            latencies = sorted(self.latencies.get(route, ()))
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies[int(self.percentile * (len(latencies) - 1))]
+
+    def record(self, route, latency):
+        with self.lock:
+            latencies = self.latencies.setdefault(route, deque(maxlen=self.window))
+            latencies.append(latency)
+
+    def allow(self, route):
+        # Whether one more hedge fits in the hedge rate cap
+        now = time.monotonic()
+        with self.lock:
+            self.__prune(now)
+            if len(self.hedges) + 1 > self.max_rate * len(self.requests):
+                allowed = False
+            else:
+                self.hedges.append(now)
+                allowed = True
+        if logger:
+            logger.info(
+                f"Hedge for '{route}' {'sent' if allowed else 'skipped (rate cap)'}"
+            )
+        return allowed
+
+    def __prune(self, now):
+        for times in (self.requests, self.hedges):
+            while times and times[0] < now - self.rate_window:
+                times.popleft()
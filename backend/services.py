@@ -0,0 +1,311 @@
+import os, sys
+import hashlib
+import json
+import multiprocessing
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import logger_setup, sample_frames
+from config import *
+from cache import AudioCache, ImageCache
+from speculation import SpeculativeStore
+from jobs import JobStore
+from idempotency import IdempotencyStore
+from sessions import SessionStore, SessionMissing
+from sessions import MemorySessionBackend, SQLiteSessionBackend
+from images import ImageMirror
+
+# Per-worker services and route helpers shared by the Flask (app.py) and the ASGI
+# (asgi.py) entry points. Each entry point builds its own Storyteller on top.
+
+load_dotenv()
+
+# Get the environment variables
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+OPENAI_ORG_ID = os.environ.get("OPENAI_ORG_ID")
+
+PORT = os.environ.get("PORT", 5000)
+
+HOST = os.environ.get("HOST", "0.0.0.0")
+DEBUG = os.environ.get("DEBUG", "False").lower() in ("true", "1", "t")
+LOGGER = os.environ.get("LOGGER", "False").lower() in ("true", "1", "t")
+STORAGE_PATH = "static"
+
+if LOGGER:
+    logger = logger_setup("app", os.path.join(LOG_FOLDER, "app.log"), debug=DEBUG)
+else:
+    logger = None
+
+
+# Initialize the generated image mirror
+image_mirror = (
+    ImageMirror(STORAGE_PATH, IMAGE_VARIANT_SIZES, IMAGE_MIRROR_WORKERS)
+    if IMAGE_MIRROR
+    else None
+)
+
+# Initialize the in-memory tier for served images
+image_cache = ImageCache(IMAGE_CACHE_SIZE, IMAGE_CACHE_MAX_ITEM)
+
+# Initialize the story image job store
+image_jobs = JobStore(IMAGE_JOB_FOLDER, IMAGE_JOB_TTL, IMAGE_JOB_WORKERS)
+
+# Initialize the session store
+sessions = SessionStore(
+    SQLiteSessionBackend(SESSION_DB, SESSION_TTL)
+    if SESSION_BACKEND == "sqlite"
+    else MemorySessionBackend(SESSION_TTL)
+)
+
+# Initialize the Idempotency-Key response store
+idempotent_requests = IdempotencyStore(
+    IDEMPOTENCY_DB, IDEMPOTENCY_TTL, IDEMPOTENCY_LEASE
+)
+
+# Initialize the speculative story part store
+speculative_parts = SpeculativeStore(SPECULATIVE_TTL)
+
+# Initialize the motion capture sampling pool (OpenCV work runs off the workers)
+# Workers come from a fork server that only imports utils: forking the threaded
+# app process itself (locks, SQLite and HTTP connections) is unsafe
+motion_context = multiprocessing.get_context("forkserver")
+motion_context.set_forkserver_preload(["utils"])
+motion_executor = ProcessPoolExecutor(
+    max_workers=MOTION_WORKERS, mp_context=motion_context
+)
+motion_slots = threading.BoundedSemaphore(MOTION_MAX_PENDING)
+
+# Initialize the TTS audio cache
+tts_cache = (
+    AudioCache(TTS_CACHE_FOLDER, TTS_CACHE_MAX_SIZE) if TTS_CACHE_ENABLED else None
+)
+
+# Texts pre-translated in the background when a worker starts
+WARMUP_TEXTS = [text for a in FIXED_ACTIONS for text in (a["title"], a["desc"])]
+
+
+def submit_motion_video(path):
+    # Sample frames from a spooled clip in the process pool.
+    # Returns a Future, or None when too many clips are already queued.
+    if not motion_slots.acquire(blocking=False):
+        return None
+    future = motion_executor.submit(
+        sample_frames,
+        path,
+        MOTION_FRAMES,
+        MOTION_FRAME_MAX_EDGE,
+        MOTION_FRAME_QUALITY,
+    )
+    future.add_done_callback(lambda _: motion_slots.release())
+    return future
+
+
+def api_description():
+    # The API and its available endpoints, served by /api
+    response = dict(
+        {
+            "prefix": "/api",
+            "endpoints": {
+                "image": {
+                    "methods": ["POST", "GET"],
+                    "description": "Save and retrieve images",
+                },
+                "character": {
+                    "methods": ["POST", "GET"],
+                    "description": "Generate and retrieve characters",
+                },
+                "session": {
+                    "methods": ["GET"],
+                    "description": "Initialize and retrieve sessions",
+                },
+                "story/premise": {
+                    "methods": ["POST"],
+                    "description": "Generate a story premise",
+                },
+                "story/part": {
+                    "methods": ["POST"],
+                    "description": "Generate a story part",
+                },
+                "story/init": {
+                    "methods": ["POST"],
+                    "description": "Initialize a story",
+                },
+                "story/end": {
+                    "methods": ["POST"],
+                    "description": "Generate the end of a story",
+                },
+                "story/part/stream": {
+                    "methods": ["POST"],
+                    "description": "Stream a story part as Server-Sent Events",
+                },
+                "story/init/stream": {
+                    "methods": ["POST"],
+                    "description": "Stream the start of a story as Server-Sent Events",
+                },
+                "story/end/stream": {
+                    "methods": ["POST"],
+                    "description": "Stream the end of a story as Server-Sent Events",
+                },
+                "story/actions": {
+                    "methods": ["POST"],
+                    "description": "Generate story actions",
+                },
+                "story/motion": {
+                    "methods": ["POST"],
+                    "description": "Process motion capture frames or a video clip",
+                },
+                "story/image": {
+                    "methods": ["POST"],
+                    "description": "Generate a story image",
+                },
+                "story/image/<job_id>": {
+                    "methods": ["GET"],
+                    "description": "Retrieve the result of a story image job",
+                },
+                "translate": {
+                    "methods": ["GET"],
+                    "description": "Translate a text",
+                },
+                "translate/batch": {
+                    "methods": ["POST"],
+                    "description": "Translate a list of texts in one request",
+                },
+                "read": {
+                    "methods": ["POST"],
+                    "description": "Read text using the API",
+                },
+            },
+        }
+    )
+    # Sort the endpoints by name
+    response["endpoints"] = dict(sorted(response["endpoints"].items()))
+    return response
+
+
+def upload_too_large(content_length, max_size):
+    # Reject an upload before parsing it when its body can't fit a `max_size`
+    # file, allowing for the boundaries and part headers of a multipart form
+    return bool(content_length) and content_length > max_size + UPLOAD_FORM_OVERHEAD
+
+
+def image_immutable(img_name):
+    # Uploaded (uuid) and mirrored (content hash) names never change content
+    return bool(
+        re.fullmatch(r"img_[0-9a-f]{32}(?:[0-9a-f]{32})?(?:_\d+)?\.\w+", img_name)
+    )
+
+
+def idempotency_key(path, header):
+    # Scope the client's Idempotency-Key to the route, None if it is invalid
+    if not header or len(header) > IDEMPOTENCY_MAX_KEY:
+        return None
+    return f"{path}:{header}"
+
+
+def idempotency_fingerprint(body):
+    # Hash of the request body, JSON is compared by value rather than by formatting
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True).encode("utf-8")
+    except ValueError:
+        pass
+    return hashlib.sha256(body).hexdigest()
+
+
+def idempotency_conflict(entry, fingerprint):
+    # (message, status) when the stored entry can't be replayed for this request
+    if entry["fingerprint"] != fingerprint:
+        return "Idempotency-Key already used for another request!", 422
+    if entry["status"] is None:
+        return "Original request still running, retry later!", 409
+    return None
+
+
+def story_image_data(result, base_url):
+    # Point clients at our own copy of the image when it has been mirrored
+    if "name" not in result:
+        return result
+    base_url = f"{base_url}api/image/"
+    return {
+        "prompt": result["prompt"],
+        "image_url": base_url + result["name"],
+        "source_url": result["image_url"],
+        "variants": {s: base_url + name for s, name in result["variants"].items()},
+    }
+
+
+def session_context(data, route):
+    # The context of a story route: what the client sent, completed from its stored
+    # session, so a client only has to send its session id and the new action
+    # Raises SessionMissing when the session is unknown or expired.
+    context = dict(data.get("context") or {})
+    if not data.get("session"):
+        return context
+    stored = sessions.context(data["session"])
+    character, premise, parts = stored["character"], stored["premise"], stored["parts"]
+    story = [part["text"] for part in parts if part.get("text")]
+    stored = {
+        "premise": character,
+        "init": {**character, **premise},
+        "part": {"premise": premise.get("desc"), "story": story},
+        "actions": {"part": parts[-1] if parts else None, "character": character},
+        "end": {"story": story},
+    }[route]
+    for key, value in stored.items():
+        if not context.get(key):
+            context[key] = value
+    return context
+
+
+def session_story(session_id, story, premise):
+    # Record a new story (with its first part) as the current one of the session
+    if session_id:
+        sessions.start_story(session_id, story["id"], premise, story["parts"][0])
+    return story
+
+
+def session_part(session_id, part, action=None, finished=False):
+    # Record a new part of the current story of the session
+    if session_id:
+        sessions.add_part(
+            session_id, {**part, "action": action} if action else part, finished
+        )
+    return part
+
+
+def story_premise(context):
+    # The premise the client picked, sent along with the character
+    return {key: context[key] for key in ("title", "desc") if key in context}
+
+
+def story_init_context(context):
+    return {
+        "setting": context["desc"],
+        "protagonist": {
+            "name": context["fullname"],
+            "about": context["backstory"],
+        },
+    }
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def speculative_contexts(session_id, actions, speculate):
+    # Story part contexts for the LLM-generated actions, within the session budget.
+    # Blocking (the budget is charged in the session store).
+    count = min(len(actions), SPECULATIVE_TURN_BUDGET)
+    count = sessions.speculate(session_id, count, SPECULATIVE_SESSION_BUDGET)
+    contexts = []
+    for action in actions[:count]:
+        action = {**action, "id": str(action["id"])}
+        context = {
+            "premise": speculate.get("premise"),
+            "action": action,
+            "story": speculate.get("story"),
+        }
+        contexts.append((action, context))
+    return contexts
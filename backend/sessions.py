@@ -0,0 +1,325 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import logger_setup
+from config import *
+
+from dotenv import load_dotenv
+
+load_dotenv()
+LOGGER = os.environ.get("LOGGER", "False").lower() in ("true", "1", "t")
+
+if LOGGER:
+    logger = logger_setup("sessions", os.path.join(LOG_FOLDER, "sessions.log"))
+else:
+    logger = None
+
+
+class SessionMissing(LookupError):
+    # A request names a session that is unknown (404) or has expired (410)
+
+    def __init__(self, session_id, expired=False) -> None:
+        self.status = 410 if expired else 404
+        super().__init__("Session expired!" if expired else "Session not found!")
+        self.session_id = session_id
+
+
+class SessionStore:
+    # Characters, premises and stories of the client sessions, so the story routes
+    # can rebuild the prompt context on the server from a session id.
+    # Documents ("session", "character", "story") and the ordered parts of each
+    # story are kept by a backend: MemorySessionBackend (per worker) or
+    # SQLiteSessionBackend (shared by all workers). Both forget what was not
+    # updated for `ttl` seconds. The drawing of a character is kept apart
+    # ("drawing"), so building a prompt context never loads it.
+
+    def __init__(self, backend) -> None:
+        self.backend = backend
+
+    def create(self):
+        session = {
+            "id": str(uuid.uuid4()),
+            "created": time.time(),
+            "character": None,
+            "premise": None,
+            "story": None,
+        }
+        self.backend.save("session", session["id"], session)
+        if logger:
+            logger.info(f"Session created: {session['id']}")
+        return session
+
+    def get(self, session_id):
+        # The session with its character and current story, None if unknown
+        session = self.backend.load("session", str(session_id or ""))
+        if not session:
+            return None
+        if session["character"]:
+            session["character"] = self.character(session["character"])
+        if session["story"]:
+            session["story"] = self.story(session["story"])
+        return session
+
+    def character(self, char_id):
+        # The character with its drawing (image.src)
+        character = self.backend.load("character", str(char_id or ""))
+        drawing = character and self.backend.load("drawing", character["id"])
+        if drawing:
+            character["image"] = {"src": drawing["src"], **character["image"]}
+        return character
+
+    def story(self, story_id):
+        story = self.backend.load("story", str(story_id or ""))
+        if story:
+            story["parts"] = self.backend.parts(story["id"])
+        return story
+
+    def context(self, session_id):
+        # What the story prompts need: {"character", "premise", "parts"}.
+        # Raises SessionMissing for an unknown or expired session.
+        session_id = str(session_id or "")
+        session = self.backend.load("session", session_id)
+        if not session:
+            raise SessionMissing(
+                session_id, self.backend.expired("session", session_id)
+            )
+        character = self.backend.load("character", session["character"] or "")
+        character = (character or {}).get("character") or {}
+        parts = self.backend.parts(session["story"]) if session["story"] else []
+        return {
+            "character": character,
+            "premise": session["premise"] or {},
+            "parts": parts,
+        }
+
+    def speculate(self, session_id, count, budget):
+        # Charge `count` speculative story parts to the session, returns how many
+        # of them are still within its `budget` (0 for unknown sessions)
+        session = self.backend.load("session", str(session_id or ""))
+        if not session:
+            return 0
+        spent = session.get("speculated", 0)
+        count = max(0, min(count, budget - spent))
+        if count:
+            session["speculated"] = spent + count
+            self.backend.save("session", session["id"], session)
+        elif logger:
+            logger.info(f"Speculation budget used up in session {session_id}")
+        return count
+
+    def put_character(self, session_id, character):
+        # `character` is the generated {"id", "image", "character"}
+        image = dict(character.get("image") or {})
+        character = {**character, "id": str(character["id"]), "image": image}
+        session = self.__session(session_id)
+        if "src" in image:
+            self.backend.save("drawing", character["id"], {"src": image.pop("src")})
+        self.backend.save(
+            "character", character["id"], {**character, "session": session["id"]}
+        )
+        session["character"] = character["id"]
+        self.backend.save("session", session["id"], session)
+
+    def start_story(self, session_id, story_id, premise, part):
+        # A new story replaces the current one of the session
+        session = self.__session(session_id)
+        story = {
+            "id": str(story_id),
+            "session": session["id"],
+            "created": time.time(),
+            "finished": False,
+        }
+        self.backend.save("story", story["id"], story)
+        self.backend.append(story["id"], {**part, "id": str(part["id"])})
+        session.update(premise=premise, story=story["id"])
+        self.backend.save("session", session["id"], session)
+        self.__touch_character(session)
+
+    def add_part(self, session_id, part, finished=False):
+        # Append a part to the current story of the session
+        session = self.backend.load("session", str(session_id or ""))
+        story = session and self.backend.load("story", session["story"] or "")
+        if not story:
+            if logger:
+                logger.warning(f"No story to add a part to in session {session_id}")
+            return
+        self.backend.append(story["id"], {**part, "id": str(part["id"])})
+        story["finished"] = story["finished"] or finished
+        self.backend.save("story", story["id"], story)
+        self.backend.save("session", session["id"], session)
+        self.__touch_character(session)
+
+    def __touch_character(self, session):
+        # The character lives as long as the session that plays it
+        if session["character"]:
+            self.backend.touch("character", session["character"])
+            self.backend.touch("drawing", session["character"])
+
+    def __session(self, session_id):
+        # Sessions minted before the store existed (or expired) are recreated
+        session_id = str(session_id)
+        session = self.backend.load("session", session_id)
+        if not session:
+            session = {
+                "id": session_id,
+                "created": time.time(),
+                "character": None,
+                "premise": None,
+                "story": None,
+            }
+        return session
+
+
+class MemorySessionBackend:
+    PURGE_INTERVAL = 60  # seconds
+
+    def __init__(self, ttl) -> None:
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.documents = {}  # (kind, key) -> (updated, document)
+        self.story_parts = {}  # story id -> [part, ...]
+        self.purged = time.monotonic()
+
+    def load(self, kind, key):
+        with self.lock:
+            entry = self.documents.get((kind, key))
+        if not entry or entry[0] < time.time() - self.ttl:
+            return None
+        return json.loads(entry[1])
+
+    def save(self, kind, key, document):
+        # Documents are copied as JSON, like the SQLite backend does
+        document = json.dumps(document)
+        with self.lock:
+            self.documents[(kind, key)] = (time.time(), document)
+            self.__purge()
+
+    def touch(self, kind, key):
+        # Restart the TTL of a document without rewriting it
+        with self.lock:
+            entry = self.documents.get((kind, key))
+            if entry and entry[0] >= time.time() - self.ttl:
+                self.documents[(kind, key)] = (time.time(), entry[1])
+
+    def expired(self, kind, key):
+        # True for a document that existed but expired (until it is purged)
+        with self.lock:
+            entry = self.documents.get((kind, key))
+        return bool(entry) and entry[0] < time.time() - self.ttl
+
+    def append(self, story_id, part):
+        part = json.dumps(part)
+        with self.lock:
+            self.story_parts.setdefault(story_id, []).append(part)
+
+    def parts(self, story_id):
+        with self.lock:
+            parts = list(self.story_parts.get(story_id, ()))
+        return [json.loads(part) for part in parts]
+
+    def __purge(self):
+        if time.monotonic() - self.purged < self.PURGE_INTERVAL:
+            return
+        self.purged = time.monotonic()
+        expired = time.time() - self.ttl
+        for key, (updated, _) in list(self.documents.items()):
+            if updated < expired:
+                del self.documents[key]
+        for story_id in list(self.story_parts):
+            if ("story", story_id) not in self.documents:
+                del self.story_parts[story_id]
+
+
+class SQLiteSessionBackend:
+    PURGE_INTERVAL = 60  # seconds
+
+    def __init__(self, path, ttl) -> None:
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.purged = time.monotonic()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(
+            path, timeout=5, check_same_thread=False, isolation_level=None
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS documents (kind TEXT, key TEXT, "
+            "document TEXT, updated REAL, PRIMARY KEY (kind, key))"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS parts (seq INTEGER PRIMARY KEY, "
+            "story TEXT, part TEXT)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS parts_story ON parts (story, seq)")
+
+    def load(self, kind, key):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT document FROM documents "
+                "WHERE kind = ? AND key = ? AND updated >= ?",
+                (kind, key, time.time() - self.ttl),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, kind, key, document):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)",
+                (kind, key, json.dumps(document), time.time()),
+            )
+            self.__purge()
+
+    def touch(self, kind, key):
+        # Restart the TTL of a document without rewriting it
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "UPDATE documents SET updated = ? "
+                "WHERE kind = ? AND key = ? AND updated >= ?",
+                (now, kind, key, now - self.ttl),
+            )
+
+    def expired(self, kind, key):
+        # True for a document that existed but expired (until it is purged)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT 1 FROM documents WHERE kind = ? AND key = ? AND updated < ?",
+                (kind, key, time.time() - self.ttl),
+            ).fetchone()
+        return row is not None
+
+    def append(self, story_id, part):
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO parts (story, part) VALUES (?, ?)",
+                (story_id, json.dumps(part)),
+            )
+
+    def parts(self, story_id):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT part FROM parts WHERE story = ? ORDER BY seq", (story_id,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def __purge(self):
+        if time.monotonic() - self.purged < self.PURGE_INTERVAL:
+            return
+        self.purged = time.monotonic()
+        try:
+            self.db.execute(
+                "DELETE FROM documents WHERE updated < ?", (time.time() - self.ttl,)
+            )
+            self.db.execute(
+                "DELETE FROM parts WHERE story NOT IN "
+                "(SELECT key FROM documents WHERE kind = 'story')"
+            )
+        except sqlite3.Error as e:
+            if logger:
+                logger.error(f"Session purge failed: {e}")
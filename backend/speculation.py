@@ -0,0 +1,114 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import CancelledError
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import logger_setup
+from config import *
+
+from dotenv import load_dotenv
+
+load_dotenv()
+LOGGER = os.environ.get("LOGGER", "False").lower() in ("true", "1", "t")
+
+if LOGGER:
+    logger = logger_setup("speculation", os.path.join(LOG_FOLDER, "speculation.log"))
+else:
+    logger = None
+
+
+class SpeculativeJob:
+    # A speculative branch run by a thread pool. Future.cancel() can't stop a call
+    # that already runs, so the branch consumes a streamed generation and closes
+    # it (ending the upstream request) as soon as cancel() is called.
+    # `stream` returns the ("delta" | "field" | "done", key, value) events of a
+    # streaming Storyteller function, the job result is the "done" value.
+
+    def __init__(self, executor, stream) -> None:
+        self.cancelled = threading.Event()
+        self.future = executor.submit(self.__run, stream)
+
+    def cancel(self):
+        self.cancelled.set()
+        return self.future.cancel()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+    def __run(self, stream):
+        events = stream()
+        try:
+            for kind, _, value in events:
+                if self.cancelled.is_set():
+                    raise CancelledError()
+                if kind == "done":
+                    return value
+        finally:
+            events.close()
+        return None
+
+
+class SpeculativeStore:
+    # Short-lived store of speculative story part jobs, keyed by session and action id.
+    # A job is anything with cancel() (concurrent.futures.Future or asyncio.Task),
+    # so the same store serves the Flask and the ASGI app.
+
+    def __init__(self, ttl) -> None:
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.sessions = {}  # session -> {action id: (expires, action, job)}
+
+    def put(self, session, action, job):
+        with self.lock:
+            self.__purge()
+            jobs = self.sessions.setdefault(str(session), {})
+            jobs[str(action["id"])] = (time.monotonic() + self.ttl, action, job)
+        if logger:
+            logger.debug(f"Speculating on '{action['title']}' for session {session}")
+
+    def take(self, session, action):
+        # Return the job for the chosen action (if it matches) and drop the losers,
+        # all of them when the chosen action is not an offered one (motion, text)
+        if not session:
+            return None
+        with self.lock:
+            self.__purge()
+            jobs = self.sessions.pop(str(session), {})
+        entry = None
+        if action and "id" in action:
+            entry = jobs.pop(str(action["id"]), None)
+        for _, _, job in jobs.values():
+            job.cancel()
+        if not entry:
+            return None
+        _, expected, job = entry
+        if (expected["title"], expected["desc"]) != (
+            action.get("title"),
+            action.get("desc"),
+        ):
+            job.cancel()
+            return None
+        if logger:
+            logger.debug(
+                f"Speculation hit on '{action['title']}' for session {session}"
+            )
+        return job
+
+    def discard(self, session):
+        if not session:
+            return
+        with self.lock:
+            jobs = self.sessions.pop(str(session), {})
+        for _, _, job in jobs.values():
+            job.cancel()
+
+    def __purge(self):
+        now = time.monotonic()
+        for session in list(self.sessions):
+            jobs = self.sessions[session]
+            for action_id in [a for a, (exp, _, _) in jobs.items() if exp < now]:
+                jobs.pop(action_id)[2].cancel()
+            if not jobs:
+                del self.sessions[session]
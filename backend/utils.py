@@ -3,7 +3,14 @@ import os
 from PIL import Image
 from io import BytesIO
 import logging
+import math
+import re
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
 import cv2
+import numpy as np
 
 
 def base64_encode_file(image_path):
@@ -25,6 +32,72 @@ def save_base64_image(base64_string, save_path):
     image = Image.open(BytesIO(image_data))
     image.save(save_path)
 
+# Magic bytes of the accepted upload types
+IMAGE_SIGNATURES = {
+    b"\xff\xd8\xff": "jpg",
+    b"\x89PNG\r\n\x1a\n": "png",
+}
+
+
+def sniff_image_type(head):
+    # Detect the image type from the first bytes of the file
+    for signature, ext in IMAGE_SIGNATURES.items():
+        if head.startswith(signature):
+            return ext
+    return None
+
+
+def save_image_stream(stream, folder, max_size, chunk_size=64 * 1024):
+    # Write an uploaded image to disk in chunks, without decoding it.
+    # Returns the file name, raises ValueError for unknown types or oversized files.
+    head = b""
+    while len(head) < 16:
+        chunk = stream.read(16 - len(head))
+        if not chunk:
+            break
+        head += chunk
+    ext = sniff_image_type(head)
+    if not ext:
+        raise ValueError("Invalid image type!")
+
+    name = f"img_{uuid.uuid4().hex}.{ext}"
+    path = os.path.join(folder, name)
+    tmp_path = f"{path}.part"
+    size = len(head)
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(head)
+            while chunk := stream.read(chunk_size):
+                size += len(chunk)
+                if size > max_size:
+                    raise ValueError("Image too large!")
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return name
+
+def save_video_stream(stream, max_size, chunk_size=64 * 1024):
+    # Spool an uploaded video to a temp file (sample_frames needs a path).
+    # Returns the path, the caller removes the file. Raises ValueError when too large.
+    fd, path = tempfile.mkstemp(suffix=".video")
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while chunk := stream.read(chunk_size):
+                size += len(chunk)
+                if size > max_size:
+                    raise ValueError("Video too large!")
+                f.write(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    if not size:
+        os.remove(path)
+        raise ValueError("No video found!")
+    return path
+
 def logger_setup(name, location, debug=False):
     os.makedirs(os.path.dirname(location), exist_ok=True)
 
@@ -46,39 +119,286 @@ def get_mimetype(os):
         mime_type = "audio/mpeg"
     return mime_type
 
-def sample_frames(video_blob, n_frames=10):
-    # Initialize video capture from the video blob
-    video = cv2.VideoCapture(video_blob)
-    
-    # Get the total number of frames in the video
-    total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
-    
-    # Calculate the interval between frames to sample
-    interval = max(total_frames // n_frames, 1)
-    
-    sampled_frames = []
-    
-    for i in range(0, total_frames, interval):
-        # Set the video position to the i-th frame
-        video.set(cv2.CAP_PROP_POS_FRAMES, i)
-        
-        # Read the frame
-        ret, frame = video.read()
-        
-        if not ret:
+def split_sentences(text, min_chars=0):
+    # Split text into sentences, merging short ones so each chunk has min_chars.
+    # Only whitespace after a sentence end splits, so "3.50" or "e.g.," stay whole.
+    sentences = re.split(r"(?:(?<=[.!?\u2026])|(?<=[.!?\u2026][\"')\]]))\s+", text)
+    sentences = [s.strip() for s in sentences if s.strip()]
+    chunks = []
+    current = ""
+    for sentence in sentences:
+        current = f"{current} {sentence}" if current else sentence
+        if len(current) >= min_chars:
+            chunks.append(current)
+            current = ""
+    if current:
+        if chunks and len(current) < min_chars:
+            chunks[-1] = f"{chunks[-1]} {current}"
+        else:
+            chunks.append(current)
+    return chunks
+
+@contextmanager
+def video_path(source):
+    # OpenCV can only open videos by path, so bytes and streams go to a temp file
+    if isinstance(source, (str, os.PathLike)):
+        yield os.fspath(source)
+        return
+    fd, path = tempfile.mkstemp(suffix=".video")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                f.write(source)
+            else:
+                shutil.copyfileobj(source, f, 64 * 1024)
+        yield path
+    finally:
+        os.remove(path)
+
+
+def sample_frames(source, n_frames=10, max_edge=None, quality=95):
+    # Sample n_frames evenly spaced frames as base64 JPEGs, downscaled to max_edge.
+    # Clips are decoded in a single forward pass: seeking to each sample decodes
+    # from the previous keyframe, which phone clips (1-2 s GOPs) only have every
+    # 30-60 frames. Clips without a frame count (e.g. webm) are counted while
+    # being sampled.
+    # source can be a path, bytes or a binary file object.
+    with video_path(source) as path:
+        video = cv2.VideoCapture(path)
+        try:
+            total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+            if total_frames <= 0:
+                frames = read_frames_unknown_length(video, n_frames, max_edge)
+            else:
+                interval = max(total_frames // n_frames, 1)
+                targets = list(range(0, total_frames, interval))[:n_frames]
+                frames = read_frames_forward(video, targets, max_edge)
+        finally:
+            video.release()
+    return [encode_frame(frame, quality) for frame in frames]
+
+
+def read_frames_forward(video, targets, max_edge=None):
+    # Grab every frame up to the last target, only the targets are retrieved
+    targets = set(targets)
+    last = max(targets, default=-1)
+    frames = []
+    for i in range(last + 1):
+        if not video.grab():
             break
-        
-        # Encode the frame to base64
-        _, buffer = cv2.imencode('.jpg', frame)
-        frame_base64 = base64.b64encode(buffer).decode('utf-8')
-        
-        sampled_frames.append(frame_base64)
-        
-        # Stop if we have sampled enough frames
-        if len(sampled_frames) >= n_frames:
+        if i not in targets:
+            continue
+        ret, frame = video.retrieve()
+        if not ret:
             break
-    
-    # Release the video capture object
-    video.release()
-    
-    return sampled_frames
\ No newline at end of file
+        frames.append(resize_frame(frame, max_edge))
+    return frames
+
+
+def read_frames_unknown_length(video, n_frames, max_edge=None):
+    # Keep every step-th frame, doubling the step (and dropping every other kept
+    # frame) when more than 2 * n_frames are kept, then pick n_frames evenly
+    kept = []
+    step = 1
+    i = 0
+    while video.grab():
+        if i % step == 0:
+            ret, frame = video.retrieve()
+            if not ret:
+                break
+            kept.append(resize_frame(frame, max_edge))
+            if len(kept) > 2 * n_frames:
+                kept = kept[::2]
+                step *= 2
+        i += 1
+    interval = max(len(kept) // n_frames, 1)
+    return kept[::interval][:n_frames]
+
+
+def resize_frame(frame, max_edge=None):
+    height, width = frame.shape[:2]
+    if max_edge and max(height, width) > max_edge:
+        scale = max_edge / max(height, width)
+        size = (max(round(width * scale), 1), max(round(height * scale), 1))
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    return frame
+
+
+def encode_frame(frame, quality=95):
+    _, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return base64.b64encode(buffer).decode("utf-8")
+
+
+def frame_motion(frames, size=64):
+    # Motion of each frame relative to the previous one (0 for the first), as the
+    # mean absolute difference of downscaled grayscale frames (0-255).
+    # frames are base64 JPEGs or data URLs.
+    gray = []
+    for frame in frames:
+        data = np.frombuffer(base64.b64decode(frame.split(",", 1)[-1]), np.uint8)
+        image = cv2.imdecode(data, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+        if image is None:
+            raise ValueError("Invalid frame!")
+        gray.append(cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA))
+    stack = np.stack(gray).astype(np.int16)
+    motion = np.abs(np.diff(stack, axis=0)).mean(axis=(1, 2))
+    return np.concatenate(([0.0], motion))
+
+
+def select_keyframes(frames, k, threshold):
+    # Keep the first and last frames and up to k - 2 frames in between with the
+    # most motion; frames moving less than threshold are never picked.
+    # Returns the kept frames in their original order.
+    if len(frames) <= 2:
+        return list(frames)
+    motion = frame_motion(frames)[1:-1]
+    candidates = np.flatnonzero(motion >= threshold)
+    order = np.argsort(-motion[candidates], kind="stable")
+    keep = candidates[order[: max(k - 2, 0)]] + 1
+    indices = [0, *np.sort(keep).tolist(), len(frames) - 1]
+    return [frames[i] for i in indices]
+
+
+def contact_sheet(frames, columns, width, quality=85):
+    # Tile frames in order (left to right, top to bottom) into one JPEG data URL,
+    # with the frame number burned into the corner of each tile
+    images = []
+    for frame in frames:
+        data = np.frombuffer(base64.b64decode(frame.split(",", 1)[-1]), np.uint8)
+        image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Invalid frame!")
+        images.append(image)
+
+    columns = min(columns, len(images))
+    rows = math.ceil(len(images) / columns)
+    height, frame_width = images[0].shape[:2]
+    tile_width = width // columns
+    tile_height = max(round(tile_width * height / frame_width), 1)
+    sheet = np.zeros((rows * tile_height, columns * tile_width, 3), np.uint8)
+    scale = tile_height / 200
+    for i, image in enumerate(images):
+        tile = cv2.resize(
+            image, (tile_width, tile_height), interpolation=cv2.INTER_AREA
+        )
+        origin = (max(round(8 * scale), 2), max(round(40 * scale), 12))
+        for color, thickness in (((0, 0, 0), 6), ((255, 255, 255), 2)):
+            cv2.putText(
+                tile,
+                str(i + 1),
+                origin,
+                cv2.FONT_HERSHEY_SIMPLEX,
+                max(scale, 0.4),
+                color,
+                max(round(thickness * scale), 1),
+                cv2.LINE_AA,
+            )
+        row, col = divmod(i, columns)
+        sheet[
+            row * tile_height : (row + 1) * tile_height,
+            col * tile_width : (col + 1) * tile_width,
+        ] = tile
+
+    _, buffer = cv2.imencode(".jpg", sheet, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return f"data:image/jpeg;base64,{base64.b64encode(buffer).decode('utf-8')}"
+
+
+class JsonFieldStream:
+    # Incremental parser for a JSON object that arrives in chunks (e.g. a streamed
+    # LLM completion). feed() returns events as soon as they can be decided:
+    #   ("delta", key, chars) - new characters of a string value listed in `stream`
+    #   ("field", key, value) - a string value that just closed
+    # Keys are matched at any depth, so {"part": {"text": ...}} works as well.
+
+    ESCAPES = {
+        '"': '"',
+        "\\": "\\",
+        "/": "/",
+        "b": "\b",
+        "f": "\f",
+        "n": "\n",
+        "r": "\r",
+        "t": "\t",
+    }
+
+    def __init__(self, stream=("text",)) -> None:
+        self.stream = set(stream)
+        self.started = False
+        self.stack = []  # open containers, "{" or "["
+        self.expect_key = False
+        self.key = None
+        self.in_string = False
+        self.is_key = False
+        self.escape = None  # None, "" (after backslash) or the \u digits so far
+        self.buffer = []
+
+    def feed(self, chunk):
+        events = []
+        delta = []
+        for char in chunk:
+            if not self.started:
+                # Skip anything before the object, e.g. a ```json fence
+                if char == "{":
+                    self.started = True
+                    self.stack.append("{")
+                    self.expect_key = True
+                continue
+            if self.in_string:
+                decoded = self.__read_string_char(char)
+                if decoded is None:
+                    continue
+                if decoded is False:
+                    # End of string
+                    value = "".join(self.buffer)
+                    self.in_string = False
+                    if self.is_key:
+                        self.key = value
+                    else:
+                        if delta:
+                            events.append(("delta", self.key, "".join(delta)))
+                            delta = []
+                        events.append(("field", self.key, value))
+                    continue
+                self.buffer.append(decoded)
+                if not self.is_key and self.key in self.stream:
+                    delta.append(decoded)
+            elif char == '"':
+                self.in_string = True
+                self.is_key = self.expect_key and self.stack[-1] == "{"
+                self.buffer = []
+            elif char in "{[":
+                self.stack.append(char)
+                self.expect_key = char == "{"
+            elif char in "}]":
+                if self.stack:
+                    self.stack.pop()
+                self.expect_key = False
+            elif char == ",":
+                self.expect_key = bool(self.stack) and self.stack[-1] == "{"
+            elif char == ":":
+                self.expect_key = False
+        if delta:
+            events.append(("delta", self.key, "".join(delta)))
+        return events
+
+    def __read_string_char(self, char):
+        # Returns the decoded character, None if more input is needed, False on close
+        if self.escape is None:
+            if char == "\\":
+                self.escape = ""
+                return None
+            if char == '"':
+                return False
+            return char
+        if self.escape == "" and char != "u":
+            self.escape = None
+            return self.ESCAPES.get(char, char)
+        self.escape += char
+        if len(self.escape) < 5:
+            return None
+        code = self.escape[1:]
+        self.escape = None
+        try:
+            return chr(int(code, 16))
+        except ValueError:
+            return ""